@@ -30,6 +30,9 @@ from handlers.extended_handlers import (
     free_command,
     code_command,
     handle_email_download,    
+    handle_list_page,
+    export_emails_command,
+    import_users_document,
     UserManager
 )
 from handlers.user_handlers import start, handle_menu_selection
@@ -43,14 +46,17 @@ from handlers.email_search_handlers import (
     handle_max_menu,
     email_service
 )
-from handlers.imap_manager import IMAPConnectionPool
+from handlers.imap_manager import IMAPConnectionPool, imap_config_resolver
+from handlers.async_imap import async_imap_pool
+from handlers.mailbox_ingestion import mailbox_ingestion
 
 # Import utilities
 from utils.permission_manager import PermissionManager
 from utils.permission_middleware import check_user_permission, check_callback_permission
 from utils.logger_utility import bot_logger
 from utils.notifications import AdminNotifier
-from database.connection import execute_query
+from utils.update_processor import PerUserUpdateProcessor
+from database.async_db import db
 
 # Silenciar logs no deseados
 logging.getLogger('httpx').setLevel(logging.WARNING)
@@ -92,14 +98,14 @@ async def addimap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         bot_token = context.bot.token
         
         # Verificar si ya existe una configuración para este dominio
-        existing = execute_query("""
+        existing = await db.fetch("""
         SELECT id FROM imap_config
         WHERE domain = %s AND bot_token = %s
         """, (domain, bot_token))
         
         if existing:
             # Actualizar configuración existente
-            execute_query("""
+            await db.execute("""
             UPDATE imap_config
             SET email = %s, password = %s, imap_server = %s
             WHERE domain = %s AND bot_token = %s
@@ -110,7 +116,7 @@ async def addimap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         else:
             # Insertar nueva configuración
-            execute_query("""
+            await db.execute("""
             INSERT INTO imap_config (domain, email, password, imap_server, bot_token)
             VALUES (%s, %s, %s, %s, %s)
             """, (domain, email, password, server, bot_token))
@@ -119,6 +125,9 @@ async def addimap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"✅ Nueva configuración IMAP agregada para el dominio {domain}"
             )
         
+        # Las búsquedas leen imap_config desde el índice en memoria
+        imap_config_resolver.invalidate(bot_token)
+        
     except Exception as e:
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
@@ -128,6 +137,13 @@ class EmailBot:
         self.application = None
         self.imap_pool = IMAPConnectionPool()
         self.permission_manager = PermissionManager()
+        # Updates de distintos usuarios en paralelo, los de cada usuario en orden
+        self.update_processor = PerUserUpdateProcessor()
+        # En run_multi_bot varios bots comparten el proceso: los recursos
+        # globales (pool IMAP asíncrono) los cierra el runner, no cada bot
+        self.shared_runtime = False
+        # Servidor de webhooks si el bot recibe updates por webhook (None = polling)
+        self.webhook = None
 
     async def post_init(self, application):
         """Hook que se ejecuta asíncronamente luego de inicializar la aplicación"""
@@ -145,6 +161,7 @@ class EmailBot:
                 BotCommand("eliminar", "Elimina correos de un usuario. Uso: <user_id> <email1> [email2...]"),
                 BotCommand("garantia", "Reemplaza un correo por otro. Uso: <user_id> <old_email> <new_email>"),
                 BotCommand("list", "Lista los usuarios"),
+                BotCommand("exportemails", "Exporta los correos en CSV. Uso: [reseller_id]"),
                 BotCommand("addemail", "Añadir correos a un usuario específico"),
                 BotCommand("addimap", "Añade configuración IMAP. Uso: <domain> <email> <password> <server>"),
                 BotCommand("free", "Da acceso libre a un usuario. Uso: <user_id>"),
@@ -172,6 +189,21 @@ class EmailBot:
         except Exception as e:
             bot_logger.log_error(f"❌ Excepción inesperada en post_init para bot {token_short}: {e}")
         
+        # Worker de ingesta IMAP (IDLE) para el índice local de códigos, si está habilitado
+        try:
+            await mailbox_ingestion.start(self.token)
+        except Exception as e:
+            bot_logger.log_error(f"❌ Error iniciando la ingesta IMAP para bot {token_short}: {e}")
+        
+    async def post_shutdown(self, application):
+        """Hook que se ejecuta al detener la aplicación: cierra los clientes IMAP asíncronos"""
+        try:
+            await mailbox_ingestion.stop(self.token)
+            if not self.shared_runtime:
+                await async_imap_pool.close_all()
+        except Exception as e:
+            bot_logger.log_error(f"Error cerrando conexiones IMAP asíncronas: {e}")
+        
     def setup(self):
         if not self.token:
             raise ValueError("Token not provided")
@@ -189,7 +221,11 @@ class EmailBot:
             
         # Initialize application with custom request timeouts
         request = HTTPXRequest(connect_timeout=30.0, read_timeout=30.0, write_timeout=30.0)
-        application = ApplicationBuilder().token(self.token).request(request).post_init(self.post_init).build()
+        application = (
+            ApplicationBuilder().token(self.token).request(request)
+            .concurrent_updates(self.update_processor)
+            .post_init(self.post_init).post_shutdown(self.post_shutdown).build()
+        )
         
         # Guardar token y super admin id en el contexto del bot
         application.bot_data["token"] = self.token
@@ -218,6 +254,7 @@ class EmailBot:
             CommandHandler('eliminar', eliminar_command),
             CommandHandler('garantia', garantia_command),
             CommandHandler('list', list_command),
+            CommandHandler('exportemails', export_emails_command),
             CommandHandler('addemail', addemail_command),
         ]
         
@@ -271,12 +308,22 @@ class EmailBot:
             CallbackQueryHandler(
                 check_callback_permission(handle_email_download),
                 pattern=r'^download_emails_\d+$'
+            ),
+            CallbackQueryHandler(
+                check_callback_permission(handle_list_page),
+                pattern=r'^list_[np]_\d+$'
             )
         ]
         
         for handler in callback_handlers:
             application.add_handler(handler)
         
+        # CSV documents for bulk user import (admins and resellers)
+        application.add_handler(MessageHandler(
+            filters.Document.FileExtension("csv") | filters.Document.MimeType("text/csv"),
+            import_users_document
+        ))
+        
         # Add message handler for email input with permission check
         application.add_handler(MessageHandler(
             filters.TEXT & ~filters.COMMAND,
@@ -0,0 +1,75 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+
+from database.connection import execute_query, execute_values_query, transaction
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Executor dedicado para las consultas a Postgres lanzadas desde handlers.
+# Configurable vía env var DB_EXECUTOR_WORKERS (default=DB_POOL_MAX o 20).
+# Separado del executor por defecto para que las búsquedas IMAP largas no
+# dejen sin hilos a las consultas cortas, y acotado al tamaño del pool de
+# conexiones para que la espera ocurra en la cola del executor.
+# ---------------------------------------------------------------------------
+_DB_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get("DB_EXECUTOR_WORKERS", os.environ.get("DB_POOL_MAX", "20"))),
+    thread_name_prefix="db"
+)
+
+
+class AsyncDatabase:
+    """
+    API asíncrona de acceso a datos para los handlers.
+
+    Cada llamada ejecuta execute_query en el executor de base de datos, de
+    modo que una consulta lenta no congela el event loop del bot. El
+    execute_query síncrono queda para el código que ya corre en hilos.
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+
+    async def run(self, func, *args, **kwargs):
+        """Ejecuta una función síncrona que accede a la BD (p. ej. métodos de los managers)."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def fetch(self, query, params=None):
+        """Devuelve todas las filas de la consulta (lista vacía si no hay)."""
+        return await self.run(execute_query, query, params) or []
+
+    async def fetchone(self, query, params=None):
+        """Devuelve la primera fila o None."""
+        rows = await self.fetch(query, params)
+        return rows[0] if rows else None
+
+    async def fetchval(self, query, params=None):
+        """Devuelve la primera columna de la primera fila o None."""
+        row = await self.fetchone(query, params)
+        return row[0] if row else None
+
+    async def execute(self, query, params=None):
+        """Ejecuta una sentencia de escritura; devuelve las filas de RETURNING si las hay."""
+        return await self.run(execute_query, query, params)
+
+    async def execute_values(self, query, rows, template=None, page_size=1000, fetch=False):
+        """Inserción masiva en una sola transacción (ver execute_values_query)."""
+        return await self.run(execute_values_query, query, rows, template, page_size, fetch)
+
+    async def run_in_transaction(self, func, *args, **kwargs):
+        """Ejecuta func(tx, *args) dentro de transaction(): un solo commit para todo."""
+        def _run():
+            with transaction() as tx:
+                return func(tx, *args, **kwargs)
+        return await self.run(_run)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+# Instancia global para los handlers
+db = AsyncDatabase(_DB_EXECUTOR)
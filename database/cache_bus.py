@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import queue
+import select
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+from config import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache_invalidation"
+
+
+class CacheInvalidationBus:
+    """
+    Invalidación de cachés en memoria entre procesos vía LISTEN/NOTIFY.
+
+    Cada proceso de bot mantiene cachés propias (autorización, imap_config)
+    sobre la misma base de datos. Al invalidar localmente se publica un
+    evento {"cache", "bot_token", "user_id"} y el hilo oyente de los demás
+    procesos aplica la misma invalidación. Un único hilo con una conexión
+    dedicada en autocommit publica y escucha; los eventos propios se
+    descartan comparando el PID del backend. Si la conexión se pierde se
+    vacían todas las cachés al reconectar, porque pudieron perderse eventos.
+    """
+
+    def __init__(self):
+        self.enabled = os.environ.get("CACHE_BUS", "1") == "1"
+        self._handlers = {}            # cache -> callback(bot_token, user_id)
+        self._outbox = queue.Queue()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {'published': 0, 'received': 0, 'reconnects': 0}
+
+    def subscribe(self, cache, callback):
+        """Registra la función que invalida localmente la caché indicada."""
+        self._handlers[cache] = callback
+
+    def publish(self, cache, bot_token=None, user_id=None):
+        """Encola un evento de invalidación para el resto de procesos (no bloquea)."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._outbox.put(json.dumps({'cache': cache, 'bot_token': bot_token, 'user_id': user_id}))
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-bus", daemon=True)
+        self._thread.start()
+        logger.info(f"Bus de invalidación de cachés iniciado (canal {CHANNEL})")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def get_stats(self):
+        return dict(self._stats)
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, database=DB_NAME
+        )
+        conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        return conn
+
+    def _run(self):
+        backoff = 1
+        first = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                own_pid = conn.get_backend_pid()
+                if not first:
+                    # Durante la desconexión pudieron perderse eventos: vaciar todo
+                    self._stats['reconnects'] += 1
+                    self._dispatch_all()
+                first = False
+                backoff = 1
+                while not self._stop.is_set():
+                    self._flush_outbox(conn)
+                    if select.select([conn], [], [], 0.5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        if notify.pid != own_pid:
+                            self._dispatch(notify.payload)
+            except Exception as e:
+                logger.warning(f"Bus de invalidación desconectado, reintentando en {backoff}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _flush_outbox(self, conn):
+        while True:
+            try:
+                payload = self._outbox.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+            except Exception:
+                # Se reenviará tras reconectar
+                self._outbox.put(payload)
+                raise
+            self._stats['published'] += 1
+
+    def _dispatch(self, payload):
+        try:
+            event = json.loads(payload)
+            callback = self._handlers.get(event.get('cache'))
+            if callback:
+                self._stats['received'] += 1
+                callback(event.get('bot_token'), event.get('user_id'))
+        except Exception as e:
+            logger.error(f"Error procesando evento de invalidación {payload!r}: {e}")
+
+    def _dispatch_all(self):
+        for cache, callback in self._handlers.items():
+            try:
+                callback(None, None)
+            except Exception as e:
+                logger.error(f"Error vaciando la caché {cache}: {e}")
+
+
+# Instancia global del bus de invalidación
+cache_bus = CacheInvalidationBus()
@@ -1,6 +1,11 @@
 import psycopg2
-from psycopg2 import pool
+from psycopg2 import pool, extensions, extras
 import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
 from config import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME
 
 # Configurar logging
@@ -9,12 +14,253 @@ logger = logging.getLogger(__name__)
 # Crear un pool de conexiones para mejorar el rendimiento con múltiples bots
 connection_pool = None
 
-def init_db():
-    """Inicializa el pool de conexiones a la base de datos"""
+# Consultas más lentas que este umbral se registran como warning
+SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", "500"))
+# Máximo de consultas distintas con métricas propias
+_MAX_TRACKED_QUERIES = 200
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+class PoolTimeoutError(pool.PoolError):
+    """No se liberó ninguna conexión dentro del tiempo de espera del pool."""
+
+
+class ThreadSafeConnectionPool:
+    """
+    Pool de conexiones psycopg2 seguro entre hilos.
+
+    execute_query se usa tanto desde el event loop como desde hilos del
+    executor, así que el préstamo se protege con una Condition: si están
+    todas las conexiones en uso se espera (hasta DB_POOL_TIMEOUT) en lugar
+    de fallar. Las conexiones inactivas se verifican con un SELECT 1 antes
+    de prestarse y se reciclan al superar DB_POOL_RECYCLE segundos de vida.
+    """
+
+    def __init__(self, minconn, maxconn, **kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._kwargs = kwargs
+        self._timeout = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+        self._recycle = float(os.environ.get("DB_POOL_RECYCLE", "1800"))
+        self._preping_idle = float(os.environ.get("DB_POOL_PREPING_IDLE", "30"))
+        self._cond = threading.Condition()
+        self._idle = []          # [(conn, devuelta_en)] LIFO: se reutiliza la más reciente
+        self._in_use = set()     # id(conn) de las conexiones prestadas
+        self._created_at = {}    # id(conn) -> momento de creación
+        self._opened = 0         # conexiones abiertas o en apertura (prestadas + libres)
+        self._closed = False
+        self._metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_ms_total': 0.0,
+            'wait_ms_max': 0.0,
+            'created': 0,
+            'recycled': 0,
+            'ping_failures': 0,
+            'discarded': 0,
+        }
+        for _ in range(minconn):
+            conn = self._new_connection()
+            self._opened += 1
+            self._idle.append((conn, time.time()))
+
+    def _new_connection(self):
+        conn = psycopg2.connect(**self._kwargs)
+        with self._cond:
+            self._created_at[id(conn)] = time.time()
+            self._metrics['created'] += 1
+        return conn
+
+    def _count(self, name, amount=1):
+        with self._cond:
+            self._metrics[name] += amount
+
+    def _discard(self, conn):
+        """Cierra una conexión y libera su hueco para otro hilo."""
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._opened -= 1
+            self._created_at.pop(id(conn), None)
+            self._in_use.discard(id(conn))
+            self._metrics['discarded'] += 1
+            self._cond.notify()
+
+    def _is_usable(self, conn, idle_since):
+        """Comprueba una conexión libre antes de prestarla (reciclado y pre-ping)."""
+        if conn.closed:
+            return False
+        now = time.time()
+        if now - self._created_at.get(id(conn), now) > self._recycle:
+            self._count('recycled')
+            return False
+        if now - idle_since > self._preping_idle:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except Exception as e:
+                logger.warning(f"Conexión inactiva descartada tras fallar el pre-ping: {e}")
+                self._count('ping_failures')
+                return False
+        return True
+
+    def getconn(self):
+        """Presta una conexión, esperando hasta DB_POOL_TIMEOUT si el pool está saturado."""
+        t_start = time.perf_counter()
+        deadline = time.monotonic() + self._timeout
+        waited = False
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise pool.PoolError("El pool de conexiones está cerrado")
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._opened < self.maxconn:
+                        # Reservar el hueco dentro de la sección crítica; se conecta fuera
+                        self._opened += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"Pool de conexiones agotado: {self.maxconn} en uso durante {self._timeout:g}s"
+                        )
+                    if not waited:
+                        waited = True
+                        self._metrics['waits'] += 1
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self._new_connection()
+                except Exception:
+                    with self._cond:
+                        self._opened -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_usable(conn, idle_since):
+                self._discard(conn)
+                continue
+            break
+
+        wait_ms = (time.perf_counter() - t_start) * 1000
+        with self._cond:
+            self._in_use.add(id(conn))
+            self._metrics['checkouts'] += 1
+            self._metrics['wait_ms_total'] += wait_ms
+            self._metrics['wait_ms_max'] = max(self._metrics['wait_ms_max'], wait_ms)
+        if waited and wait_ms >= 1000:
+            logger.warning(f"Pool de conexiones saturado: préstamo tras esperar {wait_ms:.0f}ms")
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Devuelve una conexión; si quedó rota o en una transacción abierta se limpia o descarta."""
+        with self._cond:
+            known = id(conn) in self._created_at
+        if not known:
+            # Conexión de un pool anterior (p. ej. tras close_all_connections)
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                close = True
+        if close or conn.closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._in_use.discard(id(conn))
+            if not self._closed:
+                self._idle.append((conn, time.time()))
+                self._cond.notify()
+                return
+        self._discard(conn)
+
+    def closeall(self):
+        """Cierra las conexiones libres; las prestadas se cierran al devolverse."""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._metrics)
+            stats.update({
+                'max': self.maxconn,
+                'opened': self._opened,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+            })
+        stats['wait_ms_avg'] = stats['wait_ms_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+
+# Tiempos por consulta (texto normalizado) para localizar las más costosas
+_query_stats = {}
+_query_stats_lock = threading.Lock()
+
+
+def _record_query(query, elapsed_ms):
+    key = _WHITESPACE_RE.sub(' ', query).strip()[:120]
+    with _query_stats_lock:
+        entry = _query_stats.get(key)
+        if entry is None:
+            if len(_query_stats) >= _MAX_TRACKED_QUERIES:
+                key = '(otras)'
+                entry = _query_stats.setdefault(key, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'slow': 0})
+            else:
+                entry = _query_stats[key] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'slow': 0}
+        entry['count'] += 1
+        entry['total_ms'] += elapsed_ms
+        entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+        if elapsed_ms >= SLOW_QUERY_MS:
+            entry['slow'] += 1
+    if elapsed_ms >= SLOW_QUERY_MS:
+        logger.warning(f"Consulta lenta ({elapsed_ms:.0f}ms): {key}")
+
+
+def get_pool_stats(top=10):
+    """Métricas del pool (préstamos, esperas, saturación) y las consultas más costosas."""
+    with _query_stats_lock:
+        queries = sorted(
+            ({'query': key, **entry} for key, entry in _query_stats.items()),
+            key=lambda item: item['total_ms'],
+            reverse=True
+        )[:top]
+    return {
+        'pool': connection_pool.stats() if connection_pool is not None else None,
+        'queries': queries,
+    }
+
+
+def init_db(init_schema=True):
+    """
+    Inicializa el pool de conexiones a la base de datos.
+    Con init_schema=False no se revisan tablas ni migraciones (procesos hijo
+    cuyo supervisor ya lo hizo).
+    """
     global connection_pool
     try:
-        connection_pool = psycopg2.pool.SimpleConnectionPool(
-            1, 20,  # min_conn, max_conn
+        connection_pool = ThreadSafeConnectionPool(
+            int(os.environ.get("DB_POOL_MIN", "1")),
+            int(os.environ.get("DB_POOL_MAX", "20")),
             user=DB_USER,
             password=DB_PASS,
             host=DB_HOST,
@@ -31,8 +277,9 @@ def init_db():
         logger.info("Conexión a la base de datos establecida exitosamente")
         
         # Inicializar las tablas
-        from database.models import init_db as init_tables
-        init_tables()
+        if init_schema:
+            from database.models import init_db as init_tables
+            init_tables()
         
         return True
     except Exception as e:
@@ -45,13 +292,16 @@ def get_connection():
         raise Exception("El pool de conexiones no ha sido inicializado. Llama a init_db() primero.")
     return connection_pool.getconn()
 
-def release_connection(conn):
-    """Devuelve una conexión al pool"""
+def release_connection(conn, close=False):
+    """Devuelve una conexión al pool (o la descarta si close=True)"""
     if connection_pool is not None:
-        connection_pool.putconn(conn)
+        connection_pool.putconn(conn, close=close)
 
-def close_all_connections():
-    """Cierra todas las conexiones activas y reinicia el pool"""
+def close_all_connections(reopen=True):
+    """
+    Cierra todas las conexiones activas y reinicia el pool.
+    Con reopen=False el pool queda sin crear (p. ej. antes de hacer fork).
+    """
     global connection_pool
     
     try:
@@ -61,9 +311,13 @@ def close_all_connections():
     except Exception as e:
         logger.error(f"Error al cerrar el pool de conexiones: {e}")
     
-    # Recrear el pool
+    if not reopen:
+        connection_pool = None
+        return
+    
+    # Recrear el pool (el esquema ya se revisó al crearlo la primera vez)
     try:
-        init_db()
+        init_db(init_schema=False)
     except Exception as e:
         logger.error(f"Error al recrear el pool de conexiones: {e}")
         raise
@@ -71,6 +325,8 @@ def close_all_connections():
 def execute_query(query, params=None):
     """Ejecuta una consulta SQL y devuelve los resultados"""
     conn = get_connection()
+    broken = False
+    t_query = time.perf_counter()
     try:
         with conn.cursor() as cursor:
             cursor.execute(query, params)
@@ -82,12 +338,109 @@ def execute_query(query, params=None):
             except psycopg2.ProgrammingError:
                 # No hay resultados para retornar
                 return None
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        # Conexión caída: se descarta en lugar de devolverla al pool
+        logger.error(f"Error de conexión ejecutando consulta: {e}")
+        broken = True
+        raise
     except Exception as e:
         logger.error(f"Error ejecutando consulta: {e}")
         conn.rollback()
         raise
     finally:
-        release_connection(conn)
+        _record_query(query, (time.perf_counter() - t_query) * 1000)
+        release_connection(conn, close=broken)
+
+def execute_values_query(query, rows, template=None, page_size=1000, fetch=False):
+    """
+    Ejecuta una sentencia con VALUES %s para muchas filas (psycopg2 execute_values):
+    una sentencia por cada page_size filas y un único commit al final. Con
+    fetch=True devuelve las filas de RETURNING de todas las páginas.
+    """
+    conn = get_connection()
+    broken = False
+    t_query = time.perf_counter()
+    try:
+        with conn.cursor() as cursor:
+            result = extras.execute_values(
+                cursor, query, rows, template=template, page_size=page_size, fetch=fetch
+            )
+            conn.commit()
+            return result
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        logger.error(f"Error de conexión ejecutando inserción masiva: {e}")
+        broken = True
+        raise
+    except Exception as e:
+        logger.error(f"Error ejecutando inserción masiva: {e}")
+        conn.rollback()
+        raise
+    finally:
+        _record_query(query, (time.perf_counter() - t_query) * 1000)
+        release_connection(conn, close=broken)
+
+class Transaction:
+    """Sentencias dentro de transaction(): misma conexión, sin commit intermedio."""
+    
+    def __init__(self, cursor):
+        self._cursor = cursor
+    
+    def execute(self, query, params=None):
+        """Igual que execute_query pero sin commit; devuelve las filas o None."""
+        t_query = time.perf_counter()
+        try:
+            self._cursor.execute(query, params)
+            try:
+                return self._cursor.fetchall()
+            except psycopg2.ProgrammingError:
+                return None
+        finally:
+            _record_query(query, (time.perf_counter() - t_query) * 1000)
+    
+    def execute_values(self, query, rows, template=None, page_size=1000, fetch=False):
+        """Igual que execute_values_query pero sin commit."""
+        t_query = time.perf_counter()
+        try:
+            return extras.execute_values(
+                self._cursor, query, rows, template=template, page_size=page_size, fetch=fetch
+            )
+        finally:
+            _record_query(query, (time.perf_counter() - t_query) * 1000)
+
+    def copy_expert(self, sql, file):
+        """COPY ... FROM STDIN / TO STDOUT dentro de la transacción."""
+        t_query = time.perf_counter()
+        try:
+            self._cursor.copy_expert(sql, file)
+            return self._cursor.rowcount
+        finally:
+            _record_query(sql, (time.perf_counter() - t_query) * 1000)
+
+@contextmanager
+def transaction():
+    """
+    Unidad de trabajo: varias sentencias sobre una conexión del pool con un
+    único commit al salir del bloque, o rollback si se produce una excepción.
+    
+        with transaction() as tx:
+            tx.execute("DELETE ...", params)
+            tx.execute("INSERT ...", params)
+    """
+    conn = get_connection()
+    broken = False
+    try:
+        with conn.cursor() as cursor:
+            yield Transaction(cursor)
+        conn.commit()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        logger.error(f"Error de conexión en transacción: {e}")
+        broken = True
+        raise
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_connection(conn, close=broken)
 
 def check_table_exists(table_name):
     """Verifica si una tabla existe en la base de datos"""
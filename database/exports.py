@@ -0,0 +1,173 @@
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import psycopg2
+from database.connection import get_connection, release_connection, _record_query
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Exportaciones de correos sin ficheros temporales en el directorio de trabajo.
+# Los datos van de COPY ... TO STDOUT (o de un cursor de servidor) a un
+# SpooledTemporaryFile: en memoria hasta EXPORT_SPOOL_MAX_BYTES y en un
+# temporal anónimo del sistema a partir de ahí, con memoria acotada.
+# Por encima de EXPORT_GZIP_ROWS filas el CSV se entrega comprimido.
+# ---------------------------------------------------------------------------
+SPOOL_MAX_BYTES = int(os.environ.get("EXPORT_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+GZIP_ROWS = int(os.environ.get("EXPORT_GZIP_ROWS", "5000"))
+_FETCH_SIZE = 2000
+_CHUNK_SIZE = 64 * 1024
+
+# Correos de todo el bot
+_BOT_EMAILS_QUERY = """
+SELECT e.user_id, u.created_by, e.email, e.added_at
+FROM user_emails e
+JOIN users u ON u.id = e.user_id AND u.bot_token = e.bot_token
+WHERE e.bot_token = %(bot_token)s
+ORDER BY e.user_id, e.email
+"""
+
+# Correos del revendedor y de todos los usuarios creados por él o por sus
+# descendientes (UNION descarta ciclos en created_by)
+_SUBTREE_EMAILS_QUERY = """
+WITH RECURSIVE subtree AS (
+    SELECT id, created_by FROM users
+    WHERE bot_token = %(bot_token)s AND id = %(root_id)s
+    UNION
+    SELECT u.id, u.created_by FROM users u
+    JOIN subtree s ON u.created_by = s.id
+    WHERE u.bot_token = %(bot_token)s
+)
+SELECT e.user_id, s.created_by, e.email, e.added_at
+FROM user_emails e
+JOIN subtree s ON s.id = e.user_id
+WHERE e.bot_token = %(bot_token)s
+ORDER BY e.user_id, e.email
+"""
+
+
+def _new_spool():
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode='w+b')
+
+
+def _gzip_spool(source):
+    """Comprime un spool en otro por bloques, sin cargarlo entero en memoria."""
+    target = _new_spool()
+    source.seek(0)
+    with gzip.GzipFile(fileobj=target, mode='wb') as gz:
+        shutil.copyfileobj(source, gz, _CHUNK_SIZE)
+    source.close()
+    target.seek(0)
+    return target
+
+
+def _copy_to_spool(query, params):
+    """
+    Ejecuta COPY (query) TO STDOUT en CSV con cabecera sobre un spool.
+    Devuelve (spool rebobinado, filas copiadas).
+    """
+    conn = get_connection()
+    broken = False
+    spool = _new_spool()
+    t_query = time.perf_counter()
+    try:
+        with conn.cursor() as cursor:
+            inner = cursor.mogrify(query, params).decode()
+            cursor.copy_expert(f"COPY ({inner}) TO STDOUT WITH (FORMAT csv, HEADER)", spool, size=_CHUNK_SIZE)
+            rows = cursor.rowcount
+        conn.commit()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        logger.error(f"Error de conexión exportando correos: {e}")
+        broken = True
+        spool.close()
+        raise
+    except Exception as e:
+        logger.error(f"Error exportando correos: {e}")
+        conn.rollback()
+        spool.close()
+        raise
+    finally:
+        _record_query(query, (time.perf_counter() - t_query) * 1000)
+        release_connection(conn, close=broken)
+    spool.seek(0)
+    return spool, rows
+
+
+def export_emails_csv(bot_token, root_id=None, compress=None):
+    """
+    Exporta en CSV (user_id, created_by, email, added_at) los correos de un bot
+    o, con root_id, del subárbol de usuarios creados por ese revendedor.
+
+    Args:
+        bot_token: Token del bot
+        root_id: Revendedor raíz del subárbol (opcional)
+        compress: Forzar (True/False) la compresión; por defecto según GZIP_ROWS
+
+    Returns:
+        tuple: (fichero binario rebobinado, filas exportadas, comprimido)
+        El llamador debe cerrar el fichero.
+    """
+    if root_id is None:
+        spool, rows = _copy_to_spool(_BOT_EMAILS_QUERY, {'bot_token': bot_token})
+    else:
+        spool, rows = _copy_to_spool(_SUBTREE_EMAILS_QUERY, {'bot_token': bot_token, 'root_id': root_id})
+
+    if compress is None:
+        compress = rows > GZIP_ROWS
+    if compress:
+        spool = _gzip_spool(spool)
+    return spool, rows, compress
+
+
+def export_user_emails_txt(user_id, bot_token):
+    """
+    Lista de correos de un usuario en el formato de texto de /list, leída con
+    un cursor de servidor por lotes de _FETCH_SIZE filas.
+
+    Returns:
+        tuple: (fichero binario rebobinado o None si no tiene correos, total de correos)
+    """
+    conn = get_connection()
+    broken = False
+    spool = _new_spool()
+    total = 0
+    t_query = time.perf_counter()
+    try:
+        with conn.cursor(name=f"export_user_{user_id}") as cursor:
+            cursor.itersize = _FETCH_SIZE
+            cursor.execute("""
+            SELECT email FROM user_emails
+            WHERE user_id = %s AND bot_token = %s
+            ORDER BY email
+            """, (user_id, bot_token))
+
+            spool.write(f"Lista de correos para usuario {user_id}\n".encode())
+            spool.write(("=" * 50 + "\n\n").encode())
+            for (email,) in cursor:
+                spool.write(f"{email}\n".encode())
+                total += 1
+            spool.write(f"\nTotal de correos: {total}".encode())
+        conn.commit()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        logger.error(f"Error de conexión exportando correos del usuario {user_id}: {e}")
+        broken = True
+        spool.close()
+        raise
+    except Exception as e:
+        logger.error(f"Error exportando correos del usuario {user_id}: {e}")
+        conn.rollback()
+        spool.close()
+        raise
+    finally:
+        _record_query("export_user_emails_txt", (time.perf_counter() - t_query) * 1000)
+        release_connection(conn, close=broken)
+
+    if not total:
+        spool.close()
+        return None, 0
+    spool.seek(0)
+    return spool, total
@@ -0,0 +1,112 @@
+import csv
+import io
+import logging
+import time
+
+from database.connection import transaction
+
+logger = logging.getLogger(__name__)
+
+# Tabla de staging de la transacción de importación (desaparece en el COMMIT)
+_CREATE_STAGING = """
+CREATE TEMP TABLE import_staging (
+    line_no INTEGER NOT NULL,
+    user_id BIGINT NOT NULL,
+    access_until TIMESTAMP NOT NULL,
+    email VARCHAR(255)
+) ON COMMIT DROP
+"""
+
+# Filas de usuarios existentes que quien importa no puede gestionar
+_FOREIGN_OWNER_QUERY = """
+SELECT DISTINCT s.line_no, s.user_id
+FROM import_staging s
+JOIN users u ON u.id = s.user_id AND u.bot_token = %s
+WHERE u.created_by IS DISTINCT FROM %s
+ORDER BY s.line_no
+"""
+
+# Alta de usuarios nuevos (rol user) y renovación de los existentes; el rol y
+# created_by de los existentes no cambian. xmax = 0 distingue inserción de update.
+_MERGE_USERS = """
+INSERT INTO users (id, role_id, bot_token, access_until, created_by)
+SELECT DISTINCT ON (s.user_id) s.user_id, r.id, %s, s.access_until, %s
+FROM import_staging s
+CROSS JOIN (SELECT id FROM roles WHERE name = 'user') r
+ORDER BY s.user_id, s.line_no DESC
+ON CONFLICT (id, bot_token) DO UPDATE
+SET access_until = EXCLUDED.access_until
+RETURNING id, (xmax = 0)
+"""
+
+_MERGE_EMAILS = """
+INSERT INTO user_emails (user_id, bot_token, email)
+SELECT DISTINCT s.user_id, %s, s.email
+FROM import_staging s
+WHERE s.email IS NOT NULL
+ON CONFLICT (user_id, bot_token, email) DO NOTHING
+RETURNING 1
+"""
+
+
+def import_users(bot_token, rows, caller_id, owner_only):
+    """
+    Carga usuarios y correos ya validados en una sola transacción:
+    COPY a una tabla temporal y merge por conjuntos en users y user_emails.
+
+    Args:
+        bot_token: Token del bot
+        rows: Lista de (line_no, user_id, access_until, [emails])
+        caller_id: Quien importa; será created_by de los usuarios nuevos
+        owner_only: Si es True (revendedores) se rechazan las filas de
+            usuarios existentes que no creó caller_id
+
+    Returns:
+        dict: created, updated, emails_added, emails_duplicated, user_ids
+        y errors (lista de (line_no, mensaje))
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    email_rows = 0
+    for line_no, user_id, access_until, emails in rows:
+        if emails:
+            for email in emails:
+                writer.writerow((line_no, user_id, access_until.isoformat(sep=' '), email))
+                email_rows += 1
+        else:
+            writer.writerow((line_no, user_id, access_until.isoformat(sep=' '), ''))
+    buffer.seek(0)
+
+    result = {'created': 0, 'updated': 0, 'emails_added': 0, 'emails_duplicated': 0,
+              'user_ids': [], 'errors': []}
+    t_start = time.perf_counter()
+    with transaction() as tx:
+        tx.execute(_CREATE_STAGING)
+        # Cadena vacía sin comillas = NULL en COPY csv: usuarios sin correos
+        tx.copy_expert("COPY import_staging (line_no, user_id, access_until, email) FROM STDIN WITH (FORMAT csv)", buffer)
+
+        if owner_only:
+            foreign = tx.execute(_FOREIGN_OWNER_QUERY, (bot_token, caller_id)) or []
+            for line_no, user_id in foreign:
+                result['errors'].append((line_no, f"No tienes permiso para gestionar al usuario {user_id}"))
+            if foreign:
+                tx.execute(
+                    "DELETE FROM import_staging WHERE user_id = ANY(%s)",
+                    (list({user_id for _, user_id in foreign}),)
+                )
+                remaining = tx.execute("SELECT COUNT(*) FROM import_staging WHERE email IS NOT NULL")
+                email_rows = remaining[0][0] if remaining else 0
+
+        for user_id, inserted in tx.execute(_MERGE_USERS, (bot_token, caller_id)) or []:
+            result['user_ids'].append(user_id)
+            result['created' if inserted else 'updated'] += 1
+
+        added = tx.execute(_MERGE_EMAILS, (bot_token,)) or []
+        result['emails_added'] = len(added)
+        result['emails_duplicated'] = email_rows - len(added)
+
+    logger.info(
+        f"Importación en {time.perf_counter()-t_start:.2f}s: {result['created']} usuarios nuevos, "
+        f"{result['updated']} actualizados, {result['emails_added']} correos añadidos"
+    )
+    return result
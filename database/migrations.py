@@ -0,0 +1,282 @@
+import logging
+import time
+from database.connection import execute_query, get_connection, release_connection
+
+logger = logging.getLogger(__name__)
+
+# Clave del advisory lock que serializa las migraciones entre procesos
+_MIGRATION_LOCK_KEY = 7315001
+
+# ---------------------------------------------------------------------------
+# Migraciones en orden. Cada una es (versión, nombre, [sentencias SQL]) y se
+# aplica en una sola transacción junto con su fila en schema_version.
+# Nunca se edita una migración ya publicada: los cambios van en una nueva.
+# ---------------------------------------------------------------------------
+
+# 1: esquema que antes creaba init_db sondeando information_schema. Es
+# idempotente para que las bases existentes lo registren sin cambios.
+_BASELINE = [
+    """
+    CREATE TABLE IF NOT EXISTS roles (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(50) NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGINT,
+        username VARCHAR(100),
+        role_id INTEGER REFERENCES roles(id),
+        bot_token VARCHAR(100) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        access_until TIMESTAMP,
+        free_access BOOLEAN DEFAULT FALSE,
+        code_access BOOLEAN DEFAULT FALSE,
+        created_by BIGINT,
+        blocked_reason VARCHAR(255),
+        PRIMARY KEY (id, bot_token)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS services (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        display_name VARCHAR(100) NOT NULL,
+        color_bg VARCHAR(10) DEFAULT '#ddd',
+        color_text VARCHAR(10) DEFAULT '#333',
+        is_active BOOLEAN DEFAULT TRUE,
+        sort_order INTEGER DEFAULT 0,
+        bot_token VARCHAR(100) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(name, bot_token)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS service_options (
+        id SERIAL PRIMARY KEY,
+        service_id INTEGER REFERENCES services(id) ON DELETE CASCADE,
+        name VARCHAR(100) NOT NULL,
+        price DECIMAL(10, 2),
+        is_active BOOLEAN DEFAULT TRUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS reseller_config (
+        id SERIAL PRIMARY KEY,
+        reseller_id BIGINT,
+        bot_token VARCHAR(100) NOT NULL,
+        service_id INTEGER REFERENCES services(id) ON DELETE CASCADE,
+        can_access BOOLEAN DEFAULT TRUE,
+        profit_margin DECIMAL(5, 2) DEFAULT 0,
+        FOREIGN KEY (reseller_id, bot_token) REFERENCES users(id, bot_token) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS imap_config (
+        id SERIAL PRIMARY KEY,
+        domain VARCHAR(100) NOT NULL,
+        email VARCHAR(100) NOT NULL,
+        password VARCHAR(100) NOT NULL,
+        imap_server VARCHAR(100) NOT NULL,
+        bot_token VARCHAR(100) NOT NULL,
+        UNIQUE(domain, bot_token)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_emails (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT,
+        bot_token VARCHAR(100) NOT NULL,
+        email VARCHAR(255) NOT NULL,
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id, bot_token) REFERENCES users(id, bot_token) ON DELETE CASCADE,
+        UNIQUE(user_id, bot_token, email)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS warranty_records (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT,
+        bot_token VARCHAR(100) NOT NULL,
+        old_email VARCHAR(255) NOT NULL,
+        new_email VARCHAR(255) NOT NULL,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        changed_by BIGINT,
+        FOREIGN KEY (user_id, bot_token) REFERENCES users(id, bot_token) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS reseller_service_options (
+        id SERIAL PRIMARY KEY,
+        reseller_id BIGINT,
+        bot_token VARCHAR(100) NOT NULL,
+        service_id INTEGER REFERENCES services(id) ON DELETE CASCADE,
+        option_type VARCHAR(50) NOT NULL,
+        can_access BOOLEAN DEFAULT TRUE,
+        FOREIGN KEY (reseller_id, bot_token) REFERENCES users(id, bot_token) ON DELETE CASCADE,
+        UNIQUE(reseller_id, bot_token, service_id, option_type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS disney_searches (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        email VARCHAR(255) NOT NULL,
+        result_type VARCHAR(100),
+        result_code VARCHAR(50),
+        search_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        verification_scheduled BOOLEAN DEFAULT FALSE,
+        verification_completed BOOLEAN DEFAULT FALSE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS email_change_verifications (
+        id SERIAL PRIMARY KEY,
+        search_id INTEGER REFERENCES disney_searches(id) ON DELETE CASCADE,
+        user_id BIGINT NOT NULL,
+        email VARCHAR(255) NOT NULL,
+        original_code VARCHAR(50),
+        scheduled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        verified_at TIMESTAMP,
+        email_changed BOOLEAN DEFAULT FALSE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS extracted_codes (
+        id BIGSERIAL PRIMARY KEY,
+        bot_token VARCHAR(100) NOT NULL,
+        account VARCHAR(255) NOT NULL,
+        uidvalidity BIGINT NOT NULL,
+        uid BIGINT NOT NULL,
+        recipient VARCHAR(255) NOT NULL,
+        regex_key VARCHAR(50) NOT NULL,
+        result TEXT NOT NULL,
+        is_link BOOLEAN DEFAULT FALSE,
+        subject TEXT,
+        from_addr VARCHAR(255),
+        msg_date VARCHAR(100),
+        received_at TIMESTAMP NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(bot_token, account, uidvalidity, uid, recipient, regex_key)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_extracted_codes_lookup
+    ON extracted_codes (bot_token, recipient, regex_key, received_at DESC)
+    """,
+    """
+    INSERT INTO roles (name)
+    VALUES ('super_admin'), ('admin'), ('reseller'), ('user')
+    ON CONFLICT (name) DO NOTHING
+    """,
+    # Columnas añadidas después de la primera versión del esquema
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS free_access BOOLEAN DEFAULT FALSE",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS code_access BOOLEAN DEFAULT FALSE",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS created_by BIGINT",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_reason VARCHAR(255)",
+    "ALTER TABLE services ADD COLUMN IF NOT EXISTS display_name VARCHAR(100)",
+    "UPDATE services SET display_name = name WHERE display_name IS NULL",
+]
+
+# 2: índices para las claves foráneas (Postgres no los crea solo) y para
+# imap_config, que siempre se filtra por bot_token.
+_FOREIGN_KEY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_imap_config_bot_token ON imap_config (bot_token)",
+    "CREATE INDEX IF NOT EXISTS idx_warranty_records_user ON warranty_records (user_id, bot_token)",
+    "CREATE INDEX IF NOT EXISTS idx_reseller_config_reseller ON reseller_config (reseller_id, bot_token)",
+    "CREATE INDEX IF NOT EXISTS idx_reseller_config_service ON reseller_config (service_id)",
+    "CREATE INDEX IF NOT EXISTS idx_reseller_service_options_service ON reseller_service_options (service_id)",
+    "CREATE INDEX IF NOT EXISTS idx_service_options_service ON service_options (service_id)",
+    "CREATE INDEX IF NOT EXISTS idx_email_change_verifications_search ON email_change_verifications (search_id)",
+]
+
+# 3: índices de las consultas calientes: /list y reseller_can_manage_user
+# (created_by), /msg allid, /checktimeall y avisos de start (access_until) y
+# búsqueda inversa de correos. Se verifican con database/query_plans.py.
+_HOT_PATH_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_users_bot_token_created_by ON users (bot_token, created_by)",
+    "CREATE INDEX IF NOT EXISTS idx_users_bot_token_access_until ON users (bot_token, access_until)",
+    "CREATE INDEX IF NOT EXISTS idx_user_emails_bot_token_email ON user_emails (bot_token, email)",
+]
+
+MIGRATIONS = [
+    (1, 'baseline', _BASELINE),
+    (2, 'foreign_key_indexes', _FOREIGN_KEY_INDEXES),
+    (3, 'hot_path_indexes', _HOT_PATH_INDEXES),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version():
+    """Versión aplicada del esquema (0 si la tabla schema_version aún no existe)."""
+    result = execute_query("""
+    SELECT CASE WHEN to_regclass('schema_version') IS NULL THEN 0
+                ELSE (SELECT COALESCE(MAX(version), 0) FROM schema_version) END
+    """)
+    return result[0][0] if result else 0
+
+
+def apply_migrations():
+    """
+    Aplica las migraciones pendientes bajo un advisory lock, de modo que si
+    varios procesos arrancan a la vez solo uno migra y el resto espera y
+    encuentra el esquema al día. Devuelve la versión final.
+    """
+    conn = get_connection()
+    discard_conn = False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s)", (_MIGRATION_LOCK_KEY,))
+            try:
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(100) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                """)
+                conn.commit()
+                
+                cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+                current = cursor.fetchone()[0]
+                
+                for version, name, statements in MIGRATIONS:
+                    if version <= current:
+                        continue
+                    t_start = time.perf_counter()
+                    logger.info(f"Aplicando migración {version} ({name})...")
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.execute(
+                        "INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+                        (version, name)
+                    )
+                    conn.commit()
+                    current = version
+                    logger.info(f"✅ Migración {version} aplicada en {time.perf_counter()-t_start:.2f}s")
+                return current
+            finally:
+                # Una migración fallida deja la transacción abortada: hay que hacer
+                # rollback antes del unlock, y un fallo aquí nunca debe ocultar el
+                # error original. Si no se puede liberar, se cierra la conexión
+                # (al cerrar la sesión Postgres suelta el advisory lock).
+                try:
+                    conn.rollback()
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (_MIGRATION_LOCK_KEY,))
+                    conn.commit()
+                except Exception as e:
+                    logger.error(f"No se pudo liberar el lock de migraciones, se descarta la conexión: {e}")
+                    discard_conn = True
+    finally:
+        release_connection(conn, close=discard_conn)
+
+
+def ensure_schema():
+    """Comprobación rápida de versión; solo migra si el esquema está atrasado."""
+    version = get_schema_version()
+    if version >= LATEST_VERSION:
+        logger.info(f"Esquema de base de datos al día (versión {version})")
+        return version
+    logger.info(f"Esquema en versión {version}, migrando a {LATEST_VERSION}...")
+    return apply_migrations()
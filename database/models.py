@@ -1,331 +1,33 @@
 import logging
-from database.connection import execute_query, check_table_exists
+from database.connection import execute_query, execute_values_query
 from config import ADMIN_ID, DEFAULT_SERVICES
 from datetime import datetime
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
-def verify_table_columns(table_name, expected_columns):
-    """Verifica que una tabla tenga todas las columnas esperadas y las añade si faltan"""
-    try:
-        # Obtener columnas existentes
-        existing_columns = execute_query("""
-        SELECT column_name FROM information_schema.columns 
-        WHERE table_name = %s
-        """, (table_name,))
-        
-        if not existing_columns:
-            logger.warning(f"No se encontraron columnas para la tabla {table_name}")
-            return False
-            
-        existing_column_names = [col[0] for col in existing_columns]
-        
-        # Verificar cada columna esperada
-        for col_name, col_def in expected_columns.items():
-            if col_name not in existing_column_names:
-                logger.info(f"Añadiendo columna {col_name} a la tabla {table_name}")
-                execute_query(f"ALTER TABLE {table_name} ADD COLUMN {col_name} {col_def}")
-                
-        return True
-    except Exception as e:
-        logger.error(f"Error verificando columnas para {table_name}: {e}")
-        return False
-
 def init_db():
-    """Inicializa las tablas en la base de datos si no existen"""
-    logger.info("Verificando estructura de la base de datos...")
-    
-    # Verificar y crear cada tabla individualmente
-    
-    # Tabla de roles
-    if not check_table_exists('roles'):
-        logger.info("Creando tabla de roles...")
-        execute_query("""
-        CREATE TABLE IF NOT EXISTS roles (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(50) NOT NULL UNIQUE
-        )
-        """)
-        
-        # Insertar roles predefinidos
-        logger.info("Insertando roles predefinidos...")
-        for role in ['super_admin', 'admin', 'reseller', 'user']:
-            execute_query("""
-            INSERT INTO roles (name) VALUES (%s)
-            ON CONFLICT (name) DO NOTHING
-            """, (role,))
-    
-    # Tabla de usuarios
-    if not check_table_exists('users'):
-        logger.info("Creando tabla de usuarios...")
-        execute_query("""
-        CREATE TABLE IF NOT EXISTS users (
-            id BIGINT,
-            username VARCHAR(100),
-            role_id INTEGER REFERENCES roles(id),
-            bot_token VARCHAR(100) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            access_until TIMESTAMP,
-            free_access BOOLEAN DEFAULT FALSE,
-            code_access BOOLEAN DEFAULT FALSE,
-            created_by BIGINT,
-            blocked_reason VARCHAR(255),
-            PRIMARY KEY (id, bot_token)
-        )
-        """)
-    
-    # Tabla de servicios
-    if not check_table_exists('services'):
-        logger.info("Creando tabla de servicios...")
-        execute_query("""
-        CREATE TABLE IF NOT EXISTS services (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(100) NOT NULL,
-            display_name VARCHAR(100) NOT NULL,
-            color_bg VARCHAR(10) DEFAULT '#ddd',
-            color_text VARCHAR(10) DEFAULT '#333',
-            is_active BOOLEAN DEFAULT TRUE,
-            sort_order INTEGER DEFAULT 0,
-            bot_token VARCHAR(100) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(name, bot_token)
-        )
-        """)
-    
-    # Tabla de opciones de servicios
-    if not check_table_exists('service_options'):
-        logger.info("Creando tabla de opciones de servicios...")
-        execute_query("""
-        CREATE TABLE IF NOT EXISTS service_options (
-            id SERIAL PRIMARY KEY,
-            service_id INTEGER REFERENCES services(id) ON DELETE CASCADE,
-            name VARCHAR(100) NOT NULL,
-            price DECIMAL(10, 2),
-            is_active BOOLEAN DEFAULT TRUE
-        )
-        """)
-    
-    # Tabla de configuración de resellers
-    if not check_table_exists('reseller_config'):
-        logger.info("Creando tabla de configuración de resellers...")
-        execute_query("""
-        CREATE TABLE IF NOT EXISTS reseller_config (
-            id SERIAL PRIMARY KEY,
-            reseller_id BIGINT,
-            bot_token VARCHAR(100) NOT NULL,
-            service_id INTEGER REFERENCES services(id) ON DELETE CASCADE,
-            can_access BOOLEAN DEFAULT TRUE,
-            profit_margin DECIMAL(5, 2) DEFAULT 0,
-            FOREIGN KEY (reseller_id, bot_token) REFERENCES users(id, bot_token) ON DELETE CASCADE
-        )
-        """)
-    
-    # Tabla para configuraciones IMAP
-    if not check_table_exists('imap_config'):
-        logger.info("Creando tabla de configuraciones IMAP...")
-        execute_query("""
-        CREATE TABLE IF NOT EXISTS imap_config (
-            id SERIAL PRIMARY KEY,
-            domain VARCHAR(100) NOT NULL,
-            email VARCHAR(100) NOT NULL,
-            password VARCHAR(100) NOT NULL,
-            imap_server VARCHAR(100) NOT NULL,
-            bot_token VARCHAR(100) NOT NULL,
-            UNIQUE(domain, bot_token)
-        )
-        """)
-    
-    # Tabla de correos asociados a usuarios
-    if not check_table_exists('user_emails'):
-        logger.info("Creando tabla de correos de usuarios...")
-        execute_query("""
-        CREATE TABLE IF NOT EXISTS user_emails (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT,
-            bot_token VARCHAR(100) NOT NULL,
-            email VARCHAR(255) NOT NULL,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id, bot_token) REFERENCES users(id, bot_token) ON DELETE CASCADE,
-            UNIQUE(user_id, bot_token, email)
-        )
-        """)
-
-    # Tabla para almacenar registros de garantía
-    if not check_table_exists('warranty_records'):
-        logger.info("Creando tabla de registros de garantía...")
-        execute_query("""
-        CREATE TABLE IF NOT EXISTS warranty_records (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT,
-            bot_token VARCHAR(100) NOT NULL,
-            old_email VARCHAR(255) NOT NULL,
-            new_email VARCHAR(255) NOT NULL,
-            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            changed_by BIGINT,
-            FOREIGN KEY (user_id, bot_token) REFERENCES users(id, bot_token) ON DELETE CASCADE
-        )
-        """)
-    
-    # Tabla para opciones de servicio específicas por reseller
-    if not check_table_exists('reseller_service_options'):
-        logger.info("Creando tabla de opciones de servicio para resellers...")
-        execute_query("""
-        CREATE TABLE IF NOT EXISTS reseller_service_options (
-            id SERIAL PRIMARY KEY,
-            reseller_id BIGINT,
-            bot_token VARCHAR(100) NOT NULL,
-            service_id INTEGER REFERENCES services(id) ON DELETE CASCADE,
-            option_type VARCHAR(50) NOT NULL,
-            can_access BOOLEAN DEFAULT TRUE,
-            FOREIGN KEY (reseller_id, bot_token) REFERENCES users(id, bot_token) ON DELETE CASCADE,
-            UNIQUE(reseller_id, bot_token, service_id, option_type)
-        )
-        """)
-    
-    # AÑADIDO: Tabla para registros de búsquedas Disney (para monitoreo)
-    if not check_table_exists('disney_searches'):
-        logger.info("Creando tabla de búsquedas Disney...")
-        execute_query("""
-        CREATE TABLE IF NOT EXISTS disney_searches (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            email VARCHAR(255) NOT NULL,
-            result_type VARCHAR(100),
-            result_code VARCHAR(50),
-            search_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            verification_scheduled BOOLEAN DEFAULT FALSE,
-            verification_completed BOOLEAN DEFAULT FALSE
-        )
-        """)
-    
-    # AÑADIDO: Tabla para verificaciones de cambio de email
-    if not check_table_exists('email_change_verifications'):
-        logger.info("Creando tabla de verificaciones de cambio de email...")
-        execute_query("""
-        CREATE TABLE IF NOT EXISTS email_change_verifications (
-            id SERIAL PRIMARY KEY,
-            search_id INTEGER REFERENCES disney_searches(id) ON DELETE CASCADE,
-            user_id BIGINT NOT NULL,
-            email VARCHAR(255) NOT NULL,
-            original_code VARCHAR(50),
-            scheduled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            verified_at TIMESTAMP,
-            email_changed BOOLEAN DEFAULT FALSE
-        )
-        """)
-    
-    # Verificar y añadir columnas necesarias
-    logger.info("Verificando columnas requeridas...")
-    
-    # Columna free_access en users
-    try:
-        column_exists = execute_query("""
-        SELECT EXISTS (
-            SELECT FROM information_schema.columns 
-            WHERE table_name = 'users' AND column_name = 'free_access'
-        )
-        """)
-        
-        if not column_exists[0][0]:
-            logger.info("Añadiendo columna free_access a tabla users...")
-            execute_query("ALTER TABLE users ADD COLUMN free_access BOOLEAN DEFAULT FALSE")
-    except Exception as e:
-        logger.warning(f"Error al verificar columna free_access: {e}")
-    
-    # Columna code_access en users
-    try:
-        column_exists = execute_query("""
-        SELECT EXISTS (
-            SELECT FROM information_schema.columns 
-            WHERE table_name = 'users' AND column_name = 'code_access'
-        )
-        """)
-        
-        if not column_exists[0][0]:
-            logger.info("Añadiendo columna code_access a tabla users...")
-            execute_query("ALTER TABLE users ADD COLUMN code_access BOOLEAN DEFAULT FALSE")
-    except Exception as e:
-        logger.warning(f"Error al verificar columna code_access: {e}")
-    
-    # Columna created_by en users
-    try:
-        column_exists = execute_query("""
-        SELECT EXISTS (
-            SELECT FROM information_schema.columns 
-            WHERE table_name = 'users' AND column_name = 'created_by'
-        )
-        """)
-        
-        if not column_exists[0][0]:
-            logger.info("Añadiendo columna created_by a tabla users...")
-            execute_query("ALTER TABLE users ADD COLUMN created_by BIGINT")
-    except Exception as e:
-        logger.warning(f"Error al verificar columna created_by: {e}")
-    
-    # MEJORADO: Columna blocked_reason en users
-    try:
-        column_exists = execute_query("""
-        SELECT EXISTS (
-            SELECT FROM information_schema.columns 
-            WHERE table_name = 'users' AND column_name = 'blocked_reason'
-        )
-        """)
-        
-        if not column_exists[0][0]:
-            logger.info("Añadiendo columna blocked_reason a tabla users...")
-            execute_query("ALTER TABLE users ADD COLUMN blocked_reason VARCHAR(255)")
-            logger.info("✅ Columna blocked_reason añadida exitosamente")
-        else:
-            logger.info("✅ Columna blocked_reason ya existe")
-    except Exception as e:
-        logger.warning(f"Error al verificar/añadir columna blocked_reason: {e}")
-    
-    # Verificar y añadir columna display_name en services
-    try:
-        column_exists = execute_query("""
-        SELECT EXISTS (
-            SELECT FROM information_schema.columns 
-            WHERE table_name = 'services' AND column_name = 'display_name'
-        )
-        """)
-        
-        if not column_exists[0][0]:
-            logger.info("Añadiendo columna display_name a tabla services...")
-            execute_query("ALTER TABLE services ADD COLUMN display_name VARCHAR(100)")
-            
-            # Actualizar valores existentes para que display_name sea igual a name
-            execute_query("UPDATE services SET display_name = name WHERE display_name IS NULL")
-    except Exception as e:
-        logger.warning(f"Error al verificar/añadir columna display_name: {e}")
+    """Inicializa las tablas en la base de datos aplicando las migraciones pendientes"""
+    from database.migrations import ensure_schema
     
+    logger.info("Verificando estructura de la base de datos...")
+    ensure_schema()
     logger.info("✅ Verificación de la base de datos completada")
 
 def ensure_roles_exist():
     """Verifica que todos los roles predefinidos existan y los crea si no"""
     predefined_roles = ['super_admin', 'admin', 'reseller', 'user']
     
-    # Verificar si la tabla roles existe
-    if not check_table_exists('roles'):
-        logger.info("Creando tabla de roles...")
+    # La tabla roles la crea la migración base; aquí basta con un INSERT idempotente
+    try:
         execute_query("""
-        CREATE TABLE IF NOT EXISTS roles (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(50) NOT NULL UNIQUE
-        )
-        """)
-    
-    # Verificar cada rol y crearlo si no existe
-    for role in predefined_roles:
-        role_exists = execute_query("SELECT id FROM roles WHERE name = %s", (role,))
-        if not role_exists:
-            logger.warning(f"No se encontró el rol '{role}'. Creando...")
-            try:
-                execute_query("INSERT INTO roles (name) VALUES (%s)", (role,))
-                logger.info(f"Rol '{role}' creado correctamente")
-            except Exception as e:
-                logger.error(f"Error al crear el rol '{role}': {e}")
-                return False
+        INSERT INTO roles (name)
+        SELECT unnest(%s::varchar[])
+        ON CONFLICT (name) DO NOTHING
+        """, (predefined_roles,))
+    except Exception as e:
+        logger.error(f"Error al crear los roles predefinidos: {e}")
+        return False
     
     return True
 
@@ -381,59 +83,23 @@ def setup_super_admin(bot_token):
 
 def setup_default_services(bot_token):
     """Configura los servicios predeterminados para un bot"""
+    # display_name está garantizada por la migración base, sin sondear information_schema
     try:
-        # Verificar qué columnas existen en la tabla services
-        columns_result = execute_query("""
-        SELECT column_name FROM information_schema.columns 
-        WHERE table_name = 'services'
-        """)
-        
-        if not columns_result:
-            logger.error("No se pudieron obtener las columnas de la tabla services")
-            return False
-            
-        columns = [col[0] for col in columns_result]
-        has_display_name = 'display_name' in columns
-        
         for service_name in DEFAULT_SERVICES:
-            # Verificar si el servicio ya existe
-            exists_result = execute_query(
-                "SELECT id FROM services WHERE name = %s AND bot_token = %s",
-                (service_name, bot_token)
-            )
+            created = execute_query("""
+            INSERT INTO services (name, display_name, bot_token) VALUES (%s, %s, %s)
+            ON CONFLICT (name, bot_token) DO NOTHING
+            RETURNING id
+            """, (service_name, service_name, bot_token))
             
-            if not exists_result:
-                if has_display_name:
-                    # Con display_name
-                    execute_query(
-                        "INSERT INTO services (name, display_name, bot_token) VALUES (%s, %s, %s)",
-                        (service_name, service_name, bot_token)
-                    )
-                else:
-                    # Sin display_name
-                    execute_query(
-                        "INSERT INTO services (name, bot_token) VALUES (%s, %s)",
-                        (service_name, bot_token)
-                    )
-                    
+            if created:
                 logger.info(f"Servicio '{service_name}' creado para el bot {bot_token[:10]}...")
         
         return True
         
     except Exception as e:
         logger.error(f"Error al configurar servicios predeterminados: {e}")
-        
-        # Intentar inserción mínima como último recurso
-        try:
-            for service_name in DEFAULT_SERVICES:
-                execute_query(
-                    "INSERT INTO services (name, bot_token) VALUES (%s, %s) ON CONFLICT (name, bot_token) DO NOTHING",
-                    (service_name, bot_token)
-                )
-            return True
-        except Exception as e2:
-            logger.error(f"Error en inserción de emergencia: {e2}")
-            return False
+        return False
 
 def can_user_access_email(user_id, bot_token, email):
     """Verifica si un usuario tiene acceso a un correo específico"""
@@ -474,6 +140,56 @@ def can_user_access_email(user_id, bot_token, email):
         logger.error(f"Error verificando acceso al correo {email} para usuario {user_id}: {e}")
         return False
 
+def upsert_user_role(tx, user_id, bot_token, role_name, expiration, created_by, clear_block=False):
+    """
+    Crea el usuario o actualiza su rol y expiración dentro de la transacción tx.
+    El created_by de un usuario existente se conserva.
+    
+    Returns:
+        bool: False si el rol no existe
+    """
+    set_block = ", blocked_reason = NULL" if clear_block else ""
+    result = tx.execute(f"""
+    INSERT INTO users (id, role_id, bot_token, access_until, created_by)
+    SELECT %s, r.id, %s, %s, %s FROM roles r WHERE r.name = %s
+    ON CONFLICT (id, bot_token) DO UPDATE
+    SET role_id = EXCLUDED.role_id, access_until = EXCLUDED.access_until{set_block}
+    RETURNING id
+    """, (user_id, bot_token, expiration, created_by, role_name))
+    return bool(result)
+
+def add_user_emails(user_id, bot_token, emails, tx=None):
+    """
+    Asigna correos a un usuario con un solo INSERT ... ON CONFLICT DO NOTHING
+    en una transacción, en lugar de una consulta y un commit por correo.
+    
+    Args:
+        user_id: ID del usuario
+        bot_token: Token del bot
+        emails: Correos a asignar (se normalizan a minúsculas y sin repetidos)
+        tx: Transacción en curso (opcional); sin ella se confirma al terminar
+    
+    Returns:
+        tuple: (correos insertados, correos que ya estaban asignados)
+    """
+    normalized = list(dict.fromkeys(e.strip().lower() for e in emails if e.strip()))
+    if not normalized:
+        return [], []
+        
+    run = tx.execute_values if tx is not None else execute_values_query
+    rows = run("""
+    INSERT INTO user_emails (user_id, bot_token, email)
+    VALUES %s
+    ON CONFLICT (user_id, bot_token, email) DO NOTHING
+    RETURNING email
+    """, [(user_id, bot_token, email) for email in normalized], fetch=True)
+    
+    inserted = {row[0] for row in rows}
+    return (
+        [e for e in normalized if e in inserted],
+        [e for e in normalized if e not in inserted]
+    )
+
 def block_user(user_id, bot_token, reason, email_addr=None):
     """
     Bloquea un usuario por razones de seguridad
@@ -507,6 +223,9 @@ def block_user(user_id, bot_token, reason, email_addr=None):
             WHERE id = %s AND bot_token = %s
             """, (user_id, bot_token))
         
+        from utils.authorization import authorization_service
+        authorization_service.invalidate(bot_token, user_id)
+        
         logger.info(f"✅ Usuario {user_id} bloqueado. Razón: {full_reason}")
         return True
         
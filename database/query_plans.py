@@ -0,0 +1,226 @@
+"""
+Verificación de planes de las consultas calientes sobre users y user_emails.
+
+Siembra una base de Postgres DESECHABLE con volumen de producción (por
+defecto ~1M usuarios y ~10M correos), aplica las migraciones y comprueba con
+EXPLAIN que cada consulta caliente usa el índice esperado y que ninguna hace
+Seq Scan sobre users o user_emails. Sale con código 1 si algún plan regresa,
+para poder usarse en CI o antes de publicar una migración.
+
+Uso:
+    QUERY_PLANS_DSN=postgresql://localhost/bot_plans \\
+        python -m database.query_plans --seed [--users 1000000] [--emails 10000000]
+
+Sin --seed solo se ejecutan los EXPLAIN sobre los datos existentes.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import psycopg2
+
+from database.migrations import MIGRATIONS
+
+logger = logging.getLogger(__name__)
+
+# Tipos de nodo que cuentan como acceso por índice
+_INDEX_NODES = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+_CHECKED_TABLES = ('users', 'user_emails')
+
+# Valores sembrados que usan las consultas: el bot 0 y el revendedor 1
+_BOT = 'bot_0'
+_RESELLER = 1
+
+# (nombre, consulta, parámetros, índices aceptados)
+HOT_QUERIES = [
+    (
+        'autorizacion_usuario',
+        """
+        SELECT r.name, u.access_until, u.free_access, u.code_access, u.blocked_reason, u.created_by
+        FROM users u LEFT JOIN roles r ON u.role_id = r.id
+        WHERE u.id = %s AND u.bot_token = %s
+        """,
+        (12340, _BOT),
+        ('users_pkey',),
+    ),
+    (
+        'autorizacion_correo',
+        "SELECT 1 FROM user_emails WHERE user_id = %s AND bot_token = %s AND email = %s LIMIT 1",
+        (12340, _BOT, 'user12340_0@example.com'),
+        ('user_emails_user_id_bot_token_email_key',),
+    ),
+    (
+        'correos_de_usuario',
+        "SELECT email FROM user_emails WHERE user_id = %s AND bot_token = %s",
+        (12340, _BOT),
+        ('user_emails_user_id_bot_token_email_key',),
+    ),
+    (
+        'busqueda_inversa_correo',
+        "SELECT user_id FROM user_emails WHERE bot_token = %s AND email = %s",
+        (_BOT, 'user12340_0@example.com'),
+        ('idx_user_emails_bot_token_email',),
+    ),
+    (
+        'list_revendedor',
+        "SELECT id, access_until FROM users WHERE bot_token = %s AND created_by = %s ORDER BY id",
+        (_BOT, _RESELLER),
+        ('idx_users_bot_token_created_by',),
+    ),
+    (
+        'conteo_revendedor',
+        "SELECT COUNT(*) FROM users WHERE created_by = %s AND bot_token = %s",
+        (_RESELLER, _BOT),
+        ('idx_users_bot_token_created_by',),
+    ),
+    (
+        'msg_allid',
+        "SELECT id FROM users WHERE bot_token = %s AND access_until > CURRENT_TIMESTAMP",
+        (_BOT,),
+        ('idx_users_bot_token_access_until',),
+    ),
+    (
+        'checktimeall_por_vencer',
+        """
+        SELECT id, access_until FROM users
+        WHERE bot_token = %s
+          AND (access_until < CURRENT_TIMESTAMP OR access_until < CURRENT_TIMESTAMP + INTERVAL '2 days')
+        ORDER BY access_until ASC
+        """,
+        (_BOT,),
+        ('idx_users_bot_token_access_until',),
+    ),
+]
+
+
+def _connect(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    return conn
+
+
+def apply_schema(conn):
+    """Aplica las mismas sentencias que database.migrations sobre la base de prueba."""
+    with conn.cursor() as cursor:
+        for version, name, statements in MIGRATIONS:
+            for statement in statements:
+                cursor.execute(statement)
+        logger.info(f"Esquema aplicado hasta la migración {MIGRATIONS[-1][0]}")
+
+
+def seed(conn, users, emails, bots):
+    """
+    Vacía users/user_emails y los rellena con generate_series en el servidor.
+    Reparte los usuarios entre `bots` tokens y 500 revendedores; ~5% vencen en
+    los próximos 2 días y ~20% ya están vencidos (por bloques de id, para que
+    la vigencia no dependa del bot).
+    """
+    emails_per_user = max(1, emails // users)
+    with conn.cursor() as cursor:
+        cursor.execute("TRUNCATE user_emails, users CASCADE")
+        t_start = time.perf_counter()
+        cursor.execute("""
+        INSERT INTO users (id, role_id, bot_token, access_until, created_by)
+        SELECT g,
+               (SELECT id FROM roles WHERE name = 'user'),
+               'bot_' || (g %% %s),
+               CASE WHEN (g / 997) %% 20 = 0 THEN now() + (g %% 48) * INTERVAL '1 hour'
+                    WHEN (g / 997) %% 5 = 1 THEN now() - (g %% 90) * INTERVAL '1 day'
+                    ELSE now() + (3 + g %% 90) * INTERVAL '1 day' END,
+               (g %% 500) + 1
+        FROM generate_series(1, %s) AS g
+        """, (bots, users))
+        logger.info(f"{users} usuarios sembrados en {time.perf_counter()-t_start:.1f}s")
+
+        t_start = time.perf_counter()
+        cursor.execute("""
+        INSERT INTO user_emails (user_id, bot_token, email)
+        SELECT u.id, u.bot_token, 'user' || u.id || '_' || n || '@example.com'
+        FROM users u CROSS JOIN generate_series(0, %s - 1) AS n
+        """, (emails_per_user,))
+        logger.info(f"{users * emails_per_user} correos sembrados en {time.perf_counter()-t_start:.1f}s")
+
+        cursor.execute("ANALYZE users")
+        cursor.execute("ANALYZE user_emails")
+
+
+def _walk(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from _walk(child)
+
+
+def explain(conn, query, params):
+    with conn.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def check_plan(plan, expected_indexes):
+    """Devuelve la lista de problemas del plan (vacía si es correcto)."""
+    problems = []
+    used = set()
+    for node in _walk(plan):
+        node_type = node.get('Node Type')
+        if node_type == 'Seq Scan' and node.get('Relation Name') in _CHECKED_TABLES:
+            problems.append(f"Seq Scan sobre {node['Relation Name']}")
+        if node_type in _INDEX_NODES:
+            used.add(node.get('Index Name'))
+    if not used.intersection(expected_indexes):
+        problems.append(
+            f"no usa {' / '.join(expected_indexes)} (índices usados: {', '.join(sorted(filter(None, used))) or 'ninguno'})"
+        )
+    return problems
+
+
+def run_checks(conn):
+    failures = 0
+    for name, query, params, expected_indexes in HOT_QUERIES:
+        plan = explain(conn, query, params)
+        problems = check_plan(plan, expected_indexes)
+        if problems:
+            failures += 1
+            print(f"❌ {name}: {'; '.join(problems)}")
+        else:
+            print(f"✅ {name}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('QUERY_PLANS_DSN'),
+                        help='DSN de una base DESECHABLE (o QUERY_PLANS_DSN)')
+    parser.add_argument('--seed', action='store_true', help='vaciar y sembrar users/user_emails')
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--emails', type=int, default=10_000_000)
+    parser.add_argument('--bots', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not args.dsn:
+        parser.error("Falta --dsn o QUERY_PLANS_DSN (nunca apuntar a la base de producción)")
+
+    conn = _connect(args.dsn)
+    try:
+        apply_schema(conn)
+        if args.seed:
+            seed(conn, args.users, args.emails, args.bots)
+        failures = run_checks(conn)
+    finally:
+        conn.close()
+
+    if failures:
+        print(f"\n{failures} consulta(s) sin el plan esperado")
+        return 1
+    print(f"\nTodas las consultas calientes ({len(HOT_QUERIES)}) usan índices")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,7 +4,9 @@ from datetime import datetime, timedelta
 from config import ADMIN_ID
 from utils.logger_utility import bot_logger
 from functools import wraps
-from database.connection import execute_query
+from database.async_db import db
+from database.models import add_user_emails, upsert_user_role
+from utils.authorization import authorization_service
 
 class AdminManager:
     def __init__(self):
@@ -16,15 +18,9 @@ class AdminManager:
         if user_id == ADMIN_ID:
             return True
             
-        # Verificar en la base de datos
+        # Verificar en la base de datos (servicio de autorización con caché)
         try:
-            result = execute_query("""
-            SELECT r.name FROM users u
-            JOIN roles r ON u.role_id = r.id
-            WHERE u.id = %s AND u.bot_token = %s
-            """, (user_id, bot_token))
-            
-            return result and result[0][0] in ['admin', 'super_admin']
+            return authorization_service.is_admin(user_id, bot_token)
         except Exception as e:
             bot_logger.log_error(f"Error verificando admin: {str(e)}")
             return False
@@ -44,7 +40,7 @@ def admin_required(func):
             return await func(update, context, *args, **kwargs)
             
         # Verificar si es admin en la base de datos
-        is_valid_admin = admin_manager.is_admin(user_id, bot_token)
+        is_valid_admin = await db.run(admin_manager.is_admin, user_id, bot_token)
         
         if not is_valid_admin:
             await update.message.reply_text("❌ Este comando está restringido solo para administradores.")
@@ -78,33 +74,14 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Formato de tiempo inválido. Use 'd' para días o 'm' para minutos.")
             return
             
-        # Obtener el ID del rol de admin
-        role_result = execute_query("SELECT id FROM roles WHERE name = 'admin'")
-        if not role_result:
+        # Crear o actualizar el usuario con rol de admin (una sola transacción)
+        role_found = await db.run_in_transaction(
+            upsert_user_role, user_id, context.bot.token, 'admin', expiration, update.effective_user.id
+        )
+        if not role_found:
             await update.message.reply_text("❌ Error: No se encontró el rol de administrador en la base de datos.")
             return
-            
-        admin_role_id = role_result[0][0]
-        
-        # Verificar si el usuario existe
-        user_exists = execute_query(
-            "SELECT id FROM users WHERE id = %s AND bot_token = %s",
-            (user_id, context.bot.token)
-        )
-        
-        if user_exists:
-            # Actualizar rol y tiempo de expiración
-            execute_query("""
-            UPDATE users 
-            SET role_id = %s, access_until = %s
-            WHERE id = %s AND bot_token = %s
-            """, (admin_role_id, expiration, user_id, context.bot.token))
-        else:
-            # Crear nuevo usuario con rol de admin
-            execute_query("""
-            INSERT INTO users (id, role_id, bot_token, access_until, created_by)
-            VALUES (%s, %s, %s, %s, %s)
-            """, (user_id, admin_role_id, context.bot.token, expiration, update.effective_user.id))
+        authorization_service.invalidate(context.bot.token, user_id)
             
         await update.message.reply_text(
             f"✅ Privilegios de administrador otorgados a {user_id}\n"
@@ -145,46 +122,24 @@ async def add_reseller_command(update: Update, context: ContextTypes.DEFAULT_TYP
         else:
             expiration = datetime.now() + timedelta(minutes=amount)
         
-        # Obtener el ID del rol de revendedor
-        role_result = execute_query("SELECT id FROM roles WHERE name = 'reseller'")
-        if not role_result:
-            await update.message.reply_text("❌ Error: No se encontró el rol de revendedor en la base de datos.")
-            return
-            
-        reseller_role_id = role_result[0][0]
+        def _add_reseller(tx):
+            # Usuario con rol de revendedor y sus correos en una sola transacción
+            if not upsert_user_role(tx, user_id, context.bot.token, 'reseller', expiration,
+                                    update.effective_user.id, clear_block=True):
+                return None
+            return add_user_emails(user_id, context.bot.token, emails, tx=tx)
         
-        # Verificar si el usuario existe
-        user_exists = execute_query(
-            "SELECT id FROM users WHERE id = %s AND bot_token = %s",
-            (user_id, context.bot.token)
-        )
-        
-        # Iniciar transacción para manejar múltiples inserciones
         try:
-            # Primero crear o actualizar el usuario como revendedor
-            if user_exists:
-                execute_query("""
-                UPDATE users 
-                SET role_id = %s, access_until = %s, blocked_reason = NULL
-                WHERE id = %s AND bot_token = %s
-                """, (reseller_role_id, expiration, user_id, context.bot.token))
-            else:
-                execute_query("""
-                INSERT INTO users (id, role_id, bot_token, access_until, created_by)
-                VALUES (%s, %s, %s, %s, %s)
-                """, (user_id, reseller_role_id, context.bot.token, expiration, update.effective_user.id))
-            
-            # Ahora agregar los emails autorizados
-            for email in emails:
-                execute_query("""
-                INSERT INTO user_emails (user_id, bot_token, email)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (user_id, bot_token, email) DO NOTHING
-                """, (user_id, context.bot.token, email.lower()))
+            result = await db.run_in_transaction(_add_reseller)
+            if result is None:
+                await update.message.reply_text("❌ Error: No se encontró el rol de revendedor en la base de datos.")
+                return
+            inserted, duplicates = result
+            authorization_service.invalidate(context.bot.token, user_id)
             
             await update.message.reply_text(
                 f"✅ Revendedor {user_id} añadido exitosamente\n"
-                f"📧 Correos autorizados: {len(emails)}\n"
+                f"📧 Correos autorizados: {len(inserted)} nuevos, {len(duplicates)} ya asignados\n"
                 f"⏱️ Expira: {expiration.strftime('%Y-%m-%d %H:%M:%S')}"
             )
             
@@ -207,38 +162,21 @@ async def remove_reseller_command(update: Update, context: ContextTypes.DEFAULT_
             
         user_id = int(context.args[0])
         
-        # Obtener el ID del rol de revendedor
-        role_result = execute_query("SELECT id FROM roles WHERE name = 'reseller'")
-        if not role_result:
-            await update.message.reply_text("❌ Error: No se encontró el rol de revendedor en la base de datos.")
-            return
-            
-        reseller_role_id = role_result[0][0]
-        
-        # Verificar si el usuario es un revendedor
-        user_role = execute_query("""
-        SELECT role_id FROM users 
-        WHERE id = %s AND bot_token = %s
+        # Cambiar el rol de revendedor a usuario normal en una sola sentencia;
+        # no devuelve filas si el usuario no existe o no es revendedor
+        demoted = await db.execute("""
+        UPDATE users u
+        SET role_id = (SELECT id FROM roles WHERE name = 'user')
+        FROM roles r
+        WHERE u.role_id = r.id AND r.name = 'reseller'
+          AND u.id = %s AND u.bot_token = %s
+        RETURNING u.id
         """, (user_id, context.bot.token))
         
-        if not user_role or user_role[0][0] != reseller_role_id:
+        if not demoted:
             await update.message.reply_text(f"❌ El usuario {user_id} no es un revendedor.")
             return
-            
-        # Obtener el ID del rol de usuario normal
-        user_role_result = execute_query("SELECT id FROM roles WHERE name = 'user'")
-        if not user_role_result:
-            await update.message.reply_text("❌ Error: No se encontró el rol de usuario en la base de datos.")
-            return
-            
-        user_role_id = user_role_result[0][0]
-        
-        # Cambiar el rol de revendedor a usuario normal
-        execute_query("""
-        UPDATE users 
-        SET role_id = %s
-        WHERE id = %s AND bot_token = %s
-        """, (user_role_id, user_id, context.bot.token))
+        authorization_service.invalidate(context.bot.token, user_id)
         
         await update.message.reply_text(f"✅ Revendedor {user_id} degradado a usuario normal exitosamente")
         
@@ -287,7 +225,7 @@ async def unblock_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             new_expiration = datetime.now() + timedelta(minutes=amount)
         
         # Verificar si el usuario existe
-        user_result = execute_query("""
+        user_result = await db.fetch("""
         SELECT access_until, blocked_reason FROM users
         WHERE id = %s AND bot_token = %s
         """, (user_id, bot_token))
@@ -309,7 +247,7 @@ async def unblock_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Desbloquear al usuario
         try:
-            execute_query("""
+            await db.execute("""
             UPDATE users 
             SET access_until = %s, blocked_reason = NULL
             WHERE id = %s AND bot_token = %s
@@ -317,11 +255,12 @@ async def unblock_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             # Si falla con blocked_reason, intentar sin ella
             bot_logger.log_error(f"Error actualizando con blocked_reason: {e}")
-            execute_query("""
+            await db.execute("""
             UPDATE users 
             SET access_until = %s
             WHERE id = %s AND bot_token = %s
             """, (new_expiration, user_id, bot_token))
+        authorization_service.invalidate(bot_token, user_id)
         
         # Mensaje de confirmación para el admin
         admin_message = (
@@ -402,7 +341,7 @@ async def msg_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Si es para todos los usuarios
         if target == "allid":
             # Obtener todos los usuarios válidos (no expirados)
-            user_results = execute_query("""
+            user_results = await db.fetch("""
             SELECT id FROM users
             WHERE bot_token = %s AND access_until > CURRENT_TIMESTAMP
             """, (bot_token,))
@@ -448,7 +387,7 @@ async def msg_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 user_id = int(target)
                 
                 # Verificar si el usuario existe
-                user_exists = execute_query("""
+                user_exists = await db.fetch("""
                 SELECT id FROM users
                 WHERE id = %s AND bot_token = %s
                 """, (user_id, bot_token))
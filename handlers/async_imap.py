@@ -0,0 +1,505 @@
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import ssl
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Literal IMAP al final de una línea: "{123}"
+_LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+# Respuesta no etiquetada con número: "* 12 FETCH (...)" / "* 3 EXISTS"
+_UNTAGGED_NUM_RE = re.compile(rb'^\* (\d+) ([A-Z-]+)(?: (.*))?$', re.IGNORECASE | re.DOTALL)
+# Respuesta no etiquetada sin número: "* SEARCH 1 2 3" / "* OK [UIDVALIDITY 7]"
+_UNTAGGED_RE = re.compile(rb'^\* ([A-Z-]+)(?: (.*))?$', re.IGNORECASE | re.DOTALL)
+# Código de respuesta entre corchetes: "[UIDNEXT 123]"
+_RESP_CODE_RE = re.compile(rb'^\[([A-Z-]+)(?: ([^\]]*))?\]', re.IGNORECASE)
+# Cadena citada de un argumento: "valor" (con escapes \" y \\)
+_QUOTED_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+# UID dentro de una respuesta FETCH
+_FETCH_UID_RE = re.compile(rb'\bUID (\d+)', re.IGNORECASE)
+# Atributos que también llegan en FETCH no solicitados (cambios de flags de otra sesión)
+_FETCH_FLAGS_ONLY_RE = re.compile(rb'\bUID \d+|\bFLAGS \([^)]*\)|\bMODSEQ \(\d+\)', re.IGNORECASE)
+
+# Respuestas no etiquetadas que pertenecen a un comando concreto; el resto
+# (EXISTS, RECENT, FLAGS, códigos OK...) son del EXAMINE o del IDLE en curso
+_UNTAGGED_OWNERS = {'SEARCH': 'UID SEARCH', 'STATUS': 'STATUS', 'FETCH': 'UID FETCH'}
+
+
+# Contador de comandos IMAP del contexto actual (lo usa el single-flight para medir el ahorro)
+imap_op_counter = contextvars.ContextVar('imap_op_counter', default=None)
+
+
+def count_imap_op(amount=1):
+    """Suma comandos IMAP al contador del contexto actual, si hay uno activo."""
+    counter = imap_op_counter.get()
+    if counter is not None:
+        counter[0] += amount
+
+
+class AsyncIMAPError(Exception):
+    """Error de protocolo o de conexión del cliente IMAP asíncrono."""
+
+
+class AsyncIMAPCommandError(AsyncIMAPError):
+    """El servidor respondió NO/BAD a un comando; la conexión sigue siendo válida."""
+
+
+class AsyncIMAPTimeout(AsyncIMAPError):
+    """Un comando superó el tiempo de espera; la conexión se cierra y hay que reconectar."""
+
+
+def _quote(value):
+    """Cita un argumento IMAP (igual que imaplib._quote)."""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _encode_command(line):
+    """
+    Codifica una línea de comando; cada cadena citada no ASCII se envía como
+    literal IMAP en lugar de en línea. Devuelve [(tramo, literal)]:
+    cada literal se envía tras la continuación del servidor; el último es None.
+    """
+    chunks = []
+    pos = 0
+    for match in _QUOTED_RE.finditer(line):
+        value = match.group(1)
+        if value.isascii():
+            continue
+        literal = re.sub(r'\\(.)', r'\1', value).encode('utf-8')
+        head = line[pos:match.start()].encode('utf-8') + b'{%d}' % len(literal)
+        chunks.append((head, literal))
+        pos = match.end()
+    chunks.append((line[pos:].encode('utf-8'), None))
+    return chunks
+
+
+def _parse_uid_set(message_set):
+    """Convierte "1,4:7,9:*" en [(1, 1), (4, 7), (9, None)] (None = sin límite)."""
+    ranges = []
+    for item in str(message_set).split(','):
+        low, _, high = item.partition(':')
+        try:
+            low = None if low == '*' else int(low)
+            high = low if not high else (None if high == '*' else int(high))
+        except ValueError:
+            continue
+        if low is None:
+            low, high = high, None
+        if low is not None and high is not None and high < low:
+            low, high = high, low
+        ranges.append((low or 0, high))
+    return ranges
+
+
+class _PendingCommand:
+    """Comando enviado a la espera de su respuesta etiquetada."""
+
+    __slots__ = ('tag', 'name', 'future', 'untagged', 'listener', 'uid_ranges')
+
+    def __init__(self, tag, name, future, listener=None, uid_ranges=None):
+        self.tag = tag
+        self.name = name
+        self.future = future
+        self.untagged = {}  # tipo -> [data, ...] con el mismo formato que imaplib
+        self.listener = listener  # callback(typ, data) para comandos de larga duración (IDLE)
+        self.uid_ranges = uid_ranges  # UIDs pedidos por un UID FETCH
+
+    def wants_uid(self, uid):
+        return any(low <= uid and (high is None or uid <= high) for low, high in self.uid_ranges or ())
+
+    def add_untagged(self, typ, data):
+        self.untagged.setdefault(typ, []).append(data)
+        if self.listener:
+            self.listener(typ, data)
+
+
+class AsyncIMAPClient:
+    """
+    Cliente IMAP sobre asyncio streams con pipelining de comandos.
+
+    Varios comandos pueden estar en vuelo a la vez sobre la misma conexión:
+    cada uno recibe una etiqueta y la tarea lectora despacha la respuesta
+    etiquetada a su future. Las respuestas no etiquetadas se asignan por
+    tipo: SEARCH y STATUS al comando pendiente más antiguo de ese tipo (el
+    servidor procesa en orden) y FETCH al UID FETCH que pidió ese UID; los
+    FETCH que solo traen flags son cambios de otra sesión y se descartan.
+    Los datos se devuelven con la misma forma que imaplib, para reutilizar
+    el parseo.
+
+    Si un comando vence su tiempo de espera la conexión se cierra y fallan
+    todos los comandos en vuelo: su respuesta tardía ya no se puede distinguir
+    de la de un comando posterior del mismo tipo, así que hay que reconectar.
+    """
+
+    def __init__(self, host, port=993, use_ssl=True, timeout=None, max_inflight=None):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.timeout = timeout or float(os.environ.get("IMAP_SOCKET_TIMEOUT", "30"))
+        self.selected_folder = None
+        self.last_used = time.time()
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._tag_counter = 0
+        self._pending = OrderedDict()  # tag -> _PendingCommand, en orden de envío
+        self._inflight = asyncio.Semaphore(
+            max_inflight or int(os.environ.get("IMAP_ASYNC_MAX_INFLIGHT", "16"))
+        )
+        self._closed = True
+        self._unsolicited = None  # callback(typ, data) para respuestas sin comando pendiente
+        self._write_lock = asyncio.Lock()  # un comando con literales no se intercala con otros
+        self._continuation = None  # future que espera el "+" antes de enviar un literal
+
+    @property
+    def is_open(self):
+        return not self._closed
+
+    async def connect(self):
+        """Abre la conexión, lee el saludo y arranca la tarea lectora."""
+        ssl_context = ssl.create_default_context() if self.use_ssl else None
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context, limit=2 ** 20),
+            self.timeout
+        )
+        greeting = await asyncio.wait_for(self._reader.readline(), self.timeout)
+        if not greeting.startswith(b'* OK') and not greeting.startswith(b'* PREAUTH'):
+            self._writer.close()
+            raise AsyncIMAPError(f"Saludo IMAP inesperado: {greeting!r}")
+        self._closed = False
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_response(self):
+        """Lee una respuesta completa (incluyendo literales) con el formato de imaplib."""
+        line = await self._reader.readline()
+        if not line:
+            raise AsyncIMAPError("Conexión IMAP cerrada por el servidor")
+        line = line.rstrip(b'\r\n')
+        items = []
+        while True:
+            literal_match = _LITERAL_RE.search(line)
+            if not literal_match:
+                items.append(line)
+                return items
+            literal = await self._reader.readexactly(int(literal_match.group(1)))
+            items.append((line, literal))
+            line = (await self._reader.readline()).rstrip(b'\r\n')
+
+    async def _read_loop(self):
+        """Tarea lectora: despacha cada respuesta al comando que le corresponde."""
+        try:
+            while True:
+                items = await self._read_response()
+                head = items[0][0] if isinstance(items[0], tuple) else items[0]
+
+                if head.startswith(b'* '):
+                    self._dispatch_untagged(head, items)
+                elif head.startswith(b'+'):
+                    # Continuación: para el literal que se está enviando o para el IDLE
+                    if self._continuation is not None and not self._continuation.done():
+                        self._continuation.set_result(head[1:].strip())
+                        continue
+                    oldest = next(iter(self._pending.values()), None)
+                    if oldest is not None and oldest.listener:
+                        oldest.listener('CONTINUE', head[1:].strip())
+                    elif self._unsolicited:
+                        self._unsolicited('CONTINUE', head[1:].strip())
+                else:
+                    tag, _, rest = head.partition(b' ')
+                    command = self._pending.pop(tag.decode('ascii', 'ignore'), None)
+                    if command is None:
+                        logger.warning(f"[ASYNC-IMAP] Respuesta con etiqueta desconocida: {head[:80]!r}")
+                        continue
+                    typ, _, text = rest.partition(b' ')
+                    if not command.future.done():
+                        command.future.set_result((typ.decode('ascii', 'ignore').upper(), text, command.untagged))
+        except Exception as e:
+            self._fail_pending(e)
+
+    def _dispatch_untagged(self, head, items):
+        """Normaliza una respuesta no etiquetada y la entrega al comando que la pidió."""
+        num_match = _UNTAGGED_NUM_RE.match(head)
+        if num_match:
+            typ = num_match.group(2).upper().decode('ascii', 'ignore')
+            data = num_match.group(1) + (b' ' + num_match.group(3) if num_match.group(3) else b'')
+        else:
+            match = _UNTAGGED_RE.match(head)
+            if not match:
+                return
+            typ = match.group(1).upper().decode('ascii', 'ignore')
+            data = match.group(2) or b''
+            # "* OK [UIDVALIDITY 7] ..." -> untagged['UIDVALIDITY'] = [b'7'] (como imaplib)
+            code_match = _RESP_CODE_RE.match(data)
+            if code_match:
+                code_typ = code_match.group(1).upper().decode('ascii', 'ignore')
+                self._deliver_untagged(self._owner_for(code_typ), code_typ, code_match.group(2) or b'')
+
+        if isinstance(items[0], tuple):
+            items[0] = (data, items[0][1])
+        else:
+            items[0] = data
+        owner = self._owner_for(typ, items)
+        for item in items:
+            self._deliver_untagged(owner, typ, item)
+
+    def _owner_for(self, typ, items=None):
+        """Comando pendiente al que pertenece una respuesta no etiquetada (o None)."""
+        name = _UNTAGGED_OWNERS.get(typ)
+        if name == 'UID FETCH':
+            return self._fetch_owner(items)
+        if name is not None:
+            return next((c for c in self._pending.values() if c.name == name), None)
+        for wanted in ('EXAMINE', 'IDLE'):
+            command = next((c for c in self._pending.values() if c.name == wanted), None)
+            if command is not None:
+                return command
+        return next(iter(self._pending.values()), None)
+
+    def _fetch_owner(self, items):
+        # Solo las partes fuera de literales: "12 (UID 345 BODY[1] {200}" ... ")"
+        meta = b' '.join(item[0] if isinstance(item, tuple) else item for item in items)
+        literal = any(isinstance(item, tuple) for item in items)
+        inner = meta.split(b' ', 1)[1] if b' ' in meta else b''
+        if not literal and not _FETCH_FLAGS_ONLY_RE.sub(b'', inner).strip(b' ()'):
+            return None
+        uid_match = _FETCH_UID_RE.search(meta)
+        if not uid_match:
+            return None
+        uid = int(uid_match.group(1))
+        return next(
+            (c for c in self._pending.values() if c.name == 'UID FETCH' and c.wants_uid(uid)), None
+        )
+
+    def _deliver_untagged(self, owner, typ, data):
+        if owner is not None:
+            owner.add_untagged(typ, data)
+        elif self._unsolicited:
+            self._unsolicited(typ, data)
+
+    def _fail_pending(self, exc):
+        """Marca la conexión como cerrada y propaga el error a todos los comandos en vuelo."""
+        self._closed = True
+        for command in self._pending.values():
+            if not command.future.done():
+                command.future.set_exception(AsyncIMAPError(f"Conexión IMAP perdida: {exc}"))
+            if command.listener:
+                command.listener('BYE', str(exc).encode())
+        self._pending.clear()
+        if self._unsolicited:
+            self._unsolicited('BYE', str(exc).encode())
+
+    async def command(self, name, *args, timeout=None):
+        """
+        Envía un comando sin esperar a los anteriores (pipelining).
+
+        Devuelve (typ, texto_final, untagged) donde untagged es un dict
+        tipo -> lista de datos en el formato de imaplib.
+        """
+        if self._closed:
+            raise AsyncIMAPError("Conexión IMAP cerrada")
+        async with self._inflight:
+            self._tag_counter += 1
+            tag = f"A{self._tag_counter:05d}"
+            future = asyncio.get_running_loop().create_future()
+            uid_ranges = _parse_uid_set(args[0]) if name == 'UID FETCH' and args else None
+            self._pending[tag] = _PendingCommand(tag, name, future, uid_ranges=uid_ranges)
+            count_imap_op()
+            chunks = _encode_command(' '.join([tag, name] + [str(a) for a in args]))
+            self.last_used = time.time()
+            try:
+                await self._send(chunks, future, timeout or self.timeout)
+                await self._writer.drain()
+                return await asyncio.wait_for(future, timeout or self.timeout)
+            except asyncio.TimeoutError:
+                # Una respuesta tardía se asignaría al siguiente comando del mismo
+                # tipo: la conexión deja de ser fiable para todos los que esperan
+                await self.close()
+                raise AsyncIMAPTimeout(f"Tiempo de espera agotado en {name}")
+
+    async def _send(self, chunks, future, timeout):
+        """Escribe un comando; antes de cada literal espera la continuación del servidor."""
+        async with self._write_lock:
+            for head, literal in chunks:
+                if literal is None:
+                    self._writer.write(head + b'\r\n')
+                    return
+                self._continuation = asyncio.get_running_loop().create_future()
+                self._writer.write(head + b'\r\n')
+                await self._writer.drain()
+                done, _ = await asyncio.wait(
+                    {self._continuation, future}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                self._continuation = None
+                if not done:
+                    raise asyncio.TimeoutError()
+                if future in done:
+                    # El servidor rechazó el comando (NO/BAD) sin pedir el literal
+                    return
+                self._writer.write(literal)
+
+    async def _simple(self, name, *args, want=None):
+        typ, text, untagged = await self.command(name, *args)
+        if typ != 'OK':
+            raise AsyncIMAPCommandError(f"{name} devolvió {typ}: {text.decode('utf-8', 'ignore')}")
+        return typ, untagged.get(want or name, [])
+
+    async def login(self, user, password):
+        await self._simple('LOGIN', _quote(user), _quote(password))
+
+    async def examine(self, folder):
+        """Selecciona la carpeta en solo lectura. Devuelve (uidvalidity, uidnext)."""
+        typ, text, untagged = await self.command('EXAMINE', _quote(folder))
+        if typ != 'OK':
+            raise AsyncIMAPCommandError(f"EXAMINE {folder} devolvió {typ}: {text.decode('utf-8', 'ignore')}")
+        validity = untagged.get('UIDVALIDITY') or [None]
+        uidnext = untagged.get('UIDNEXT') or [None]
+        self.selected_folder = folder
+        return (
+            int(validity[-1]) if validity[-1] else None,
+            int(uidnext[-1]) if uidnext[-1] else None
+        )
+
+    async def noop(self):
+        return await self._simple('NOOP')
+
+    async def status(self, folder, items):
+        return await self._simple('STATUS', _quote(folder), items)
+
+    async def uid_search(self, criteria):
+        if not criteria.isascii():
+            criteria = f'CHARSET UTF-8 {criteria}'
+        return await self._simple('UID SEARCH', criteria, want='SEARCH')
+
+    async def uid_fetch(self, message_set, items):
+        return await self._simple('UID FETCH', message_set, items, want='FETCH')
+
+    async def idle(self, timeout):
+        """
+        Entra en IDLE hasta que el servidor notifique cambios (EXISTS/EXPUNGE)
+        o venza timeout, y sale con DONE. Devuelve la lista de (tipo, data)
+        recibidos durante la espera. No se deben enviar otros comandos mientras tanto.
+        """
+        if self._closed:
+            raise AsyncIMAPError("Conexión IMAP cerrada")
+        events = []
+        woke = asyncio.Event()
+        continued = asyncio.Event()
+
+        def on_response(typ, data):
+            if typ == 'CONTINUE':
+                continued.set()
+                return
+            events.append((typ, data))
+            if typ in ('EXISTS', 'EXPUNGE', 'RECENT', 'BYE'):
+                woke.set()
+
+        async with self._inflight:
+            self._tag_counter += 1
+            tag = f"A{self._tag_counter:05d}"
+            future = asyncio.get_running_loop().create_future()
+            self._pending[tag] = _PendingCommand(tag, 'IDLE', future, listener=on_response)
+            count_imap_op()
+            async with self._write_lock:
+                self._writer.write(f"{tag} IDLE\r\n".encode('ascii'))
+            await self._writer.drain()
+            try:
+                await asyncio.wait_for(continued.wait(), self.timeout)
+                try:
+                    await asyncio.wait_for(woke.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                if self._closed:
+                    if future.done():
+                        future.exception()  # marcar como recuperada
+                    raise AsyncIMAPError("Conexión IMAP perdida durante IDLE")
+                self._writer.write(b'DONE\r\n')
+                await self._writer.drain()
+                typ, text, _ = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                self._pending.pop(tag, None)
+                await self.close()
+                raise AsyncIMAPError("Tiempo de espera agotado en IDLE")
+            if typ != 'OK':
+                raise AsyncIMAPCommandError(f"IDLE devolvió {typ}: {text.decode('utf-8', 'ignore')}")
+            self.last_used = time.time()
+            return events
+
+    async def close(self):
+        """Cierra la conexión sin esperar a LOGOUT si el stream ya no es usable."""
+        was_open = not self._closed
+        self._closed = True
+        if self._writer is not None:
+            try:
+                if was_open:
+                    self._writer.write(b'Z0000 LOGOUT\r\n')
+                self._writer.close()
+            except Exception:
+                pass
+        if self._reader_task is not None and not self._reader_task.done():
+            self._reader_task.cancel()
+        self._fail_pending(AsyncIMAPError("cliente cerrado"))
+
+
+class AsyncIMAPPool:
+    """
+    Un cliente asíncrono por (cuenta, carpeta), con la carpeta fija (EXAMINE).
+
+    Gracias al pipelining un mismo cliente atiende varias búsquedas en vuelo,
+    así que no hace falta un hilo ni una conexión por búsqueda.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._locks = {}
+        self._idle_timeout = float(os.environ.get("IMAP_ASYNC_IDLE_TIMEOUT", "300"))
+
+    async def get_client(self, config_key, config, folder):
+        key = (config_key, folder)
+        client = self._clients.get(key)
+        if client and client.is_open and time.time() - client.last_used < self._idle_timeout:
+            return client
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            client = self._clients.get(key)
+            if client and client.is_open:
+                if time.time() - client.last_used < self._idle_timeout:
+                    return client
+                await client.close()
+
+            t_connect = time.perf_counter()
+            client = AsyncIMAPClient(config['IMAP_SERVER'], int(config.get('IMAP_PORT') or 993))
+            await client.connect()
+            try:
+                await client.login(config['EMAIL_ACCOUNT'], config['PASSWORD'])
+                await client.examine(folder)
+            except Exception:
+                await client.close()
+                raise
+            self._clients[key] = client
+            logger.info(
+                f"[ASYNC-IMAP] Nueva conexión a {config['IMAP_SERVER']} ({folder}) "
+                f"en {time.perf_counter()-t_connect:.3f}s (key={config_key})"
+            )
+            return client
+
+    async def discard(self, client):
+        """Descarta un cliente que falló para que la próxima búsqueda reconecte."""
+        for key, existing in list(self._clients.items()):
+            if existing is client:
+                self._clients.pop(key, None)
+        await client.close()
+
+    async def close_all(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.close()
+
+
+# Instancia global del pool asíncrono
+async_imap_pool = AsyncIMAPPool()
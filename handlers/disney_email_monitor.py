@@ -9,6 +9,8 @@ import threading
 from datetime import datetime, timedelta
 from handlers.email_search_handlers import email_service
 from database.connection import execute_query
+from database.async_db import db
+from utils.authorization import authorization_service
 from config import ADMIN_ID
 
 logger = logging.getLogger(__name__)
@@ -135,62 +137,66 @@ class DisneyEmailMonitor:
             'member.services@disneyaccount.com'
         ]
 
-        for sender in disney_senders:
-            try:
-                # Seleccionar INBOX antes de buscar
-                status, _ = conn.select("INBOX", readonly=True)
-                if status != 'OK':
-                    logger.warning(
-                        f"[disney-monitor] Error al seleccionar INBOX para {sender}"
+        try:
+            for sender in disney_senders:
+                try:
+                    # Seleccionar INBOX antes de buscar
+                    status, _ = conn.select("INBOX", readonly=True)
+                    if status != 'OK':
+                        logger.warning(
+                            f"[disney-monitor] Error al seleccionar INBOX para {sender}"
+                        )
+                        continue
+
+                    search_criteria = (
+                        f'FROM "{sender}" TO "{email_addr}" SINCE {date_since}'
+                    )
+                    # Desempaquetamos live_conn para actualizar conn si hubo reconexión interna
+                    status, messages, conn = email_service.search_with_retry(
+                        conn, search_criteria, config=config, cid="disney-mon"
                     )
-                    continue
 
-                search_criteria = (
-                    f'FROM "{sender}" TO "{email_addr}" SINCE {date_since}'
-                )
-                # Desempaquetamos live_conn para actualizar conn si hubo reconexión interna
-                status, messages, conn = email_service.search_with_retry(
-                    conn, search_criteria, config=config, cid="disney-mon"
-                )
+                    if not messages[0]:
+                        continue
 
-                if not messages[0]:
-                    continue
+                    # Procesar los últimos 5 mensajes
+                    message_ids = messages[0].split()[-5:]
+
+                    for msg_id in message_ids:
+                        try:
+                            # Desempaquetamos live_conn para actualizar conn si hubo reconexión
+                            status, msg_data, conn = email_service.fetch_with_retry(
+                                conn, msg_id, '(RFC822)', config=config, cid="disney-mon"
+                            )
+                            if status != 'OK':
+                                continue
 
-                # Procesar los últimos 5 mensajes
-                message_ids = messages[0].split()[-5:]
+                            email_message = email_lib.message_from_bytes(msg_data[0][1])
+                            email_content = self._get_email_content(email_message)
+                            subject = email_message.get('Subject', '')
 
-                for msg_id in message_ids:
-                    try:
-                        # Desempaquetamos live_conn para actualizar conn si hubo reconexión
-                        status, msg_data, conn = email_service.fetch_with_retry(
-                            conn, msg_id, '(RFC822)', config=config, cid="disney-mon"
-                        )
-                        if status != 'OK':
-                            continue
+                            for pattern in self.compiled_patterns:
+                                if pattern.search(email_content) or pattern.search(subject):
+                                    logger.warning(
+                                        f"[disney-monitor] 🚨 Cambio de email detectado "
+                                        f"para user={user_id} email={email_addr}"
+                                    )
+                                    return True
 
-                        email_message = email_lib.message_from_bytes(msg_data[0][1])
-                        email_content = self._get_email_content(email_message)
-                        subject = email_message.get('Subject', '')
-
-                        for pattern in self.compiled_patterns:
-                            if pattern.search(email_content) or pattern.search(subject):
-                                logger.warning(
-                                    f"[disney-monitor] 🚨 Cambio de email detectado "
-                                    f"para user={user_id} email={email_addr}"
-                                )
-                                return True
-
-                    except Exception as e:
-                        logger.error(
-                            f"[disney-monitor] Error procesando mensaje de {sender}: {e}"
-                        )
-                        continue
+                        except Exception as e:
+                            logger.error(
+                                f"[disney-monitor] Error procesando mensaje de {sender}: {e}"
+                            )
+                            continue
 
-            except Exception as e:
-                logger.error(
-                    f"[disney-monitor] Error buscando emails de {sender}: {e}"
-                )
-                continue
+                except Exception as e:
+                    logger.error(
+                        f"[disney-monitor] Error buscando emails de {sender}: {e}"
+                    )
+                    continue
+        finally:
+            # Devolver el lease al pool de IMAP
+            email_service.release_connection(conn)
 
         return False
 
@@ -235,7 +241,7 @@ class DisneyEmailMonitor:
         try:
             await self._block_user(user_id, bot_token, email_addr)
 
-            user_info = execute_query("""
+            user_info = await db.fetch("""
             SELECT created_by FROM users
             WHERE id = %s AND bot_token = %s
             """, (user_id, bot_token))
@@ -265,7 +271,7 @@ class DisneyEmailMonitor:
 
             # Notificar a otros admins del bot
             try:
-                admin_results = execute_query("""
+                admin_results = await db.fetch("""
                 SELECT u.id FROM users u
                 JOIN roles r ON u.role_id = r.id
                 WHERE r.name IN ('admin', 'super_admin') AND u.bot_token = %s AND u.id != %s
@@ -324,7 +330,7 @@ class DisneyEmailMonitor:
                 f"el {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
             )
             try:
-                execute_query("""
+                await db.execute("""
                 UPDATE users
                 SET access_until = NOW() - INTERVAL '1 day',
                     blocked_reason = %s
@@ -335,11 +341,12 @@ class DisneyEmailMonitor:
                     f"[disney-monitor] Columna blocked_reason no existe, "
                     f"actualizando sin ella: {e}"
                 )
-                execute_query("""
+                await db.execute("""
                 UPDATE users
                 SET access_until = NOW() - INTERVAL '1 day'
                 WHERE id = %s AND bot_token = %s
                 """, (user_id, bot_token))
+            authorization_service.invalidate(bot_token, user_id)
 
             logger.info(
                 f"[disney-monitor] ✅ Usuario {user_id} bloqueado "
@@ -6,11 +6,20 @@ import time
 import socket
 import asyncio
 import uuid
+import os
+from collections import OrderedDict
 from email.header import decode_header
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.error import BadRequest, NetworkError, TimedOut
+from handlers.async_imap import (
+    async_imap_pool, AsyncIMAPError, AsyncIMAPCommandError, imap_op_counter, count_imap_op
+)
+from utils.imap_parsing import (
+    parse_fetch_response, first_literal, header_literal, parse_bodystructure, parse_rfc822_size,
+    find_text_parts, decode_part_payload
+)
 
 logger = logging.getLogger(__name__)
 
@@ -108,101 +117,45 @@ async def safe_answer_callback(query, text=None, show_alert=False):
 class EmailSearchService:
     def __init__(self):
         """Inicializa el servicio de búsqueda de correos con conexiones persistentes"""
-        self._connections = {}  # Almacena conexiones IMAP activas
-        self._last_used = {}    # Registra cuando se usó por última vez una conexión
+        self._idle_connections = {}  # Conexiones IMAP inactivas por cuenta: [{'conn', 'last_used'}]
+        self._leases = {}            # id(conn) -> lease activo {'key', 'conn', 'leased_at'}
+        self._leased_count = {}      # Conexiones prestadas (o en creación) por cuenta
+        self._last_checked = {}      # id(conn) -> última verificación de salud
+        self._pool_metrics = {}      # Métricas de lease por cuenta
         self._connection_timeout = 40  # Tiempo de expiración de conexiones en segundos
         self._lock = threading.Lock()  # Lock para thread safety
+        self._pool_cond = threading.Condition(self._lock)  # Cola de espera de leases
+        self._pool_max_per_account = int(os.environ.get("IMAP_POOL_MAX_PER_ACCOUNT", "10"))
+        self._pool_wait_timeout = float(os.environ.get("IMAP_POOL_WAIT_TIMEOUT", "20"))
+        self._pool_healthcheck_interval = float(os.environ.get("IMAP_POOL_HEALTHCHECK_INTERVAL", "15"))
+        self._stats = {'searches': 0, 'roundtrips_saved': 0, 'watermark_hits': 0}  # Métricas acumuladas del servicio
+        # Marcas UID por (cuenta, carpeta) y último resultado por búsqueda
+        self._mailbox_state = {}
+        self._search_cache = OrderedDict()
+        self._search_cache_ttl = int(os.environ.get("IMAP_SEARCH_CACHE_TTL", "600"))
+        self._search_cache_size = int(os.environ.get("IMAP_SEARCH_CACHE_SIZE", "5000"))
+        # Extracciones por mensaje (cuenta, carpeta, UID) y candidatos por destinatario/familia
+        self._families = {}
+        self._message_cache = OrderedDict()
+        self._candidate_cache = {}
+        self._message_cache_ttl = int(os.environ.get("IMAP_MESSAGE_CACHE_TTL", "30"))
+        # Búsquedas idénticas en vuelo (single-flight), síncronas y asíncronas
+        self._flights = {}
+        self._async_flights = {}
+        # Modo de descarga del cuerpo: "parts" (solo la sección de texto) o "rfc822" (mensaje completo)
+        self._fetch_mode = os.environ.get("IMAP_FETCH_MODE", "parts").lower()
+        self._max_message_bytes = int(os.environ.get("IMAP_MAX_MESSAGE_BYTES", str(5 * 1024 * 1024)))
         
     def get_imap_config(self, email_addr, bot_token=None):
         """Obtiene la configuración IMAP apropiada para un correo"""
-        # Si se proporciona token, buscar primero en la base de datos
+        # Si se proporciona token, buscar primero en el índice en memoria de imap_config
         if bot_token:
             try:
-                from database.connection import execute_query
+                from handlers.imap_manager import imap_config_resolver
                 
-                # Obtener todas las configuraciones IMAP para este bot
-                configs = execute_query(
-                    "SELECT domain, email, password, imap_server FROM imap_config WHERE bot_token = %s",
-                    (bot_token,)
-                )
-                
-                # Si hay configuraciones para este bot
-                if configs and len(configs) > 0:
-                    local_part = None
-                    domain = None
-                    gmail_config = None
-                    
-                    # Almacenar la configuración de Gmail si existe (para usar como respaldo)
-                    for config in configs:
-                        if config[0] == 'gmail.com':
-                            gmail_config = config
-                            break
-                    
-                    # Determinar la parte local y el dominio del correo proporcionado
-                    if '@' in email_addr:
-                        local_part, domain = email_addr.split('@', 1)
-                    else:
-                        local_part = email_addr  # Si no hay @, todo es parte local
-                        
-                    # 1. PRIMERA PRIORIDAD: Si tiene +, buscar por la parte antes del +
-                    if '+' in local_part:
-                        plus_prefix = local_part.split('+', 1)[0]
-                        logger.info(f"Correo con +: buscando configuración para prefijo: {plus_prefix}")
-                        
-                        # Buscar prefijo exacto
-                        for config_domain, config_email, config_password, config_server in configs:
-                            if config_domain == plus_prefix:
-                                logger.info(f"Usando configuración para prefijo: {plus_prefix}")
-                                return {
-                                    'EMAIL_ACCOUNT': config_email,
-                                    'PASSWORD': config_password,
-                                    'IMAP_SERVER': config_server,
-                                    'IMAP_PORT': 993
-                                }
-                    
-                    # 2. SEGUNDA PRIORIDAD: Buscar configuración para el dominio específico
-                    logger.info(f"Buscando configuración para dominio: {domain}")
-                    for config_domain, config_email, config_password, config_server in configs:
-                        if config_domain == domain:
-                            logger.info(f"Usando configuración para dominio específico: {domain}")
-                            return {
-                                'EMAIL_ACCOUNT': config_email,
-                                'PASSWORD': config_password,
-                                'IMAP_SERVER': config_server,
-                                'IMAP_PORT': 993
-                            }
-                    
-                    # 3. TERCERA PRIORIDAD: Si el dominio es gmail.com y no tiene +
-                    if domain == 'gmail.com' and '+' not in local_part and gmail_config:
-                        logger.info(f"Correo de Gmail sin +, usando configuración para gmail.com")
-                        _, config_email, config_password, config_server = gmail_config
-                        return {
-                            'EMAIL_ACCOUNT': config_email,
-                            'PASSWORD': config_password,
-                            'IMAP_SERVER': config_server,
-                            'IMAP_PORT': 993
-                        }
-                    
-                    # 4. ÚLTIMA PRIORIDAD: Usar la configuración de Gmail como respaldo
-                    if gmail_config:
-                        logger.warning(f"No se encontró configuración específica para {email_addr}, usando Gmail como respaldo")
-                        _, config_email, config_password, config_server = gmail_config
-                        return {
-                            'EMAIL_ACCOUNT': config_email,
-                            'PASSWORD': config_password,
-                            'IMAP_SERVER': config_server,
-                            'IMAP_PORT': 993
-                        }
-                    
-                    # Si no hay configuración de Gmail, usar la primera disponible
-                    logger.warning(f"No hay configuración de Gmail, usando la primera disponible")
-                    domain, email, password, server = configs[0]
-                    return {
-                        'EMAIL_ACCOUNT': email,
-                        'PASSWORD': password,
-                        'IMAP_SERVER': server,
-                        'IMAP_PORT': 993
-                    }
+                config = imap_config_resolver.resolve(email_addr, bot_token)
+                if config:
+                    return config
             except Exception as e:
                 logger.error(f"Error al obtener configuración IMAP de la BD: {e}")
                 # Continuar con el método tradicional si hay error
@@ -264,17 +217,29 @@ class EmailSearchService:
     def _discard_conn_from_pool(self, conn) -> str:
         """
         Descarta una conexión muerta del pool de forma thread-safe.
-        - Obtiene la clave bajo lock, luego hace logout sin lock (puede bloquear).
+        - Libera su lease (o la quita de las inactivas) bajo lock, luego hace
+          logout sin lock (puede bloquear).
         Devuelve la clave descartada o '' si no estaba en el pool.
         """
         key_to_remove = ""
-        with self._lock:
-            for key, c in list(self._connections.items()):
-                if c is conn:
-                    key_to_remove = key
-                    self._connections.pop(key, None)
-                    self._last_used.pop(key, None)
-                    break
+        with self._pool_cond:
+            lease = self._leases.pop(id(conn), None)
+            if lease:
+                key_to_remove = lease['key']
+                self._leased_count[key_to_remove] -= 1
+            else:
+                for key, idle in self._idle_connections.items():
+                    for item in idle:
+                        if item['conn'] is conn:
+                            idle.remove(item)
+                            key_to_remove = key
+                            break
+                    if key_to_remove:
+                        break
+            self._last_checked.pop(id(conn), None)
+            if key_to_remove:
+                self._pool_metric(key_to_remove)['discarded'] += 1
+                self._pool_cond.notify()
         # Logout fuera del lock para evitar bloquear otros hilos durante operación de red
         if key_to_remove:
             try:
@@ -318,91 +283,180 @@ class EmailSearchService:
         except Exception as e:
             raise Exception(f"Error de conexión IMAP: {str(e)}")
     
+    def _pool_metric(self, config_key):
+        """Métricas del pool por cuenta (llamar con el lock tomado)."""
+        metric = self._pool_metrics.get(config_key)
+        if metric is None:
+            metric = {
+                'leases': 0, 'created': 0, 'discarded': 0, 'waits': 0, 'timeouts': 0,
+                'wait_total': 0.0, 'wait_max': 0.0, 'peak_leased': 0
+            }
+            self._pool_metrics[config_key] = metric
+        return metric
+
+    def _close_quietly(self, conns, reason):
+        """Hace logout de una lista de (key, conn) fuera del lock."""
+        for key, conn in conns:
+            try:
+                conn.logout()
+            except Exception:
+                pass
+            logger.debug(f"[IMAP-POOL] Conexión {reason} descartada (key={key})")
+
     def get_connection(self, config):
         """
-        Obtiene una conexión del pool o crea una nueva.
-
-        Patrón fast-path / slow-path / commit:
-          - fast-path: consulta el pool DENTRO del lock (operación rápida).
-          - slow-path: conecta FUERA del lock para no serializar los hilos
-                       que necesitan conexiones simultáneas.
-          - commit: registra la nueva conexión DENTRO del lock; si otro hilo
-                    ya conectó mientras tanto, descarta la nuestra.
-        """
-        config_key = f"{config['IMAP_SERVER']}_{config['EMAIL_ACCOUNT']}"
-        current_time = time.time()
+        Obtiene en exclusiva (lease) una conexión del pool de la cuenta.
 
-        # ── FAST PATH ──────────────────────────────────────────────────────
+        Cada cuenta admite hasta IMAP_POOL_MAX_PER_ACCOUNT conexiones; si están
+        todas prestadas se espera en cola hasta IMAP_POOL_WAIT_TIMEOUT segundos.
+        El caller DEBE devolverla con release_connection() (o descartarla con
+        _discard_conn_from_pool si murió).
+
+          - fast-path: reutiliza una conexión inactiva DENTRO del lock.
+          - slow-path: reserva el hueco y conecta FUERA del lock para no
+                       serializar los hilos que necesitan conexiones simultáneas.
+        """
+        config_key = self._config_key(config)
+        t_wait = time.perf_counter()
+        deadline = time.monotonic() + self._pool_wait_timeout
         stale_conns = []  # recolectar conns expiradas para logout FUERA del lock
-        with self._lock:
-            # Limpiar conexiones expiradas: pop bajo lock, logout posterior fuera del lock
-            for key in list(self._connections.keys()):
-                if current_time - self._last_used.get(key, 0) > self._connection_timeout:
-                    expired_conn = self._connections.pop(key, None)
-                    self._last_used.pop(key, None)
-                    if expired_conn:
-                        stale_conns.append((key, expired_conn))
-
-            if config_key in self._connections:
-                conn = self._connections[config_key]
-                try:
-                    conn.noop()
-                    self._last_used[config_key] = current_time
-                    logger.debug(f"[IMAP-POOL] Reutilizando conexión existente (key={config_key})")
-                    # Logout de expiradas fuera del lock antes de retornar
-                    for s_key, s_conn in stale_conns:
-                        try:
-                            s_conn.logout()
-                        except Exception:
-                            pass
-                        logger.debug(f"[IMAP-POOL] Conexión expirada descartada (key={s_key})")
-                    return conn
-                except Exception as e:
-                    logger.warning(
-                        f"[IMAP-POOL] noop() falló en fast-path, descartando (key={config_key}): {e}"
-                    )
-                    self._connections.pop(config_key, None)
-                    self._last_used.pop(config_key, None)
-                    # cae al slow-path
+        conn = None
+        waited = False
+        timed_out = False
+
+        with self._pool_cond:
+            while True:
+                current_time = time.time()
+                # Limpiar conexiones inactivas expiradas de todas las cuentas
+                for key, idle in self._idle_connections.items():
+                    for item in list(idle):
+                        if current_time - item['last_used'] > self._connection_timeout:
+                            idle.remove(item)
+                            self._last_checked.pop(id(item['conn']), None)
+                            stale_conns.append((key, item['conn']))
+
+                idle = self._idle_connections.get(config_key)
+                if idle:
+                    # LIFO: la más reciente tiene más probabilidad de seguir viva
+                    conn = idle.pop()['conn']
+                    break
+                if self._leased_count.get(config_key, 0) < self._pool_max_per_account:
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                waited = True
+                self._pool_cond.wait(remaining)
+
+            wait_time = time.perf_counter() - t_wait
+            metric = self._pool_metric(config_key)
+            if timed_out:
+                metric['timeouts'] += 1
+            else:
+                # Reservar el hueco antes de soltar el lock (también en el slow-path)
+                self._leased_count[config_key] = self._leased_count.get(config_key, 0) + 1
+                metric['leases'] += 1
+                metric['peak_leased'] = max(metric['peak_leased'], self._leased_count[config_key])
+                if waited:
+                    metric['waits'] += 1
+                    metric['wait_total'] += wait_time
+                    metric['wait_max'] = max(metric['wait_max'], wait_time)
 
         # Logout de conns expiradas fuera del lock (I/O de red no bloquea a otros)
-        for s_key, s_conn in stale_conns:
+        self._close_quietly(stale_conns, "expirada")
+        if timed_out:
+            raise Exception(
+                f"Tiempo de espera agotado ({self._pool_wait_timeout}s) para obtener "
+                f"conexión IMAP (key={config_key}, máximo={self._pool_max_per_account})"
+            )
+        if waited:
+            logger.info(f"[IMAP-POOL] Lease obtenido tras esperar {wait_time:.3f}s (key={config_key})")
+
+        if conn is not None:
+            logger.debug(f"[IMAP-POOL] Reutilizando conexión existente (key={config_key})")
+        else:
+            # ── SLOW PATH (fuera del lock) ─────────────────────────────────────
+            logger.info(f"[IMAP-POOL] Creando nueva conexión a {config['IMAP_SERVER']} (key={config_key})")
             try:
-                s_conn.logout()
+                conn = self.connect_to_imap(config)
             except Exception:
-                pass
-            logger.debug(f"[IMAP-POOL] Conexión expirada descartada (key={s_key})")
+                with self._pool_cond:
+                    self._leased_count[config_key] -= 1
+                    self._pool_cond.notify()
+                raise
+            with self._lock:
+                self._pool_metric(config_key)['created'] += 1
+                self._last_checked[id(conn)] = time.time()
+
+        with self._lock:
+            self._leases[id(conn)] = {'key': config_key, 'conn': conn, 'leased_at': time.time()}
+        return conn
 
-        # ── SLOW PATH (fuera del lock) ─────────────────────────────────────
-        logger.info(f"[IMAP-POOL] Creando nueva conexión a {config['IMAP_SERVER']} (key={config_key})")
-        new_conn = self.connect_to_imap(config)
+    def release_connection(self, conn):
+        """
+        Devuelve una conexión al pool tras usarla.
 
-        # ── COMMIT ────────────────────────────────────────────────────────
+        Health check al devolver: si el estado no es utilizable, o si pasó más de
+        IMAP_POOL_HEALTHCHECK_INTERVAL desde la última verificación y noop() falla,
+        la conexión se descarta en vez de volver al pool.
+        """
+        if conn is None:
+            return
         with self._lock:
-            if config_key in self._connections:
-                # Otro hilo conectó mientras estábamos en slow-path; usar la suya.
-                existing = self._connections[config_key]
-                try:
-                    new_conn.logout()
-                except Exception:
-                    pass
-                logger.debug(
-                    f"[IMAP-POOL] Conexión duplicada descartada (key={config_key}), "
-                    "usando la existente."
-                )
-                return existing
-            self._connections[config_key] = new_conn
-            self._last_used[config_key] = time.time()
-            logger.info(f"[IMAP-POOL] Nueva conexión registrada en pool (key={config_key})")
-            return new_conn
+            lease = self._leases.get(id(conn))
+            last_checked = self._last_checked.get(id(conn), 0)
+        if lease is None:
+            return
+
+        healthy = getattr(conn, 'state', 'AUTH') in ('AUTH', 'SELECTED')
+        checked = False
+        if healthy and time.time() - last_checked > self._pool_healthcheck_interval:
+            checked = True
+            try:
+                healthy = conn.noop()[0] == 'OK'
+            except Exception as e:
+                logger.debug(f"[IMAP-POOL] noop() falló al devolver conexión (key={lease['key']}): {e}")
+                healthy = False
+        if not healthy:
+            self._discard_conn_from_pool(conn)
+            return
+
+        now = time.time()
+        with self._pool_cond:
+            if self._leases.pop(id(conn), None) is None:
+                return
+            if checked:
+                self._last_checked[id(conn)] = now
+            self._leased_count[lease['key']] -= 1
+            self._idle_connections.setdefault(lease['key'], []).append({'conn': conn, 'last_used': now})
+            self._pool_cond.notify()
+
+    def get_pool_stats(self):
+        """Utilización del pool y tiempos de espera de lease por cuenta."""
+        with self._lock:
+            stats = {}
+            for key in set(self._pool_metrics) | set(self._idle_connections):
+                metric = dict(self._pool_metric(key))
+                leased = self._leased_count.get(key, 0)
+                metric['leased'] = leased
+                metric['idle'] = len(self._idle_connections.get(key, []))
+                metric['max'] = self._pool_max_per_account
+                metric['utilization'] = round(leased / self._pool_max_per_account, 3)
+                metric['wait_avg'] = round(metric['wait_total'] / metric['waits'], 3) if metric['waits'] else 0.0
+                stats[key] = metric
+            return stats
     
-    def search_with_retry(self, conn, criteria, config=None, max_retries=2, cid="-"):
+    def search_with_retry(self, conn, criteria, config=None, max_retries=2, cid="-", uid=False, folder=None):
         """
         Busca en IMAP con reintentos seguros.
 
         Devuelve (status, messages, live_conn).
         `live_conn` puede ser diferente de `conn` si se reconectó internamente;
         el caller DEBE usarla para operaciones posteriores (fetch, select).
+        Con uid=True se usa UID SEARCH; si se indica `folder`, se vuelve a
+        seleccionar tras una reconexión.
 
         time.sleep() aquí es CORRECTO: siempre corre en un thread del executor.
         """
@@ -410,7 +464,11 @@ class EmailSearchService:
         reconnect_count = 0
         for attempt in range(max_retries + 1):
             try:
-                status, messages = current_conn.search(None, criteria)
+                count_imap_op()
+                if uid:
+                    status, messages = current_conn.uid('SEARCH', None, criteria)
+                else:
+                    status, messages = current_conn.search(None, criteria)
                 return status, messages, current_conn
             except Exception as e:
                 if attempt < max_retries and self._is_dead_connection(e):
@@ -429,23 +487,28 @@ class EmailSearchService:
                     # Jitter mínimo (sync, OK en executor)
                     time.sleep(0.5 + attempt * 0.5)
                     current_conn = self.get_connection(config)
+                    if folder:
+                        current_conn.select(folder, readonly=True)
                     logger.info(
                         f"[{cid}][IMAP-SEARCH] Reconectado (key={dead_key}), "
                         "reintentando búsqueda..."
                     )
                     continue
-                # Error no recuperable o reintentos agotados
+                # Error no recuperable o reintentos agotados: devolver el lease propio
+                if current_conn is not conn:
+                    self._discard_conn_from_pool(current_conn)
                 raise Exception(
                     f"[{cid}] Error en búsqueda IMAP tras {attempt+1} intento(s): {str(e)}"
                 )
 
-    def fetch_with_retry(self, conn, msg_id, format_string, config=None, max_retries=2, cid="-"):
+    def fetch_with_retry(self, conn, msg_id, format_string, config=None, max_retries=2, cid="-", uid=False, folder=None):
         """
         Recupera un mensaje IMAP con reintentos seguros.
 
         Devuelve (status, data, live_conn).
         `live_conn` puede ser diferente de `conn` si se reconectó internamente;
         el caller DEBE usarla para operaciones posteriores.
+        Con uid=True `msg_id` se interpreta como UID (UID FETCH).
 
         time.sleep() es seguro aquí (executor).
         """
@@ -453,7 +516,11 @@ class EmailSearchService:
         reconnect_count = 0
         for attempt in range(max_retries + 1):
             try:
-                status, data = current_conn.fetch(msg_id, format_string)
+                count_imap_op()
+                if uid:
+                    status, data = current_conn.uid('FETCH', msg_id, format_string)
+                else:
+                    status, data = current_conn.fetch(msg_id, format_string)
                 return status, data, current_conn
             except Exception as e:
                 if attempt < max_retries and self._is_dead_connection(e):
@@ -471,11 +538,15 @@ class EmailSearchService:
                         )
                     time.sleep(0.5 + attempt * 0.5)
                     current_conn = self.get_connection(config)
+                    if folder:
+                        current_conn.select(folder, readonly=True)
                     logger.info(
                         f"[{cid}][IMAP-FETCH] Reconectado (key={dead_key}), "
                         "reintentando fetch..."
                     )
                     continue
+                if current_conn is not conn:
+                    self._discard_conn_from_pool(current_conn)
                 raise Exception(
                     f"[{cid}] Error en fetch IMAP tras {attempt+1} intento(s): {str(e)}"
                 )
@@ -509,55 +580,371 @@ class EmailSearchService:
             
             return folders
         finally:
-            # No cerramos la conexión aquí para mantenerla persistente
-            pass
+            # Devolver el lease al pool para que otro hilo pueda usarla
+            self.release_connection(conn)
     
-    def search_emails(self, email_addr, service, regex_type=None, folder="INBOX", days_back=1, bot_token=None, user_id=None):
-        """Busca correos usando una expresión regular según el servicio y devuelve el resultado."""
-        cid = str(uuid.uuid4())[:8]  # correlation-id por búsqueda
-        t_start = time.perf_counter()
-        logger.info(f"[{cid}] Iniciando búsqueda service={service} type={regex_type or 'default'} email={email_addr}")
+    # Solo las cabeceras necesarias para validar remitente/destinatario
+    _HEADER_FIELDS = 'BODY.PEEK[HEADER.FIELDS (FROM TO DATE SUBJECT)]'
+
+    def _header_fetch_items(self):
+        """Atributos del FETCH en lote: cabeceras, tamaño y, en modo parts, BODYSTRUCTURE."""
+        if self._fetch_mode == 'parts':
+            return f'(RFC822.SIZE BODYSTRUCTURE {self._HEADER_FIELDS})'
+        return f'(RFC822.SIZE {self._HEADER_FIELDS})'
+
+    def _bump_stat(self, name, amount=1):
+        """Incrementa un contador de métricas de forma thread-safe."""
+        with self._lock:
+            self._stats[name] = self._stats.get(name, 0) + amount
+
+    def get_stats(self):
+        """Devuelve una copia de las métricas acumuladas del servicio."""
+        with self._lock:
+            return dict(self._stats)
+
+    def _headers_match(self, email_headers, from_addresses, email_addr):
+        """Valida remitente y destinatario a partir de las cabeceras ya descargadas."""
+        from_value = email_headers.get('From', '')
+        if not any(addr.lower() in from_value.lower() for addr in from_addresses):
+            return False
         
-        # Verificación de acceso
+        # Verificar destinatario si se especificó un correo
+        if '@' in email_addr:
+            to_value = email_headers.get('To', '').lower()
+            email_addr_lower = email_addr.lower()
+            
+            if email_addr_lower not in to_value:
+                # Verificar si es un correo con formato user+tag@domain
+                if '+' not in email_addr_lower:
+                    return False
+                base_email = email_addr_lower.split('@')[0].split('+')[0]
+                domain = email_addr_lower.split('@')[1]
+                pattern = f"{base_email}+[^@]*@{domain}"
+                if not re.search(pattern, to_value):
+                    return False
+        return True
+
+    def _build_result(self, result, email_message, subject):
+        """Construye el dict de resultado a partir del valor extraído."""
+        result = result.replace('amp;', '')
+        return {
+            'result': result,
+            'is_link': result.startswith('http'),
+            'subject': subject,
+            'date': email_message.get('Date', ''),
+            'from': email_message.get('From', '')
+        }
+
+    def _message_bodies(self, email_message):
+        """Cuerpos decodificados del mensaje en orden de prioridad (HTML primero, luego texto plano)."""
+        if not email_message.is_multipart():
+            try:
+                return [email_message.get_payload(decode=True).decode('utf-8', 'ignore')]
+            except Exception as e:
+                logger.error(f"Error al procesar mensaje no multiparte: {e}")
+                return []
+        
+        # Primero en HTML (más común tener los códigos/enlaces aquí), luego texto plano
+        bodies = []
+        for content_type in ("text/html", "text/plain"):
+            for part in email_message.walk():
+                if part.get_content_type() != content_type:
+                    continue
+                try:
+                    bodies.append(part.get_payload(decode=True).decode('utf-8', 'ignore'))
+                except Exception as e:
+                    logger.error(f"Error al procesar parte {content_type}: {e}")
+        return bodies
+
+    def _match_body(self, body, body_regex, email_headers, subject):
+        """Aplica la regex a un cuerpo ya decodificado."""
+        match = body_regex.search(body)
+        if not match:
+            return None
+        return self._build_result(match.group(1) if match.groups() else match.group(0), email_headers, subject)
+
+    def _scan_body(self, body, family, found, email_headers, subject):
+        """Aplica al cuerpo todas las regex de la familia que aún no tienen resultado."""
+        for key, regex in family.items():
+            if key in found:
+                continue
+            result = self._match_body(body, regex, email_headers, subject)
+            if result:
+                found[key] = result
+
+    def _ordered_text_parts(self, entry):
+        """Secciones de texto del BODYSTRUCTURE (HTML primero), o [] si no aplica el modo parts."""
+        if self._fetch_mode != 'parts':
+            return []
+        text_parts = find_text_parts(parse_bodystructure(entry['meta']))
+        return [p for p in text_parts if p['subtype'] == 'html'] + [p for p in text_parts if p['subtype'] == 'plain']
+
+    def _decode_part(self, msg_data, part, cid):
+        """Decodifica la respuesta de un BODY.PEEK[n], o None si no se pudo."""
+        if not msg_data or not msg_data[0]:
+            return None
+        entries = parse_fetch_response(msg_data)
+        payload = first_literal(entries[0]) if entries else b''
+        self._bump_stat('part_bytes', len(payload))
+        try:
+            return decode_part_payload(payload, part['encoding'], part['charset'])
+        except Exception as e:
+            logger.error(f"[{cid}] Error al decodificar sección {part['section']}: {e}")
+            return None
+
+    def _scan_rfc822(self, msg_data, family, email_headers):
+        """
+        Parsea la respuesta de un FETCH (RFC822) y aplica todas las regex de la familia.
+        Devuelve (encontrados, completo).
+        """
+        entries = parse_fetch_response(msg_data) if msg_data and msg_data[0] else []
+        raw_email = first_literal(entries[0]) if entries else b''
+        if not raw_email:
+            return {}, False
+        self._bump_stat('rfc822_bytes', len(raw_email))
+        email_message = email.message_from_bytes(raw_email)
+        subject = self.decode_email_subject(email_headers.get('Subject', ''))
+        found = {}
+        for body in self._message_bodies(email_message):
+            self._scan_body(body, family, found, email_headers, subject)
+        return found, True
+
+    def _extract_from_parts(self, conn, msg_id, text_parts, regex_key, family, email_headers, config, cid, folder):
+        """
+        Descarga solo las secciones text/html y text/plain (BODY.PEEK[n]) y aplica
+        todas las regex de la familia, deteniéndose cuando aparece regex_key.
+        Devuelve (encontrados, completo, conn, secciones_descargadas); completo indica
+        que se examinaron todas las secciones.
+        """
+        subject = self.decode_email_subject(email_headers.get('Subject', ''))
+        found = {}
+        complete = True
+        fetched = 0
+        for index, part in enumerate(text_parts):
+            t_part = time.perf_counter()
+            status, msg_data, conn = self.fetch_with_retry(
+                conn, msg_id, f"(BODY.PEEK[{part['section']}])", config=config, cid=cid,
+                uid=True, folder=folder
+            )
+            fetched += 1
+            logger.debug(
+                f"[{cid}] fetch_part() sección={part['section']} ({part['subtype']}) "
+                f"en {time.perf_counter()-t_part:.3f}s"
+            )
+            body = self._decode_part(msg_data, part, cid) if status == 'OK' else None
+            if body is None:
+                complete = False
+                continue
+            self._scan_body(body, family, found, email_headers, subject)
+            if regex_key in found:
+                return found, complete and index == len(text_parts) - 1, conn, fetched
+        return found, complete, conn, fetched
+
+    def _pattern_family(self, from_key):
+        """Regex compiladas de todas las claves de REGEX_PATTERNS con los mismos remitentes."""
+        with self._lock:
+            family = self._families.get(from_key)
+        if family is None:
+            family = {}
+            for key, pattern in REGEX_PATTERNS.items():
+                if self._from_key_for(key) == from_key:
+                    try:
+                        family[key] = re.compile(pattern, re.IGNORECASE | re.DOTALL)
+                    except re.error as e:
+                        raise Exception(f"Error en la expresión regular: {str(e)}")
+            with self._lock:
+                self._families[from_key] = family
+        return family
+
+    @staticmethod
+    def _from_key_for(regex_key):
+        """Clave de FROM_ADDRESSES que corresponde a una clave de REGEX_PATTERNS."""
+        if regex_key in FROM_ADDRESSES:
+            return regex_key
+        return regex_key.split('_')[0]
+
+    def _cached_extraction(self, config_key, folder, uidvalidity, uid, regex_key):
+        """
+        Devuelve (conocido, resultado) de regex_key para un mensaje ya escaneado.
+        La clave lleva UIDVALIDITY: si el buzón se renumera, un UID reutilizado no
+        devuelve lo extraído de otro mensaje.
+        """
+        if uidvalidity is None:
+            return False, None
+        key = (config_key, folder, uidvalidity, uid)
+        with self._lock:
+            entry = self._message_cache.get(key)
+            if entry is None:
+                return False, None
+            if time.time() - entry['stored_at'] > self._message_cache_ttl:
+                self._message_cache.pop(key, None)
+                return False, None
+            if regex_key in entry['found']:
+                return True, entry['found'][regex_key]
+            return entry['complete'], None
+
+    def _store_extraction(self, config_key, folder, uidvalidity, uid, found, complete):
+        """Guarda los valores extraídos de un mensaje para todas las claves de la familia."""
+        if uidvalidity is None:
+            return
+        key = (config_key, folder, uidvalidity, uid)
+        with self._lock:
+            entry = self._message_cache.get(key)
+            if entry and time.time() - entry['stored_at'] <= self._message_cache_ttl:
+                entry['found'].update(found)
+                entry['complete'] = entry['complete'] or complete
+            else:
+                self._message_cache[key] = {'found': dict(found), 'complete': complete, 'stored_at': time.time()}
+            self._message_cache.move_to_end(key)
+            while len(self._message_cache) > self._search_cache_size:
+                self._message_cache.popitem(last=False)
+
+    def _store_candidates(self, candidate_key, uids, uidvalidity, uidnext, incremental):
+        """
+        Recuerda los candidatos (más recientes primero) de un destinatario y familia,
+        junto al UIDNEXT leído antes del UID SEARCH que los produjo.
+        """
+        with self._lock:
+            previous = self._candidate_cache.get(candidate_key)
+            if incremental and previous and previous['uidvalidity'] == uidvalidity:
+                uids = uids + [uid for uid in previous['uids'] if uid not in uids]
+            elif incremental:
+                # Sin la lista previa no se sabe qué hay en los UIDs ya escaneados
+                self._candidate_cache.pop(candidate_key, None)
+                return
+            if uidvalidity is None or uidnext is None:
+                # Sin marca UID no se puede comprobar después si llegó correo nuevo
+                self._candidate_cache.pop(candidate_key, None)
+                return
+            self._candidate_cache[candidate_key] = {
+                'uids': uids[:10], 'uidvalidity': uidvalidity, 'uidnext': uidnext,
+                'stored_at': time.time()
+            }
+
+    def _has_candidates(self, candidate_key):
+        """True si hay candidatos vigentes que justifiquen un STATUS previo."""
+        with self._lock:
+            candidates = self._candidate_cache.get(candidate_key)
+            return bool(candidates) and time.time() - candidates['stored_at'] <= self._message_cache_ttl
+
+    def _serve_from_message_cache(self, candidate_key, regex_key, watermark, cid):
+        """
+        Responde sin UID SEARCH si los candidatos recientes ya fueron escaneados para
+        regex_key y el buzón no ha cambiado desde entonces. watermark es el
+        (UIDVALIDITY, UIDNEXT) de un STATUS recién hecho. Devuelve (acierto, resultado).
+        """
+        if watermark is None:
+            return False, None
+        config_key, folder = candidate_key[0], candidate_key[1]
+        with self._lock:
+            candidates = self._candidate_cache.get(candidate_key)
+            if candidates and time.time() - candidates['stored_at'] > self._message_cache_ttl:
+                self._candidate_cache.pop(candidate_key, None)
+                candidates = None
+        if not candidates:
+            return False, None
+        # Un UIDNEXT distinto significa correo nuevo que los candidatos no incluyen
+        if (candidates['uidvalidity'], candidates['uidnext']) != tuple(watermark):
+            return False, None
+        for uid in candidates['uids']:
+            known, result = self._cached_extraction(config_key, folder, candidates['uidvalidity'], uid, regex_key)
+            if not known:
+                return False, None
+            if result:
+                self._bump_stat('message_cache_hits', 1)
+                logger.info(f"[{cid}] Resultado servido desde caché de mensajes (UID {uid.decode()})")
+                return True, result
+        self._bump_stat('message_cache_hits', 1)
+        logger.info(f"[{cid}] Candidatos recientes ya escaneados sin coincidencia (caché de mensajes)")
+        return True, None
+
+    def _config_key(self, config):
+        """Clave que identifica una cuenta IMAP (servidor + cuenta)."""
+        return f"{config['IMAP_SERVER']}_{config['EMAIL_ACCOUNT']}"
+
+    _STATUS_UIDNEXT_RE = re.compile(rb'UIDNEXT\s+(\d+)', re.IGNORECASE)
+    _STATUS_UIDVALIDITY_RE = re.compile(rb'UIDVALIDITY\s+(\d+)', re.IGNORECASE)
+
+    def _mailbox_status(self, conn, folder):
+        """Consulta UIDVALIDITY/UIDNEXT con STATUS (sin SELECT ni SEARCH)."""
+        count_imap_op()
+        status, data = conn.status(folder, '(UIDNEXT UIDVALIDITY)')
+        if status != 'OK' or not data or not data[0]:
+            raise Exception(f"STATUS devolvió {status} para {folder}")
+        raw = data[0] if isinstance(data[0], bytes) else str(data[0]).encode()
+        uidnext = self._STATUS_UIDNEXT_RE.search(raw)
+        uidvalidity = self._STATUS_UIDVALIDITY_RE.search(raw)
+        if not uidnext or not uidvalidity:
+            raise Exception(f"Respuesta STATUS incompleta: {raw!r}")
+        return int(uidvalidity.group(1)), int(uidnext.group(1))
+
+    def _selected_watermark(self, conn, folder):
+        """Obtiene UIDVALIDITY/UIDNEXT de la respuesta del SELECT, o vía STATUS si faltan."""
+        try:
+            _, validity_data = conn.response('UIDVALIDITY')
+            _, next_data = conn.response('UIDNEXT')
+            if validity_data and validity_data[0] and next_data and next_data[0]:
+                return int(validity_data[0]), int(next_data[0])
+        except Exception:
+            pass
+        try:
+            return self._mailbox_status(conn, folder)
+        except Exception as e:
+            logger.debug(f"No se pudo obtener UIDNEXT para {folder}: {e}")
+            return None, None
+
+    def _remember_mailbox_state(self, config_key, folder, uidvalidity, uidnext):
+        """Registra la última marca UIDVALIDITY/UIDNEXT conocida por (cuenta, carpeta)."""
+        if uidvalidity is None:
+            return
+        with self._lock:
+            self._mailbox_state[(config_key, folder)] = {
+                'uidvalidity': uidvalidity,
+                'uidnext': uidnext,
+                'checked_at': time.time()
+            }
+
+    def _get_cached_search(self, search_key):
+        """Devuelve el último resultado de una búsqueda si sigue dentro del TTL."""
+        with self._lock:
+            cached = self._search_cache.get(search_key)
+            if not cached:
+                return None
+            if time.time() - cached['stored_at'] > self._search_cache_ttl:
+                self._search_cache.pop(search_key, None)
+                return None
+            self._search_cache.move_to_end(search_key)
+            return cached
+
+    def _store_cached_search(self, search_key, uidvalidity, uidnext, result):
+        """Guarda el resultado junto con la marca UID hasta la que se escaneó."""
+        if uidvalidity is None or uidnext is None:
+            return
+        with self._lock:
+            self._search_cache[search_key] = {
+                'uidvalidity': uidvalidity,
+                'uidnext': uidnext,
+                'result': result,
+                'stored_at': time.time()
+            }
+            self._search_cache.move_to_end(search_key)
+            while len(self._search_cache) > self._search_cache_size:
+                self._search_cache.popitem(last=False)
+
+    def _check_search_access(self, email_addr, bot_token, user_id):
+        """Verifica que el usuario pueda consultar el correo (lanza ValueError si no)."""
+        # Verificación de acceso (admin, acceso libre o correo asignado), con caché por usuario
         if user_id and bot_token:
             try:
-                from database.connection import execute_query
+                from utils.authorization import authorization_service
                 
-                # Verificar si el usuario es superadmin o admin
-                from config import ADMIN_ID
-                if user_id == ADMIN_ID:
-                    pass  # El superadmin siempre tiene acceso
-                else:
-                    # Verificar si es admin
-                    admin_result = execute_query("""
-                    SELECT r.name FROM users u
-                    JOIN roles r ON u.role_id = r.id
-                    WHERE u.id = %s AND u.bot_token = %s
-                    """, (user_id, bot_token))
-                    
-                    is_admin = admin_result and admin_result[0][0] in ['admin', 'super_admin']
-                    
-                    if not is_admin:
-                        # Verificar si tiene acceso libre
-                        free_result = execute_query("""
-                        SELECT free_access FROM users
-                        WHERE id = %s AND bot_token = %s
-                        """, (user_id, bot_token))
-                        
-                        has_free_access = free_result and free_result[0][0]
-                        
-                        if not has_free_access:
-                            # Verificar si tiene este correo asignado
-                            email_result = execute_query("""
-                            SELECT id FROM user_emails
-                            WHERE user_id = %s AND bot_token = %s AND email = %s
-                            """, (user_id, bot_token, email_addr))
-                            
-                            if not email_result:
-                                raise ValueError(f"No tienes acceso al correo {email_addr}")
+                if not authorization_service.can_access_email(user_id, bot_token, email_addr):
+                    raise ValueError(f"No tienes acceso al correo {email_addr}")
             except ImportError:
                 logger.warning("No se pudo verificar acceso a través de la base de datos")
-        
+
+    def _resolve_search(self, service, regex_type):
+        """Devuelve (regex_key, from_key, remitentes, familia de regex compiladas) para el servicio pedido."""
         # Determinar el servicio y los remitentes
         service_lower = service.lower()
         # Calcular la clave regex primero
@@ -587,11 +974,224 @@ class EmailSearchService:
         if regex_key not in REGEX_PATTERNS:
             raise ValueError(f"No hay patrón regex para el servicio: {regex_key}")
         
-        regex_pattern = REGEX_PATTERNS[regex_key]
+        # Todas las regex de los mismos remitentes se aplican a cada cuerpo descargado
+        family = self._pattern_family(from_key)
+        if regex_key not in family:
+            try:
+                family = dict(family, **{regex_key: re.compile(REGEX_PATTERNS[regex_key], re.IGNORECASE | re.DOTALL)})
+            except re.error as e:
+                raise Exception(f"Error en la expresión regular: {str(e)}")
+        return regex_key, from_key, from_addresses, family
+
+    def _build_search_criteria(self, from_addresses, email_addr, days_back, since_uid):
+        """Construye el criterio UID SEARCH combinado y el criterio simplificado de respaldo."""
+        # Construir fecha para búsqueda (reducir días para búsqueda más eficiente)
+        days_back = min(days_back, 3)  # Limitar a máximo 3 días para búsquedas más rápidas
+        date_since = (datetime.now() - timedelta(days=days_back)).strftime("%d-%b-%Y")
+        uid_range = f' UID {since_uid}:*' if since_uid else ''
+        
+        # Optimizar búsqueda: combinar FROM y TO en una sola consulta
+        search_criteria = []
+        
+        # Crear criterio para remitentes
+        for from_addr in from_addresses:
+            if '@' in email_addr:
+                # Búsqueda combinada de remitente y destinatario para mayor precisión
+                search_criteria.append(f'(FROM "{from_addr}" TO "{email_addr}" SINCE {date_since}{uid_range})')
+            else:
+                search_criteria.append(f'(FROM "{from_addr}" SINCE {date_since}{uid_range})')
+        
+        # Combinar criterios con OR
+        if len(search_criteria) > 1:
+            combined_criteria = f'OR {" ".join(search_criteria)}'
+        else:
+            combined_criteria = search_criteria[0]
+        return combined_criteria, f'SINCE {date_since}{uid_range}'
+
+    def _new_message_ids(self, messages, since_uid, cid):
+        """UIDs a examinar, del más reciente al más antiguo (máximo 10)."""
+        # "UID n:*" siempre devuelve al menos el último mensaje; descartar los ya vistos
+        message_ids = messages[0].split() if messages and messages[0] else []
+        if since_uid:
+            message_ids = [uid for uid in message_ids if int(uid) >= since_uid]
+            logger.info(f"[{cid}] Escaneo incremental desde UID {since_uid}: {len(message_ids)} UID(s) nuevos")
+        
+        # Procesar mensajes más recientes primero (limitar a 10 para mayor velocidad)
+        message_ids.reverse()  # Ordenar de más recientes a más antiguos
+        return message_ids[:10]  # Procesar solo los 10 más recientes
+
+    def _select_candidates(self, message_ids, msg_data, from_addresses, email_addr, cid):
+        """
+        Filtra remitente/destinatario y tamaño a partir del FETCH de cabeceras en lote.
+        Devuelve [(uid, cabeceras, entrada)] del más reciente al más antiguo.
+        """
+        entries_by_id = {
+            entry['uid']: entry
+            for entry in parse_fetch_response(msg_data)
+            if entry['uid'] is not None
+        }
+        candidates = []
+        for msg_id in message_ids:
+            entry = entries_by_id.get(msg_id)
+            raw_headers = header_literal(entry) if entry else b''
+            if not raw_headers:
+                continue
+            email_headers = email.message_from_bytes(raw_headers)
+            if not self._headers_match(email_headers, from_addresses, email_addr):
+                continue
+            size = parse_rfc822_size(entry['meta'])
+            if size is not None and size > self._max_message_bytes:
+                logger.info(f"[{cid}] Mensaje UID {msg_id.decode()} omitido por tamaño ({size} bytes)")
+                self._bump_stat('oversized_skipped', 1)
+                continue
+            candidates.append((msg_id, email_headers, entry))
+        return candidates
+
+    def _header_fetches_saved(self, message_ids, matched_uid):
+        """
+        FETCH de cabeceras que el bucle anterior (uno por mensaje, hasta la primera
+        coincidencia) habría hecho de más frente al lote único. Devuelve (antes, ahorrados).
+        """
+        if matched_uid is not None and matched_uid in message_ids:
+            legacy = message_ids.index(matched_uid) + 1
+        else:
+            legacy = len(message_ids)
+        return legacy, max(legacy - 1, 0)
+
+    def _finish_search(self, search_key, uidvalidity, uidnext, latest_result, previous_result, t_start, cid):
+        """Guarda la marca UID junto al resultado y registra la duración total."""
+        # Un resultado en los UIDs nuevos sustituye al anterior; si no, el anterior sigue vigente
+        if not latest_result:
+            latest_result = previous_result
+        self._store_cached_search(search_key, uidvalidity, uidnext, latest_result)
+        
+        t_total = time.perf_counter() - t_start
+        logger.info(
+            f"[{cid}] Búsqueda completada total={t_total:.3f}s "
+            f"resultado={'encontrado' if latest_result else 'no encontrado'}"
+        )
+        return latest_result
+
+    def _log_cached_hit(self, cached, uidnext, t_start, cid):
+        self._bump_stat('watermark_hits', 1)
+        logger.info(
+            f"[{cid}] Sin correo nuevo desde la última búsqueda (UIDNEXT={uidnext}), "
+            f"total={time.perf_counter()-t_start:.3f}s resultado="
+            f"{'encontrado' if cached['result'] else 'no encontrado'} (caché)"
+        )
+        return cached['result']
+
+    def _ingestion_candidate(self, bot_token, config, email_addr):
+        """True si merece la pena consultar el índice de ingesta (hay worker al día)."""
+        if not bot_token or '@' not in email_addr:
+            return False
+        from handlers.mailbox_ingestion import mailbox_ingestion
+        return mailbox_ingestion.enabled and mailbox_ingestion.is_fresh(bot_token, self._config_key(config))
+
+    def _inbox_watermark(self, config, cid):
+        """(UIDVALIDITY, UIDNEXT) actuales del INBOX con un STATUS, o None si falla."""
+        conn = None
+        try:
+            conn = self.get_connection(config)
+            return self._mailbox_status(conn, "INBOX")
+        except Exception as e:
+            logger.warning(f"[{cid}] STATUS para el índice de ingesta falló, se usa IMAP: {e}")
+            if conn is not None and self._is_dead_connection(e):
+                self._discard_conn_from_pool(conn)
+                conn = None
+            return None
+        finally:
+            if conn is not None:
+                self.release_connection(conn)
+
+    def _lookup_ingested(self, bot_token, config, email_addr, regex_key, days_back, watermark, cid):
+        """Consulta el índice local del worker de ingesta IMAP. Devuelve (acierto, resultado)."""
+        from handlers.mailbox_ingestion import mailbox_ingestion
+        try:
+            hit, result = mailbox_ingestion.lookup(
+                bot_token, self._config_key(config), email_addr, regex_key, days_back, watermark
+            )
+        except Exception as e:
+            logger.warning(f"[{cid}] Error consultando el índice de ingesta, se usa IMAP: {e}")
+            return False, None
+        if hit:
+            self._bump_stat('ingestion_hits', 1)
+            logger.info(f"[{cid}] Resultado servido desde el índice de ingesta")
+        return hit, result
+
+    def search_emails(self, email_addr, service, regex_type=None, folder="INBOX", days_back=1, bot_token=None, user_id=None):
+        """Busca correos usando una expresión regular según el servicio y devuelve el resultado."""
+        cid = str(uuid.uuid4())[:8]  # correlation-id por búsqueda
+        t_start = time.perf_counter()
+        logger.info(f"[{cid}] Iniciando búsqueda service={service} type={regex_type or 'default'} email={email_addr}")
+        
+        # Verificación de acceso
+        self._check_search_access(email_addr, bot_token, user_id)
+        
+        # Determinar el servicio, los remitentes y las regex
+        regex_key, from_key, from_addresses, family = self._resolve_search(service, regex_type)
         
         # Obtener configuración IMAP
         config = self.get_imap_config(email_addr, bot_token)
         
+        # Índice local del worker de ingesta (IDLE), solo si ya cubre el UIDNEXT
+        # actual del buzón; en otro caso se consulta IMAP
+        if folder == "INBOX" and self._ingestion_candidate(bot_token, config, email_addr):
+            watermark = self._inbox_watermark(config, cid)
+            hit, result = self._lookup_ingested(bot_token, config, email_addr, regex_key, days_back, watermark, cid)
+            if hit:
+                return result
+        
+        candidate_key = (self._config_key(config), folder, email_addr.lower(), from_key)
+        
+        # Búsquedas idénticas concurrentes comparten una sola ejecución IMAP
+        flight_key = (self._config_key(config), email_addr.lower(), regex_key, folder)
+        return self._run_single_flight(
+            flight_key,
+            lambda: self._search_imap(
+                config, regex_key, candidate_key, from_addresses, family, email_addr, folder, days_back, t_start, cid
+            ),
+            cid
+        )
+
+    def _run_single_flight(self, flight_key, search_fn, cid):
+        """
+        Ejecuta search_fn una sola vez por clave; los hilos que llegan mientras
+        está en vuelo esperan y comparten su resultado (o su error).
+        """
+        with self._lock:
+            flight = self._flights.get(flight_key)
+            is_leader = flight is None
+            if is_leader:
+                flight = {'event': threading.Event(), 'result': None, 'error': None, 'ops': 0}
+                self._flights[flight_key] = flight
+        
+        if not is_leader:
+            logger.info(f"[{cid}] Búsqueda idéntica en vuelo, esperando su resultado")
+            flight['event'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            self._bump_stat('coalesced_searches', 1)
+            self._bump_stat('coalesced_imap_ops_saved', flight['ops'])
+            return flight['result']
+        
+        counter = [0]
+        token = imap_op_counter.set(counter)
+        try:
+            flight['result'] = search_fn()
+            return flight['result']
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            flight['ops'] = counter[0]
+            imap_op_counter.reset(token)
+            with self._lock:
+                self._flights.pop(flight_key, None)
+            flight['event'].set()
+
+    def _search_imap(self, config, regex_key, candidate_key, from_addresses, family, email_addr, folder, days_back, t_start, cid):
+        """Parte IMAP de search_emails (una ejecución por búsqueda única en vuelo)."""
         # Obtener conexión del pool
         conn = None
         try:
@@ -607,9 +1207,30 @@ class EmailSearchService:
                 f"{time.perf_counter()-t_connect:.3f}s"
             )
             
+            config_key = self._config_key(config)
+            search_key = (config_key, folder, email_addr.lower(), regex_key)
+            cached = self._get_cached_search(search_key)
+            
+            # Si ya hay un resultado previo o candidatos escaneados, un STATUS basta
+            # para saber si llegó correo nuevo
+            if cached or self._has_candidates(candidate_key):
+                t_status = time.perf_counter()
+                try:
+                    watermark = self._mailbox_status(conn, folder)
+                    logger.debug(f"[{cid}] status() en {time.perf_counter()-t_status:.3f}s")
+                    if cached and watermark == (cached['uidvalidity'], cached['uidnext']):
+                        return self._log_cached_hit(cached, watermark[1], t_start, cid)
+                    # Otra opción del mismo servicio puede haber escaneado ya los mensajes recientes
+                    hit, result = self._serve_from_message_cache(candidate_key, regex_key, watermark, cid)
+                    if hit:
+                        return result
+                except Exception as e:
+                    logger.warning(f"[{cid}] STATUS falló, se continúa con búsqueda normal: {e}")
+            
             # Seleccionar carpeta (siempre recargar para buscar nuevos correos)
             t_select = time.perf_counter()
             try:
+                count_imap_op()
                 status, messages = conn.select(folder, readonly=True)
                 if status != 'OK':
                     raise Exception(f"Error al seleccionar la carpeta {folder}")
@@ -619,31 +1240,24 @@ class EmailSearchService:
                 logger.warning(f"[{cid}] Error al seleccionar carpeta, reconectando: {e}")
                 if self._is_dead_connection(e):
                     self._discard_conn_from_pool(conn)
+                else:
+                    self.release_connection(conn)
+                conn = None
                 conn = self.get_connection(config)
                 status, messages = conn.select(folder, readonly=True)
                 if status != 'OK':
                     raise Exception(f"Error al seleccionar la carpeta {folder} después de reconexión")
             
-            # Construir fecha para búsqueda (reducir días para búsqueda más eficiente)
-            days_back = min(days_back, 3)  # Limitar a máximo 3 días para búsquedas más rápidas
-            date_since = (datetime.now() - timedelta(days=days_back)).strftime("%d-%b-%Y")
-            
-            # Optimizar búsqueda: combinar FROM y TO en una sola consulta
-            search_criteria = []
-            
-            # Crear criterio para remitentes
-            for from_addr in from_addresses:
-                if '@' in email_addr:
-                    # Búsqueda combinada de remitente y destinatario para mayor precisión
-                    search_criteria.append(f'(FROM "{from_addr}" TO "{email_addr}" SINCE {date_since})')
-                else:
-                    search_criteria.append(f'(FROM "{from_addr}" SINCE {date_since})')
+            uidvalidity, uidnext = self._selected_watermark(conn, folder)
+            self._remember_mailbox_state(config_key, folder, uidvalidity, uidnext)
             
-            # Combinar criterios con OR
-            if len(search_criteria) > 1:
-                combined_criteria = f'OR {" ".join(search_criteria)}'
-            else:
-                combined_criteria = search_criteria[0]
+            # Solo examinar UIDs nuevos si el escaneo previo sigue siendo válido
+            since_uid = None
+            if cached and uidvalidity is not None and cached['uidvalidity'] == uidvalidity:
+                since_uid = cached['uidnext']
+            combined_criteria, fallback_criteria = self._build_search_criteria(
+                from_addresses, email_addr, days_back, since_uid
+            )
             
             # Realizar la búsqueda con reintentos (pasamos config para permitir reconexión)
             # search_with_retry devuelve (status, messages, live_conn); usamos live_conn
@@ -651,190 +1265,338 @@ class EmailSearchService:
             t_search = time.perf_counter()
             try:
                 status, messages, conn = self.search_with_retry(
-                    conn, combined_criteria, config=config, cid=cid
+                    conn, combined_criteria, config=config, cid=cid, uid=True, folder=folder
                 )
-                logger.debug(f"[{cid}] search() en {time.perf_counter()-t_search:.3f}s")
+                logger.debug(f"[{cid}] uid_search() en {time.perf_counter()-t_search:.3f}s")
             except Exception as e:
                 logger.error(f"[{cid}] Error en búsqueda IMAP: {e}")
 
                 # Intentar una búsqueda más simple como último recurso
-                fallback_criteria = f'SINCE {date_since}'
                 logger.info(f"[{cid}] Intentando búsqueda simplificada: {fallback_criteria}")
                 try:
                     # Reconectar frescamente para el fallback
+                    self._discard_conn_from_pool(conn)
+                    conn = None
                     conn = self.get_connection(config)
+                    conn.select(folder, readonly=True)
                     status, messages, conn = self.search_with_retry(
-                        conn, fallback_criteria, config=config, cid=cid
+                        conn, fallback_criteria, config=config, cid=cid, uid=True, folder=folder
                     )
                 except Exception as e2:
                     logger.error(f"[{cid}] Error en búsqueda simplificada: {e2}")
                     raise Exception(f"Error en búsqueda IMAP: {str(e)}")
             
-            if not messages[0]:
-                t_total = time.perf_counter() - t_start
-                logger.info(
-                    f"[{cid}] Búsqueda completada total={t_total:.3f}s resultado=no encontrado"
-                )
-                return None
+            message_ids = self._new_message_ids(messages, since_uid, cid)
+            previous_result = cached['result'] if since_uid else None
             
-            # Compilar expresión regular para cuerpo
-            try:
-                body_regex = re.compile(regex_pattern, re.IGNORECASE | re.DOTALL)
-            except re.error as e:
-                raise Exception(f"Error en la expresión regular: {str(e)}")
+            if not message_ids:
+                return self._finish_search(search_key, uidvalidity, uidnext, None, previous_result, t_start, cid)
             
-            # Variable para almacenar el resultado más reciente
-            latest_result = None
+            logger.info(f"Procesando {len(message_ids)} mensajes recientes para {email_addr}")
             
-            # Procesar mensajes más recientes primero (limitar a 10 para mayor velocidad)
-            message_ids = messages[0].split()
-            message_ids.reverse()  # Ordenar de más recientes a más antiguos
-            message_ids = message_ids[:10]  # Procesar solo los 10 más recientes
+            # Un único FETCH de cabeceras para todo el conjunto (en vez de uno por mensaje)
+            t_hdr = time.perf_counter()
+            message_set = b','.join(message_ids).decode()
+            try:
+                status, msg_data, conn = self.fetch_with_retry(
+                    conn, message_set, self._header_fetch_items(), config=config, cid=cid,
+                    uid=True, folder=folder
+                )
+                if status != 'OK':
+                    raise Exception(f"Estado {status} al recuperar cabeceras")
+            except Exception as e:
+                logger.error(f"[{cid}] Error al recuperar cabeceras en lote: {e}")
+                raise Exception(f"Error al recuperar cabeceras: {str(e)}")
             
-            logger.info(f"Procesando {len(message_ids)} mensajes recientes para {email_addr}")
+            self._bump_stat('searches', 1)
+            logger.debug(
+                f"[{cid}] fetch_headers() lote={len(message_ids)} en "
+                f"{time.perf_counter()-t_hdr:.3f}s"
+            )
             
-            # Procesamiento optimizado: verificar directamente los mensajes más recientes
-            for msg_id in message_ids:
-                # Recuperar encabezados primero para validación rápida
-                t_hdr = time.perf_counter()
-                try:
-                    # Desempaquetamos live_conn para que conn quede actualizado si hubo reconexión
-                    status, msg_data, conn = self.fetch_with_retry(
-                        conn, msg_id, '(BODY.PEEK[HEADER])', config=config, cid=cid
-                    )
-                    if status != 'OK':
-                        continue
-                    logger.debug(f"[{cid}] fetch_header() en {time.perf_counter()-t_hdr:.3f}s")
-                except Exception as e:
-                    logger.error(f"[{cid}] Error al recuperar encabezado: {e}")
+            # Filtrar remitente/destinatario localmente, del más reciente al más antiguo
+            candidates = self._select_candidates(message_ids, msg_data, from_addresses, email_addr, cid)
+            self._store_candidates(
+                candidate_key, [c[0] for c in candidates], uidvalidity, uidnext, since_uid is not None
+            )
+            
+            # Descargar el cuerpo solo de los candidatos, deteniéndose en el primero que coincida
+            latest_result = None
+            matched_uid = None
+            body_fetches = 0
+            for msg_id, email_headers, entry in candidates:
+                # Mensaje ya escaneado por otra opción del mismo servicio
+                known, cached_result = self._cached_extraction(config_key, folder, uidvalidity, msg_id, regex_key)
+                if known:
+                    self._bump_stat('body_fetches_skipped', 1)
+                    latest_result = cached_result
+                    if latest_result:
+                        matched_uid = msg_id
+                        break
                     continue
                 
-                # Validar remitente y destinatario
-                raw_headers = msg_data[0][1]
-                email_headers = email.message_from_bytes(raw_headers)
-                
-                # Verificar remitente
-                from_value = email_headers.get('From', '')
-                from_match = any(addr.lower() in from_value.lower() for addr in from_addresses)
-                if not from_match:
-                    continue
+                # Modo parts: solo las secciones de texto declaradas en BODYSTRUCTURE
+                text_parts = self._ordered_text_parts(entry)
+                found = None
+                if text_parts:
+                    try:
+                        found, complete, conn, fetched = self._extract_from_parts(
+                            conn, msg_id, text_parts, regex_key, family, email_headers, config, cid, folder
+                        )
+                        body_fetches += fetched
+                    except Exception as e:
+                        logger.warning(f"[{cid}] Descarga por secciones falló, usando RFC822: {e}")
                 
-                # Verificar destinatario si se especificó un correo
-                if '@' in email_addr:
-                    to_value = email_headers.get('To', '')
-                    email_addr_lower = email_addr.lower()
-                    
-                    # Verificación simplificada del destinatario
-                    if email_addr_lower not in to_value.lower():
-                        # Verificar si es un correo con formato user+tag@domain
-                        if '+' in email_addr_lower:
-                            base_email = email_addr_lower.split('@')[0].split('+')[0]
-                            domain = email_addr_lower.split('@')[1]
-                            pattern = f"{base_email}+[^@]*@{domain}"
-                            if not re.search(pattern, to_value.lower()):
-                                continue
-                        else:
+                if found is None:
+                    t_body = time.perf_counter()
+                    try:
+                        status, msg_data, conn = self.fetch_with_retry(
+                            conn, msg_id, '(RFC822)', config=config, cid=cid,
+                            uid=True, folder=folder
+                        )
+                        body_fetches += 1
+                        if status != 'OK':
                             continue
-                
-                # Si pasa las validaciones, recuperar el mensaje completo
-                t_body = time.perf_counter()
-                try:
-                    status, msg_data, conn = self.fetch_with_retry(
-                        conn, msg_id, '(RFC822)', config=config, cid=cid
-                    )
-                    if status != 'OK':
+                        logger.debug(f"[{cid}] fetch_body() en {time.perf_counter()-t_body:.3f}s")
+                    except Exception as e:
+                        logger.error(f"[{cid}] Error al recuperar mensaje completo: {e}")
                         continue
-                    logger.debug(f"[{cid}] fetch_body() en {time.perf_counter()-t_body:.3f}s")
-                except Exception as e:
-                    logger.error(f"[{cid}] Error al recuperar mensaje completo: {e}")
-                    continue
-                
-                raw_email = msg_data[0][1]
-                email_message = email.message_from_bytes(raw_email)
+                    found, complete = self._scan_rfc822(msg_data, family, email_headers)
                 
-                # Extraer asunto para registro
-                subject = self.decode_email_subject(email_message.get('Subject', ''))
-                
-                # Búsqueda optimizada en el cuerpo del mensaje
-                if email_message.is_multipart():
-                    # Primero en HTML (más común tener los códigos/enlaces aquí)
-                    for part in email_message.walk():
-                        if part.get_content_type() == "text/html":
-                            try:
-                                body = part.get_payload(decode=True).decode('utf-8', 'ignore')
-                                match = body_regex.search(body)
-                                if match:
-                                    result = match.group(1) if match.groups() else match.group(0)
-                                    result = result.replace('amp;', '')
-                                    
-                                    latest_result = {
-                                        'result': result,
-                                        'is_link': result.startswith('http'),
-                                        'subject': subject,
-                                        'date': email_message.get('Date', ''),
-                                        'from': email_message.get('From', '')
-                                    }
-                                    # Encontramos un resultado, romper ciclo externo
-                                    break
-                            except Exception as e:
-                                logger.error(f"Error al procesar parte HTML: {e}")
-                    
-                    # Si no se encontró en HTML y aún no tenemos resultado, buscar en texto plano
-                    if not latest_result:
-                        for part in email_message.walk():
-                            if part.get_content_type() == "text/plain":
-                                try:
-                                    body = part.get_payload(decode=True).decode('utf-8', 'ignore')
-                                    if match:
-                                        result = match.group(1) if match.groups() else match.group(0)
-                                        result = result.replace('amp;', '')
-                                        
-                                        latest_result = {
-                                            'result': result,
-                                            'is_link': result.startswith('http'),
-                                            'subject': subject,
-                                            'date': email_message.get('Date', ''),
-                                            'from': email_message.get('From', '')
-                                        }
-                                        break
-                                except Exception as e:
-                                    logger.error(f"Error al procesar parte texto: {e}")
-                else:
-                    # No es multiparte, procesar directamente
-                    try:
-                        body = email_message.get_payload(decode=True).decode('utf-8', 'ignore')
-                        match = body_regex.search(body)
-                        if match:
-                            result = match.group(1) if match.groups() else match.group(0)
-                            result = result.replace('amp;', '')
-                            
-                            latest_result = {
-                                'result': result,
-                                'is_link': result.startswith('http'),
-                                'subject': subject,
-                                'date': email_message.get('Date', ''),
-                                'from': email_message.get('From', '')
-                            }
-                    except Exception as e:
-                        logger.error(f"Error al procesar mensaje no multiparte: {e}")
+                # Guardar lo extraído para todas las opciones del servicio
+                self._store_extraction(config_key, folder, uidvalidity, msg_id, found, complete)
+                latest_result = found.get(regex_key)
                 
                 # Si encontramos un resultado, terminar la búsqueda
                 if latest_result:
+                    matched_uid = msg_id
                     break
             
-            t_total = time.perf_counter() - t_start
+            legacy_fetches, roundtrips_saved = self._header_fetches_saved(message_ids, matched_uid)
+            self._bump_stat('roundtrips_saved', roundtrips_saved)
             logger.info(
-                f"[{cid}] Búsqueda completada total={t_total:.3f}s "
-                f"resultado={'encontrado' if latest_result else 'no encontrado'}"
+                f"[{cid}] Round trips IMAP: {1 + body_fetches} "
+                f"(FETCH de cabeceras: 1 en lote frente a {legacy_fetches} individuales, "
+                f"ahorrados {roundtrips_saved})"
             )
-
+            
             # Devolver el resultado más reciente, o None si no se encontró nada
-            return latest_result
+            return self._finish_search(
+                search_key, uidvalidity, uidnext, latest_result, previous_result, t_start, cid
+            )
                     
         finally:
-            # No cerramos la conexión para mantenerla persistente
-            # Las conexiones inactivas se limpiarán en la próxima búsqueda
-            pass
+            # Devolver el lease al pool; las inactivas se limpiarán en el próximo lease
+            self.release_connection(conn)
+
+    async def _async_status(self, client, folder):
+        """UIDVALIDITY/UIDNEXT vía STATUS sobre el cliente asíncrono."""
+        _, data = await client.status(folder, '(UIDNEXT UIDVALIDITY)')
+        raw = data[0] if data else b''
+        uidnext = self._STATUS_UIDNEXT_RE.search(raw)
+        uidvalidity = self._STATUS_UIDVALIDITY_RE.search(raw)
+        if not uidnext or not uidvalidity:
+            raise Exception(f"Respuesta STATUS incompleta: {raw!r}")
+        return int(uidvalidity.group(1)), int(uidnext.group(1))
+
+    async def _async_inbox_watermark(self, config_key, config, cid):
+        """Versión asíncrona de _inbox_watermark sobre el cliente del pool."""
+        try:
+            client = await async_imap_pool.get_client(config_key, config, "INBOX")
+            return await self._async_status(client, "INBOX")
+        except Exception as e:
+            logger.warning(f"[{cid}] STATUS para el índice de ingesta falló, se usa IMAP: {e}")
+            return None
+
+    async def search_emails_async(self, email_addr, service, regex_type=None, folder="INBOX", days_back=1, bot_token=None, user_id=None):
+        """
+        Versión asíncrona de search_emails con la misma semántica.
+
+        Usa un AsyncIMAPClient por (cuenta, carpeta) con pipelining, de modo que
+        varias búsquedas comparten conexión sin ocupar un hilo cada una. Las
+        consultas a la base de datos se ejecutan en el executor de BD.
+        """
+        from database.async_db import db
+        
+        cid = str(uuid.uuid4())[:8]  # correlation-id por búsqueda
+        t_start = time.perf_counter()
+        logger.info(f"[{cid}] Iniciando búsqueda async service={service} type={regex_type or 'default'} email={email_addr}")
+        
+        await db.run(self._check_search_access, email_addr, bot_token, user_id)
+        regex_key, from_key, from_addresses, family = self._resolve_search(service, regex_type)
+        config = await db.run(self.get_imap_config, email_addr, bot_token)
+        
+        config_key = self._config_key(config)
+        search_key = (config_key, folder, email_addr.lower(), regex_key)
+        flight_key = (config_key, email_addr.lower(), regex_key, folder)
+        candidate_key = (config_key, folder, email_addr.lower(), from_key)
+        
+        # Índice local del worker de ingesta (IDLE), solo si ya cubre el UIDNEXT
+        # actual del buzón; en otro caso se consulta IMAP
+        if folder == "INBOX" and self._ingestion_candidate(bot_token, config, email_addr):
+            watermark = await self._async_inbox_watermark(config_key, config, cid)
+            hit, result = await db.run(
+                self._lookup_ingested, bot_token, config, email_addr, regex_key, days_back, watermark, cid
+            )
+            if hit:
+                return result
+        
+        # Búsquedas idénticas concurrentes comparten una sola ejecución IMAP
+        flight = self._async_flights.get(flight_key)
+        if flight is not None:
+            logger.info(f"[{cid}] Búsqueda idéntica en vuelo, esperando su resultado")
+            result, ops = await asyncio.shield(flight)
+            self._bump_stat('coalesced_searches', 1)
+            self._bump_stat('coalesced_imap_ops_saved', ops)
+            return result
+        
+        flight = asyncio.ensure_future(self._counted_flight(
+            self._search_async_with_retry(
+                config_key, config, search_key, candidate_key, from_addresses, family, email_addr, folder, days_back, t_start, cid
+            )
+        ))
+        self._async_flights[flight_key] = flight
+        flight.add_done_callback(lambda _: self._async_flights.pop(flight_key, None))
+        result, _ = await asyncio.shield(flight)
+        return result
+
+    async def _counted_flight(self, coro):
+        """Ejecuta la búsqueda líder contando sus comandos IMAP. Devuelve (resultado, comandos)."""
+        counter = [0]
+        imap_op_counter.set(counter)
+        result = await coro
+        return result, counter[0]
+
+    async def _search_async_with_retry(self, config_key, config, search_key, candidate_key, from_addresses, family, email_addr, folder, days_back, t_start, cid):
+        """Parte IMAP de search_emails_async, con una reconexión si la conexión cae."""
+        for attempt in range(2):
+            try:
+                client = await async_imap_pool.get_client(config_key, config, folder)
+            except Exception as e:
+                logger.error(f"[{cid}] Error al obtener conexión IMAP asíncrona: {e}")
+                raise Exception(f"No se pudo establecer conexión IMAP: {e}")
+            try:
+                return await self._search_on_client(
+                    client, search_key, candidate_key, from_addresses, family, email_addr, folder, days_back, t_start, cid
+                )
+            except AsyncIMAPCommandError as e:
+                logger.error(f"[{cid}] Error en búsqueda IMAP: {e}")
+                raise Exception(f"Error en búsqueda IMAP: {str(e)}")
+            except AsyncIMAPError as e:
+                # Conexión caída: descartar y reintentar una vez con una nueva
+                await async_imap_pool.discard(client)
+                if attempt == 0:
+                    logger.warning(f"[{cid}] Conexión IMAP asíncrona perdida, reconectando: {e}")
+                    await asyncio.sleep(0.5)
+                    continue
+                raise Exception(f"Error en búsqueda IMAP: {str(e)}")
+
+    async def _search_on_client(self, client, search_key, candidate_key, from_addresses, family, email_addr, folder, days_back, t_start, cid):
+        """Cuerpo de search_emails_async sobre un cliente ya conectado y con la carpeta examinada."""
+        cached = self._get_cached_search(search_key)
+        since_uid = None
+        uidvalidity = uidnext = None
+        
+        # Si ya hay un resultado previo o candidatos escaneados, un STATUS basta
+        # para saber si llegó correo nuevo
+        config_key, regex_key = search_key[0], search_key[3]
+        if cached or self._has_candidates(candidate_key):
+            uidvalidity, uidnext = await self._async_status(client, folder)
+            if cached and uidvalidity == cached['uidvalidity'] and uidnext == cached['uidnext']:
+                return self._log_cached_hit(cached, uidnext, t_start, cid)
+            # Otra opción del mismo servicio puede haber escaneado ya los mensajes recientes
+            hit, result = self._serve_from_message_cache(candidate_key, regex_key, (uidvalidity, uidnext), cid)
+            if hit:
+                return result
+            if cached and uidvalidity == cached['uidvalidity']:
+                since_uid = cached['uidnext']
+        
+        combined_criteria, fallback_criteria = self._build_search_criteria(
+            from_addresses, email_addr, days_back, since_uid
+        )
+        
+        # NOOP, STATUS y UID SEARCH van en vuelo a la vez por la misma conexión;
+        # STATUS va antes del SEARCH para que su UIDNEXT no cubra correo no buscado
+        t_search = time.perf_counter()
+        pipeline = [client.noop()]
+        if uidvalidity is None:
+            pipeline.append(self._async_status(client, folder))
+        pipeline.append(client.uid_search(combined_criteria))
+        results = await asyncio.gather(*pipeline, return_exceptions=True)
+        for outcome in results:
+            if isinstance(outcome, AsyncIMAPError) and not isinstance(outcome, AsyncIMAPCommandError):
+                raise outcome
+        if isinstance(results[-1], Exception):
+            logger.error(f"[{cid}] Error en búsqueda IMAP: {results[-1]}")
+            logger.info(f"[{cid}] Intentando búsqueda simplificada: {fallback_criteria}")
+            _, messages = await client.uid_search(fallback_criteria)
+        else:
+            _, messages = results[-1]
+        if uidvalidity is None and not isinstance(results[1], Exception):
+            uidvalidity, uidnext = results[1]
+        logger.debug(f"[{cid}] noop+uid_search() en {time.perf_counter()-t_search:.3f}s")
+        self._remember_mailbox_state(search_key[0], folder, uidvalidity, uidnext)
+        
+        message_ids = self._new_message_ids(messages, since_uid, cid)
+        previous_result = cached['result'] if since_uid else None
+        
+        if not message_ids:
+            return self._finish_search(search_key, uidvalidity, uidnext, None, previous_result, t_start, cid)
+        
+        # Un único FETCH de cabeceras para todo el conjunto
+        t_hdr = time.perf_counter()
+        _, msg_data = await client.uid_fetch(b','.join(message_ids).decode(), self._header_fetch_items())
+        self._bump_stat('searches', 1)
+        logger.debug(f"[{cid}] fetch_headers() lote={len(message_ids)} en {time.perf_counter()-t_hdr:.3f}s")
+        
+        candidates = self._select_candidates(message_ids, msg_data, from_addresses, email_addr, cid)
+        self._store_candidates(
+            candidate_key, [c[0] for c in candidates], uidvalidity, uidnext, since_uid is not None
+        )
+        
+        latest_result = None
+        matched_uid = None
+        for msg_id, email_headers, entry in candidates:
+            # Mensaje ya escaneado por otra opción del mismo servicio
+            known, cached_result = self._cached_extraction(config_key, folder, uidvalidity, msg_id, regex_key)
+            if known:
+                self._bump_stat('body_fetches_skipped', 1)
+                latest_result = cached_result
+                if latest_result:
+                    matched_uid = msg_id
+                    break
+                continue
+            
+            uid_str = msg_id.decode()
+            text_parts = self._ordered_text_parts(entry)
+            found, complete = {}, True
+            if text_parts:
+                subject = self.decode_email_subject(email_headers.get('Subject', ''))
+                for index, part in enumerate(text_parts):
+                    _, part_data = await client.uid_fetch(uid_str, f"(BODY.PEEK[{part['section']}])")
+                    body = self._decode_part(part_data, part, cid)
+                    if body is None:
+                        complete = False
+                        continue
+                    self._scan_body(body, family, found, email_headers, subject)
+                    if regex_key in found:
+                        complete = complete and index == len(text_parts) - 1
+                        break
+            else:
+                _, body_data = await client.uid_fetch(uid_str, '(RFC822)')
+                found, complete = self._scan_rfc822(body_data, family, email_headers)
+            
+            # Guardar lo extraído para todas las opciones del servicio
+            self._store_extraction(config_key, folder, uidvalidity, msg_id, found, complete)
+            latest_result = found.get(regex_key)
+            
+            # Si encontramos un resultado, terminar la búsqueda
+            if latest_result:
+                matched_uid = msg_id
+                break
+        
+        self._bump_stat('roundtrips_saved', self._header_fetches_saved(message_ids, matched_uid)[1])
+        return self._finish_search(search_key, uidvalidity, uidnext, latest_result, previous_result, t_start, cid)
 
     def decode_email_subject(self, subject):
         """Decodifica el asunto del correo"""
@@ -856,12 +1618,18 @@ class EmailSearchService:
     def cleanup(self):
         """Cierra todas las conexiones IMAP abiertas sin bloquear otros hilos."""
         conns_to_close = []
-        with self._lock:
-            for key, conn in list(self._connections.items()):
-                conns_to_close.append((key, conn))
+        with self._pool_cond:
+            for key, idle in self._idle_connections.items():
+                for item in idle:
+                    conns_to_close.append((key, item['conn']))
+            for lease in self._leases.values():
+                conns_to_close.append((lease['key'], lease['conn']))
             
-            self._connections.clear()
-            self._last_used.clear()
+            self._idle_connections.clear()
+            self._leases.clear()
+            self._leased_count.clear()
+            self._last_checked.clear()
+            self._pool_cond.notify_all()
 
         # Logout fuera del lock
         for key, conn in conns_to_close:
@@ -1089,50 +1857,17 @@ async def handle_email_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return
 
-    # Validate user's access to this email using database
-    from database.connection import execute_query
-    from config import ADMIN_ID
+    # Validate user's access to this email (shared, cached authorization service)
+    from utils.authorization import authorization_service
     
     user_id = update.effective_user.id
     bot_token = context.bot.token
     
-    # Check if the user is superadmin or admin
-    is_allowed = False
-    
-    if user_id == ADMIN_ID:
-        is_allowed = True
-    else:
-        try:
-            # Check if the user is admin
-            admin_check = execute_query("""
-            SELECT r.name FROM users u
-            JOIN roles r ON u.role_id = r.id
-            WHERE u.id = %s AND u.bot_token = %s
-            """, (user_id, bot_token))
-            
-            if admin_check and admin_check[0][0] in ['admin', 'super_admin']:
-                is_allowed = True
-            else:
-                # Check if the user has free access
-                free_check = execute_query("""
-                SELECT free_access FROM users
-                WHERE id = %s AND bot_token = %s
-                """, (user_id, bot_token))
-                
-                if free_check and free_check[0][0]:
-                    is_allowed = True
-                else:
-                    # Check if the user has this email assigned
-                    email_check = execute_query("""
-                    SELECT id FROM user_emails
-                    WHERE user_id = %s AND bot_token = %s AND email = %s
-                    """, (user_id, bot_token, email_addr))
-                    
-                    if email_check:
-                        is_allowed = True
-        except Exception as e:
-            logger.error(f"Error checking email permissions: {e}")
-            is_allowed = False
+    try:
+        is_allowed = await authorization_service.can_access_email_async(user_id, bot_token, email_addr)
+    except Exception as e:
+        logger.error(f"Error checking email permissions: {e}")
+        is_allowed = False
     
     if not is_allowed:
         keyboard = [
@@ -1198,21 +1933,31 @@ async def handle_email_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
             f"🔍 Buscando {search_description.get(search_state, 'información')}..."
         )
         
-        # Ejecutar la búsqueda en un hilo separado para no bloquear el bot
-        loop = asyncio.get_running_loop()
-        
-        # Función auxiliar para ejecutar la búsqueda
-        def run_search():
-            return email_service.search_emails(
+        if os.environ.get("IMAP_ASYNC_SEARCH", "1") == "1":
+            # Cliente IMAP asíncrono: no ocupa un hilo del executor por búsqueda
+            result = await email_service.search_emails_async(
                 email_addr=email_addr,
                 service=service,
                 regex_type=regex_type,
                 bot_token=bot_token,
                 user_id=user_id
             )
-        
-        # Ejecutar en executor
-        result = await loop.run_in_executor(None, run_search)
+        else:
+            # Ejecutar la búsqueda en un hilo separado para no bloquear el bot
+            loop = asyncio.get_running_loop()
+            
+            # Función auxiliar para ejecutar la búsqueda
+            def run_search():
+                return email_service.search_emails(
+                    email_addr=email_addr,
+                    service=service,
+                    regex_type=regex_type,
+                    bot_token=bot_token,
+                    user_id=user_id
+                )
+            
+            # Ejecutar en executor
+            result = await loop.run_in_executor(None, run_search)
         
         # Crear teclado base para todos los resultados
         service_menu_name = service + "_menu"
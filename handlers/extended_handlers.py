@@ -1,7 +1,10 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
+import csv
+import io
 import json
 import os
+import re
 import psutil
 import subprocess
 import asyncio
@@ -10,10 +13,23 @@ from config import ADMIN_ID
 from handlers.admin_handlers import admin_required, AdminManager
 from utils.logger_utility import bot_logger
 from utils.notifications import AdminNotifier
-from database.connection import execute_query
+from database.connection import execute_query, transaction
+from database.async_db import db
+from database.models import add_user_emails, upsert_user_role
+from database.exports import export_emails_csv, export_user_emails_txt
+from database.imports import import_users
+from utils.authorization import authorization_service, ADMIN_ROLES
 from datetime import datetime, timedelta 
 from utils.permission_middleware import reseller_can_manage_user, admin_or_reseller_required
 
+# Usuarios por página en /list
+LIST_PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", "10"))
+
+# Límites de la importación de usuarios desde CSV
+IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", str(2 * 1024 * 1024)))
+IMPORT_MAX_ROWS = int(os.environ.get("IMPORT_MAX_ROWS", "10000"))
+_IMPORT_EMAIL_RE = re.compile(r'^[^@\s,;]+@[^@\s,;]+\.[^@\s,;]+$')
+
 class UserManager:
     def __init__(self):
         pass
@@ -29,38 +45,36 @@ class UserManager:
             created_by (int, optional): ID of admin who created the user
         """
         try:
-            # Obtener el ID del rol de usuario
-            role_result = execute_query("SELECT id FROM roles WHERE name = 'user'")
-            if not role_result:
-                raise ValueError("No se encontró el rol de usuario en la base de datos")
-                
-            user_role_id = role_result[0][0]
-            
-            # Verificar si el usuario ya existe
-            user_exists = execute_query(
-                "SELECT id FROM users WHERE id = %s AND bot_token = %s",
-                (user_id, bot_token)
-            )
+            # Alta o actualización en una sola sentencia y un solo commit
+            with transaction() as tx:
+                if not upsert_user_role(tx, user_id, bot_token, 'user', expiration, created_by):
+                    raise ValueError("No se encontró el rol de usuario en la base de datos")
             
-            if user_exists:
-                # Actualizar usuario existente
-                execute_query("""
-                UPDATE users 
-                SET role_id = %s, access_until = %s
-                WHERE id = %s AND bot_token = %s
-                """, (user_role_id, expiration, user_id, bot_token))
-            else:
-                # Crear nuevo usuario
-                execute_query("""
-                INSERT INTO users (id, role_id, bot_token, access_until, created_by)
-                VALUES (%s, %s, %s, %s, %s)
-                """, (user_id, user_role_id, bot_token, expiration, created_by))
-                
+            authorization_service.invalidate(bot_token, user_id)
             return True
         except Exception as e:
             bot_logger.log_error(f"Error al añadir usuario {user_id}: {str(e)}")
             raise
     
+    def add_user_with_emails(self, user_id, expiration, bot_token, emails, created_by=None):
+        """
+        Add or update a user and assign emails in a single transaction
+        
+        Returns:
+            tuple: (list of emails inserted, list of emails already assigned)
+        """
+        try:
+            with transaction() as tx:
+                if not upsert_user_role(tx, user_id, bot_token, 'user', expiration, created_by):
+                    raise ValueError("No se encontró el rol de usuario en la base de datos")
+                result = add_user_emails(user_id, bot_token, emails, tx=tx)
+            
+            authorization_service.invalidate(bot_token, user_id)
+            return result
+        except Exception as e:
+            bot_logger.log_error(f"Error al añadir usuario {user_id}: {str(e)}")
+            raise
+    
     def is_user_valid(self, user_id, bot_token):
         """Verifica si un usuario está activo basado en su expiración general"""
         try:
@@ -111,16 +125,15 @@ class UserManager:
             emails (list): List of email addresses to add
             bot_token (str): Bot token
             added_by (int, optional): ID of admin who added the emails
+        
+        Returns:
+            tuple: (list of emails inserted, list of emails already assigned)
         """
         try:
-            for email in emails:
-                execute_query("""
-                INSERT INTO user_emails (user_id, bot_token, email)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (user_id, bot_token, email) DO NOTHING
-                """, (user_id, bot_token, email.lower()))
-                
-            return True
+            inserted, duplicates = add_user_emails(user_id, bot_token, emails)
+            
+            authorization_service.invalidate(bot_token, user_id)
+            return inserted, duplicates
         except Exception as e:
             bot_logger.log_error(f"Error añadiendo correos al usuario {user_id}: {str(e)}")
             raise
@@ -134,18 +147,20 @@ class UserManager:
             bot_token (str): Bot token
         """
         try:
-            # Eliminar todos los correos del usuario
-            execute_query("""
-            DELETE FROM user_emails
-            WHERE user_id = %s AND bot_token = %s
-            """, (user_id, bot_token))
-            
-            # Eliminar el usuario
-            execute_query("""
-            DELETE FROM users
-            WHERE id = %s AND bot_token = %s
-            """, (user_id, bot_token))
+            with transaction() as tx:
+                # Eliminar todos los correos del usuario
+                tx.execute("""
+                DELETE FROM user_emails
+                WHERE user_id = %s AND bot_token = %s
+                """, (user_id, bot_token))
+                
+                # Eliminar el usuario
+                tx.execute("""
+                DELETE FROM users
+                WHERE id = %s AND bot_token = %s
+                """, (user_id, bot_token))
             
+            authorization_service.invalidate(bot_token, user_id)
             return True
         except Exception as e:
             bot_logger.log_error(f"Error eliminando al usuario {user_id}: {str(e)}")
@@ -164,29 +179,19 @@ class UserManager:
             tuple: (number of emails removed, list of emails not found)
         """
         try:
-            removed_count = 0
-            not_found = []
-            
-            # Verificar qué correos existen para este usuario
-            existing_emails = execute_query("""
-            SELECT email FROM user_emails
-            WHERE user_id = %s AND bot_token = %s
-            """, (user_id, bot_token))
+            # Un solo DELETE para todos los correos; RETURNING indica cuáles existían
+            removed = execute_query("""
+            DELETE FROM user_emails
+            WHERE user_id = %s AND bot_token = %s AND email = ANY(%s)
+            RETURNING email
+            """, (user_id, bot_token, [email.lower() for email in emails_to_remove]))
             
-            existing_set = {email[0].lower() for email in existing_emails} if existing_emails else set()
+            removed_set = {row[0] for row in removed} if removed else set()
+            removed_count = len(removed_set)
+            not_found = [email for email in emails_to_remove if email.lower() not in removed_set]
             
-            for email in emails_to_remove:
-                email_lower = email.lower()
-                if email_lower in existing_set:
-                    # Eliminar el correo
-                    execute_query("""
-                    DELETE FROM user_emails
-                    WHERE user_id = %s AND bot_token = %s AND email = %s
-                    """, (user_id, bot_token, email_lower))
-                    removed_count += 1
-                else:
-                    not_found.append(email)
-                    
+            if removed_count:
+                authorization_service.invalidate(bot_token, user_id)
             return removed_count, not_found
         except Exception as e:
             bot_logger.log_error(f"Error eliminando correos del usuario {user_id}: {str(e)}")
@@ -206,94 +211,146 @@ class UserManager:
             bool: True if email was replaced, False otherwise
         """
         try:
-            # Verificar si el correo viejo existe
-            old_exists = execute_query("""
-            SELECT id FROM user_emails
-            WHERE user_id = %s AND bot_token = %s AND email = %s
-            """, (user_id, bot_token, old_email.lower()))
-            
-            if not old_exists:
-                return False
+            with transaction() as tx:
+                # Eliminar el correo viejo (si no existía no se cambia nada)
+                old_exists = tx.execute("""
+                DELETE FROM user_emails
+                WHERE user_id = %s AND bot_token = %s AND email = %s
+                RETURNING id
+                """, (user_id, bot_token, old_email.lower()))
                 
-            # Eliminar el correo viejo
-            execute_query("""
-            DELETE FROM user_emails
-            WHERE user_id = %s AND bot_token = %s AND email = %s
-            """, (user_id, bot_token, old_email.lower()))
-            
-            # Añadir el nuevo correo
-            execute_query("""
-            INSERT INTO user_emails (user_id, bot_token, email)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (user_id, bot_token, email) DO NOTHING
-            """, (user_id, bot_token, new_email.lower()))
-            
-            # Registrar la garantía
-            execute_query("""
-            INSERT INTO warranty_records (user_id, bot_token, old_email, new_email)
-            VALUES (%s, %s, %s, %s)
-            """, (user_id, bot_token, old_email.lower(), new_email.lower()))
+                if not old_exists:
+                    return False
+                
+                # Añadir el nuevo correo
+                tx.execute("""
+                INSERT INTO user_emails (user_id, bot_token, email)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (user_id, bot_token, email) DO NOTHING
+                """, (user_id, bot_token, new_email.lower()))
+                
+                # Registrar la garantía
+                tx.execute("""
+                INSERT INTO warranty_records (user_id, bot_token, old_email, new_email)
+                VALUES (%s, %s, %s, %s)
+                """, (user_id, bot_token, old_email.lower(), new_email.lower()))
             
+            authorization_service.invalidate(bot_token, user_id)
             return True
         except Exception as e:
             bot_logger.log_error(f"Error reemplazando correo del usuario {user_id}: {str(e)}")
             raise
     
     def get_all_users(self, bot_token):
-        """Get information about all users in the system"""
+        """Get information about all users in the system (one query, emails aggregated server-side)"""
         try:
-            users = []
-            current_time = datetime.now()
-            
-            # Obtener usuarios con sus roles y correos
             result = execute_query("""
             SELECT u.id, u.access_until, u.created_at, r.name as role_name, 
-                u.free_access, u.created_by
+                u.free_access, u.created_by,
+                COALESCE(array_agg(e.email ORDER BY e.email) FILTER (WHERE e.email IS NOT NULL), '{}')
             FROM users u
             JOIN roles r ON u.role_id = r.id
+            LEFT JOIN user_emails e ON e.user_id = u.id AND e.bot_token = u.bot_token
             WHERE u.bot_token = %s
+            GROUP BY u.id, u.access_until, u.created_at, r.name, u.free_access, u.created_by
             ORDER BY u.access_until
             """, (bot_token,))
             
-            if not result:
-                return []
-                    
-            for user_row in result:
-                user_id, expiration, created_at, role_name, free_access, created_by = user_row
-                
-                # Obtener correos del usuario
-                emails_result = execute_query("""
-                SELECT email FROM user_emails
-                WHERE user_id = %s AND bot_token = %s
-                """, (user_id, bot_token))
-                
-                user_emails = [{"email": email[0]} for email in emails_result] if emails_result else []
-                
-                # Calcular tiempo restante (protegiendo contra None)
-                if expiration is not None:
-                    time_remaining = expiration - current_time
-                else:
-                    time_remaining = timedelta(0)  # Valor predeterminado si es None
-                
-                user_info = {
-                    'user_id': user_id,
-                    'expiration': expiration or datetime.now(),  # Valor predeterminado si es None
-                    'time_remaining': time_remaining,
-                    'role': role_name,
-                    'emails': user_emails,
-                    'total_emails': len(user_emails),
-                    'created_at': created_at,
-                    'free_access': free_access,
-                    'created_by': created_by
-                }
-                
+            users = []
+            for row in result or []:
+                user_info = self._user_row_to_info(row[:6], len(row[6]))
+                user_info['emails'] = [{"email": email} for email in row[6]]
                 users.append(user_info)
-                    
             return users
         except Exception as e:
             bot_logger.log_error(f"Error obteniendo todos los usuarios: {str(e)}")
             return []
 
+    def get_users_page(self, bot_token, after_id=None, before_id=None, created_by=None, user_id=None, page_size=None):
+        """
+        Get one page of users ordered by ID using keyset pagination
+        
+        Args:
+            bot_token (str): Bot token
+            after_id (int, optional): Return users with ID greater than this (next page)
+            before_id (int, optional): Return users with ID lower than this (previous page)
+            created_by (int, optional): Only users created by this reseller
+            user_id (int, optional): Only this user
+            page_size (int, optional): Users per page (LIST_PAGE_SIZE by default)
+        
+        Returns:
+            tuple: (list of user dicts, has previous page, has next page, total users)
+        """
+        page_size = page_size or LIST_PAGE_SIZE
+        conditions = ["u.bot_token = %s"]
+        params = [bot_token]
+        if created_by is not None:
+            conditions.append("u.created_by = %s")
+            params.append(created_by)
+        if user_id is not None:
+            conditions.append("u.id = %s")
+            params.append(user_id)
+        filter_sql = " AND ".join(conditions)
+        filter_params = list(params)
+        
+        if before_id is not None:
+            conditions.append("u.id < %s")
+            params.append(before_id)
+            order = "DESC"
+        else:
+            if after_id is not None:
+                conditions.append("u.id > %s")
+                params.append(after_id)
+            order = "ASC"
+        
+        # Correos contados en el servidor (índice único user_id, bot_token, email)
+        result = execute_query(f"""
+        SELECT u.id, u.access_until, u.created_at, r.name, u.free_access, u.created_by,
+            (SELECT COUNT(*) FROM user_emails e
+             WHERE e.user_id = u.id AND e.bot_token = u.bot_token)
+        FROM users u
+        JOIN roles r ON u.role_id = r.id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY u.id {order}
+        LIMIT %s
+        """, params + [page_size + 1]) or []
+        
+        more = len(result) > page_size
+        rows = result[:page_size]
+        if before_id is not None:
+            rows.reverse()
+            has_prev, has_next = more, True
+        else:
+            has_prev, has_next = after_id is not None, more
+        
+        # Mismo JOIN que la página para no contar usuarios sin rol que nunca se listan
+        total = execute_query(f"""
+        SELECT COUNT(*) FROM users u
+        JOIN roles r ON u.role_id = r.id
+        WHERE {filter_sql}
+        """, filter_params)
+        users = [self._user_row_to_info(row[:6], row[6]) for row in rows]
+        return users, has_prev, has_next, total[0][0] if total else 0
+
+    @staticmethod
+    def _user_row_to_info(row, total_emails):
+        user_id, expiration, created_at, role_name, free_access, created_by = row
+        # Calcular tiempo restante (protegiendo contra None)
+        if expiration is not None:
+            time_remaining = expiration - datetime.now()
+        else:
+            time_remaining = timedelta(0)  # Valor predeterminado si es None
+        return {
+            'user_id': user_id,
+            'expiration': expiration or datetime.now(),  # Valor predeterminado si es None
+            'time_remaining': time_remaining,
+            'role': role_name,
+            'total_emails': total_emails,
+            'created_at': created_at,
+            'free_access': free_access,
+            'created_by': created_by
+        }
+
 async def _process_bot_action(update: Update, context: ContextTypes.DEFAULT_TYPE, action_type="restart"):
     """
     Función base para procesar acciones de reinicio o detención del bot
@@ -427,38 +484,33 @@ async def adduser_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:  # unit == 'm'
             expiration = datetime.now() + timedelta(minutes=amount)
 
-        # Add user
+        # Add user and emails in one transaction
         user_manager = UserManager()
-        user_manager.add_user(
+        inserted, duplicates = await db.run(
+            user_manager.add_user_with_emails,
             user_id, 
             expiration, 
             context.bot.token,
+            emails,
             created_by=update.effective_user.id
         )
 
-        # Add emails if provided
-        if emails:
-            user_manager.add_emails(
-                user_id,
-                emails,
-                context.bot.token,
-                added_by=update.effective_user.id
-            )
-
         # Prepare response message
         response = (
             f"✅ Usuario {user_id} añadido exitosamente\n"
             f"⏱️ Expira: {expiration.strftime('%Y-%m-%d %H:%M:%S')}\n"
         )
         if emails:
-            response += f"📧 Correos añadidos: {len(emails)}"
+            response += f"📧 Correos añadidos: {len(inserted)}"
+            if duplicates:
+                response += f" ({len(duplicates)} ya estaban asignados)"
 
         await update.message.reply_text(response)
 
         # Notificar al administrador si un revendedor realiza la acción
         if update.effective_user.id != ADMIN_ID:
             admin_manager = AdminManager()
-            if not admin_manager.is_admin(update.effective_user.id, context.bot.token):
+            if not await db.run(admin_manager.is_admin, update.effective_user.id, context.bot.token):
                 try:
                     await AdminNotifier.notify_admin_action(
                         context,
@@ -489,7 +541,7 @@ async def removeuser_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         bot_token = context.bot.token
         
         # Verificar si el usuario existe
-        user_exists = execute_query("""
+        user_exists = await db.fetch("""
         SELECT id FROM users
         WHERE id = %s AND bot_token = %s
         """, (user_id, bot_token))
@@ -500,14 +552,14 @@ async def removeuser_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         # Eliminar usuario
         user_manager = UserManager()
-        if user_manager.remove_user(user_id, bot_token):
+        if await db.run(user_manager.remove_user, user_id, bot_token):
             # Registrar acción
             bot_logger.logger.info(f"Usuario {user_id} eliminado por {update.effective_user.id}")
             
             # Notificar al administrador si un revendedor realiza la acción
             if update.effective_user.id != ADMIN_ID:
                 admin_manager = AdminManager()
-                if not admin_manager.is_admin(update.effective_user.id, bot_token):
+                if not await db.run(admin_manager.is_admin, update.effective_user.id, bot_token):
                     try:
                         await AdminNotifier.notify_admin_action(
                             context,
@@ -542,7 +594,7 @@ async def addemail_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         emails = context.args[1:]
         
         # Verificar si el usuario existe
-        user_exists = execute_query("""
+        user_exists = await db.fetch("""
         SELECT id FROM users
         WHERE id = %s AND bot_token = %s
         """, (user_id, context.bot.token))
@@ -551,24 +603,29 @@ async def addemail_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(f"❌ El usuario {user_id} no existe.")
             return
         
-        # Añadir correos
+        # Añadir correos (una sola inserción masiva)
         user_manager = UserManager()
-        user_manager.add_emails(
+        inserted, duplicates = await db.run(
+            user_manager.add_emails,
             user_id, 
             emails,
             context.bot.token,
             added_by=update.effective_user.id
         )
         
-        await update.message.reply_text(
-            f"✅ Correos añadidos exitosamente para el usuario {user_id}\n"
-            f"📧 Correos: {', '.join(emails)}"
+        response = (
+            f"✅ Correos procesados para el usuario {user_id}\n"
+            f"📧 Añadidos: {len(inserted)}\n"
+            f"♻️ Ya asignados: {len(duplicates)}"
         )
+        if duplicates and len(duplicates) <= 20:
+            response += f"\n{', '.join(duplicates)}"
+        await update.message.reply_text(response)
         
         # Notificar al administrador si un revendedor realiza la acción
         if update.effective_user.id != ADMIN_ID:
             admin_manager = AdminManager()
-            if not admin_manager.is_admin(update.effective_user.id, context.bot.token):
+            if not await db.run(admin_manager.is_admin, update.effective_user.id, context.bot.token):
                 try:
                     await AdminNotifier.notify_admin_action(
                         context,
@@ -601,7 +658,7 @@ async def eliminar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         bot_token = context.bot.token
         
         # Verificar si el usuario existe
-        user_exists = execute_query("""
+        user_exists = await db.fetch("""
         SELECT id FROM users
         WHERE id = %s AND bot_token = %s
         """, (user_id, bot_token))
@@ -612,12 +669,12 @@ async def eliminar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Eliminar correos
         user_manager = UserManager()
-        removed_count, not_found = user_manager.remove_emails(user_id, emails, bot_token)
+        removed_count, not_found = await db.run(user_manager.remove_emails, user_id, emails, bot_token)
         
         # Notificar al administrador si un revendedor realiza la acción
         if caller_id != ADMIN_ID:
             admin_manager = AdminManager()
-            if not admin_manager.is_admin(caller_id, bot_token):
+            if not await db.run(admin_manager.is_admin, caller_id, bot_token):
                 try:
                     await AdminNotifier.notify_admin_action(
                         context,
@@ -666,7 +723,7 @@ async def garantia_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         bot_token = context.bot.token
         
         # Verificar si el usuario existe
-        user_exists = execute_query("""
+        user_exists = await db.fetch("""
         SELECT id FROM users
         WHERE id = %s AND bot_token = %s
         """, (user_id, bot_token))
@@ -677,11 +734,11 @@ async def garantia_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Realizar el reemplazo
         user_manager = UserManager()
-        if user_manager.replace_email(user_id, old_email, new_email, bot_token):
+        if await db.run(user_manager.replace_email, user_id, old_email, new_email, bot_token):
             # Notificar al administrador si un revendedor realiza la acción
             if caller_id != ADMIN_ID:
                 admin_manager = AdminManager()
-                if not admin_manager.is_admin(caller_id, bot_token):
+                if not await db.run(admin_manager.is_admin, caller_id, bot_token):
                     try:
                         await AdminNotifier.notify_admin_action(
                             context,
@@ -725,106 +782,142 @@ async def garantia_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ Error: {str(e)}")
         bot_logger.log_error(f"Error en garantia_command: {str(e)}")
 
+async def _list_scope(user_id, bot_token):
+    """
+    Determina qué usuarios puede listar quien llama.
+    Devuelve (True, None) para administradores, (True, user_id) para
+    revendedores (solo sus usuarios) y (False, None) si no tiene permiso.
+    """
+    if user_id == ADMIN_ID:
+        return True, None
+    user_info = await authorization_service.get_user_async(user_id, bot_token)
+    role = user_info['role'] if user_info else None
+    if role in ADMIN_ROLES:
+        return True, None
+    if role == 'reseller':
+        return True, user_id
+    return False, None
+
+def _format_user_entry(user):
+    time_remaining = user['time_remaining']
+    days = time_remaining.days
+    hours = time_remaining.seconds // 3600
+    return (
+        f"━━━━━━━━━━━━━━━━━━━━━\n"
+        f"🆔 ID: {user['user_id']}\n"
+        f"⏳ Tiempo restante: {days}d {hours}h\n"
+        f"📅 Expira: {user['expiration'].strftime('%Y-%m-%d %H:%M')}\n"
+        f"🔑 Rol: {user['role']}\n"
+        f"📧 Total correos: {user['total_emails']}"
+    )
+
+def _render_users_page(users, has_prev, has_next, total):
+    """Texto y teclado de una página de /list (un solo mensaje por página)"""
+    text = f"👥 Usuarios ({total} en total)\n" + "\n".join(_format_user_entry(user) for user in users)
+    
+    keyboard = []
+    # Botones de descarga de correos, dos por fila
+    download_buttons = [
+        InlineKeyboardButton(
+            f"📥 {user['user_id']} ({user['total_emails']})",
+            callback_data=f"download_emails_{user['user_id']}"
+        )
+        for user in users if user['total_emails'] > 0
+    ]
+    for i in range(0, len(download_buttons), 2):
+        keyboard.append(download_buttons[i:i + 2])
+    
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"list_p_{users[0]['user_id']}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"list_n_{users[-1]['user_id']}"))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton("🏠 Menú Principal", callback_data='main_menu')])
+    return text, InlineKeyboardMarkup(keyboard)
+
 @admin_or_reseller_required
 async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Lista usuarios con opción de descarga de correos"""
+    """Lista usuarios paginados con opción de descarga de correos"""
     try:
         user_id = update.effective_user.id
         bot_token = context.bot.token
         user_manager = UserManager()
-        admin_manager = AdminManager()
         
-        # Determinar qué usuarios mostrar
-        if user_id == ADMIN_ID or admin_manager.is_admin(user_id, bot_token):
-            # Administradores ven todos los usuarios
-            all_users = user_manager.get_all_users(bot_token)
-            
-            # Si se proporcionó un ID específico, filtrar
-            if context.args:
-                try:
-                    target_user_id = int(context.args[0])
-                    users_to_show = [user for user in all_users if user['user_id'] == target_user_id]
-                    if not users_to_show:
-                        await update.message.reply_text(f"❌ No se encontró el usuario con ID {target_user_id}")
-                        return
-                except ValueError:
-                    await update.message.reply_text("❌ El ID de usuario debe ser un número")
-                    return
-            else:
-                users_to_show = all_users
-        else:
-            # Verificar si es revendedor
-            role_result = execute_query("""
-            SELECT r.name FROM users u
-            JOIN roles r ON u.role_id = r.id
-            WHERE u.id = %s AND u.bot_token = %s
-            """, (user_id, bot_token))
-            
-            is_reseller = role_result and role_result[0][0] == 'reseller'
-            
-            if is_reseller:
-                # Obtener usuarios creados por este revendedor
-                all_users = user_manager.get_all_users(bot_token)
-                users_to_show = [user for user in all_users if user['created_by'] == user_id]
-                
-                if not users_to_show:
-                    await update.message.reply_text("📝 No has creado ningún usuario aún")
-                    return
-            else:
-                await update.message.reply_text("❌ No tienes permisos para usar este comando")
-                return
-
-        # Si no hay usuarios
-        if not users_to_show:
-            await update.message.reply_text("📝 No hay usuarios registrados en el sistema")
+        allowed, created_by = await _list_scope(user_id, bot_token)
+        if not allowed:
+            await update.message.reply_text("❌ No tienes permisos para usar este comando")
             return
-
-        # Enviar información de cada usuario en mensajes separados
-        for user in users_to_show:
-            time_remaining = user['time_remaining']
-            days = time_remaining.days
-            hours = time_remaining.seconds // 3600
-            
-            message = (
-                f"━━━━━━━━━━━━━━━━━━━━━\n"
-                f"🆔 ID: {user['user_id']}\n"
-                f"⏳ Tiempo restante: {days}d {hours}h\n"
-                f"📅 Expira: {user['expiration'].strftime('%Y-%m-%d %H:%M')}\n"
-                f"🔑 Rol: {user['role']}\n"
-                f"📧 Total correos: {user['total_emails']}"
+        
+        # Si se proporcionó un ID específico, mostrar solo ese usuario
+        if context.args:
+            try:
+                target_user_id = int(context.args[0])
+            except ValueError:
+                await update.message.reply_text("❌ El ID de usuario debe ser un número")
+                return
+            users, _, _, _ = await db.run(
+                user_manager.get_users_page, bot_token, created_by=created_by, user_id=target_user_id
             )
-            
-            # Crear botones para este usuario
-            keyboard = []
-            if user['total_emails'] > 0:
-                keyboard.append([
-                    InlineKeyboardButton(
-                        "📥 Descargar correos", 
-                        callback_data=f"download_emails_{user['user_id']}"
-                    )
-                ])
-            
-            # Enviar mensaje con botones si tiene correos
-            if keyboard:
-                await update.message.reply_text(
-                    message,
-                    reply_markup=InlineKeyboardMarkup(keyboard)
-                )
-            else:
-                await update.message.reply_text(message)
-            
-            await asyncio.sleep(0.5)
+            if not users:
+                await update.message.reply_text(f"❌ No se encontró el usuario con ID {target_user_id}")
+                return
+            text, markup = _render_users_page(users, False, False, 1)
+            await update.message.reply_text(text, reply_markup=markup)
+            return
         
-        # Mensaje final - CORREGIDO SIN USAR MARKDOWN
-        keyboard = [[InlineKeyboardButton("🏠 Menú Principal", callback_data='main_menu')]]
-        await update.message.reply_text(
-            "📝 Fin del listado",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+        users, has_prev, has_next, total = await db.run(
+            user_manager.get_users_page, bot_token, created_by=created_by
         )
         
+        if not users:
+            if created_by is not None:
+                await update.message.reply_text("📝 No has creado ningún usuario aún")
+            else:
+                await update.message.reply_text("📝 No hay usuarios registrados en el sistema")
+            return
+        
+        text, markup = _render_users_page(users, has_prev, has_next, total)
+        await update.message.reply_text(text, reply_markup=markup)
+        
     except Exception as e:
         await update.message.reply_text(f"❌ Error al listar usuarios: {str(e)}")
 
+async def handle_list_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Botones Anterior/Siguiente de /list: edita el mismo mensaje con la nueva página"""
+    query = update.callback_query
+    
+    try:
+        _, direction, cursor_id = query.data.split('_')
+        cursor_id = int(cursor_id)
+        bot_token = context.bot.token
+        
+        # El alcance se recalcula siempre: no se confía en el callback_data
+        allowed, created_by = await _list_scope(query.from_user.id, bot_token)
+        if not allowed:
+            await query.answer("❌ No tienes permisos para usar este comando", show_alert=True)
+            return
+        
+        user_manager = UserManager()
+        if direction == 'n':
+            page = await db.run(user_manager.get_users_page, bot_token, after_id=cursor_id, created_by=created_by)
+        else:
+            page = await db.run(user_manager.get_users_page, bot_token, before_id=cursor_id, created_by=created_by)
+        users, has_prev, has_next, total = page
+        
+        if not users:
+            await query.answer("📝 No hay más usuarios")
+            return
+        
+        await query.answer()
+        text, markup = _render_users_page(users, has_prev, has_next, total)
+        await query.edit_message_text(text, reply_markup=markup)
+        
+    except Exception as e:
+        bot_logger.log_error(f"Error paginando /list: {str(e)}")
+        await query.answer("❌ Error al cargar la página", show_alert=True)
+
 @admin_required
 async def restart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Reinicia el bot después de un tiempo opcional"""
@@ -850,7 +943,7 @@ async def free_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         bot_token = context.bot.token
         
         # Verificar si el usuario existe
-        user_exists = execute_query("""
+        user_exists = await db.fetch("""
         SELECT id FROM users
         WHERE id = %s AND bot_token = %s
         """, (user_id, bot_token))
@@ -860,11 +953,12 @@ async def free_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # Marcar al usuario como free_access
-        execute_query("""
+        await db.execute("""
         UPDATE users
         SET free_access = TRUE
         WHERE id = %s AND bot_token = %s
         """, (user_id, bot_token))
+        authorization_service.invalidate(bot_token, user_id)
             
         # Registrar en el log
         bot_logger.logger.info(f"Free access granted to user {user_id} by admin {update.effective_user.id}")
@@ -894,7 +988,7 @@ async def code_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         bot_token = context.bot.token
         
         # Verificar si el usuario existe
-        user_exists = execute_query("""
+        user_exists = await db.fetch("""
         SELECT id FROM users
         WHERE id = %s AND bot_token = %s
         """, (user_id, bot_token))
@@ -904,11 +998,12 @@ async def code_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # Marcar al usuario con code_access
-        execute_query("""
+        await db.execute("""
         UPDATE users
         SET code_access = TRUE
         WHERE id = %s AND bot_token = %s
         """, (user_id, bot_token))
+        authorization_service.invalidate(bot_token, user_id)
             
         # Registrar en el log
         bot_logger.logger.info(f"Code access granted to user {user_id} by admin {update.effective_user.id}")
@@ -958,13 +1053,13 @@ async def addtime_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Verificar si el usuario tiene permisos para 'allid'
             if caller_id != ADMIN_ID:
                 admin_manager = AdminManager()
-                if not admin_manager.is_admin(caller_id, bot_token):
+                if not await db.run(admin_manager.is_admin, caller_id, bot_token):
                     await update.message.reply_text("❌ Solo los administradores pueden actualizar el tiempo para todos los usuarios.")
                     return
             
             # Actualizar todos los usuarios
             try:
-                execute_query("""
+                await db.execute("""
                 UPDATE users
                 SET access_until = CASE
                     WHEN access_until < CURRENT_TIMESTAMP THEN CURRENT_TIMESTAMP + %s
@@ -972,6 +1067,7 @@ async def addtime_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 END
                 WHERE bot_token = %s
                 """, (time_delta, time_delta, bot_token))
+                authorization_service.invalidate(bot_token)
                 
                 await update.message.reply_text(
                     f"✅ Tiempo actualizado para todos los usuarios\n"
@@ -985,7 +1081,7 @@ async def addtime_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 user_id = int(target_id)
                 
                 # Verificar si el usuario existe
-                user_result = execute_query("""
+                user_result = await db.fetch("""
                 SELECT access_until FROM users
                 WHERE id = %s AND bot_token = %s
                 """, (user_id, bot_token))
@@ -1002,11 +1098,12 @@ async def addtime_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 else:
                     new_expiration = current_expiration + time_delta
                 
-                execute_query("""
+                await db.execute("""
                 UPDATE users
                 SET access_until = %s
                 WHERE id = %s AND bot_token = %s
                 """, (new_expiration, user_id, bot_token))
+                authorization_service.invalidate(bot_token, user_id)
                 
                 await update.message.reply_text(
                     f"✅ Tiempo actualizado para el usuario {user_id}\n"
@@ -1017,7 +1114,7 @@ async def addtime_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # Notificar al administrador si un revendedor realiza la acción
                 if caller_id != ADMIN_ID:
                     admin_manager = AdminManager()
-                    if not admin_manager.is_admin(caller_id, bot_token):
+                    if not await db.run(admin_manager.is_admin, caller_id, bot_token):
                         try:
                             await AdminNotifier.notify_admin_action(
                                 context,
@@ -1049,11 +1146,11 @@ async def handle_email_download(update: Update, context: ContextTypes.DEFAULT_TY
         # Verificar permisos del usuario que solicita la descarga
         if caller_id != ADMIN_ID:
             admin_manager = AdminManager()
-            is_admin = admin_manager.is_admin(caller_id, bot_token)
+            is_admin = await db.run(admin_manager.is_admin, caller_id, bot_token)
             
             if not is_admin:
                 # Verificar si es un revendedor con acceso a este usuario
-                role_result = execute_query("""
+                role_result = await db.fetch("""
                 SELECT r.name FROM users u
                 JOIN roles r ON u.role_id = r.id
                 WHERE u.id = %s AND u.bot_token = %s
@@ -1063,7 +1160,7 @@ async def handle_email_download(update: Update, context: ContextTypes.DEFAULT_TY
                 
                 if is_reseller:
                     # Verificar si el revendedor creó este usuario
-                    creator_check = execute_query("""
+                    creator_check = await db.fetch("""
                     SELECT id FROM users
                     WHERE id = %s AND bot_token = %s AND created_by = %s
                     """, (user_id, bot_token, caller_id))
@@ -1075,41 +1172,224 @@ async def handle_email_download(update: Update, context: ContextTypes.DEFAULT_TY
                     await query.message.reply_text("❌ No tienes permisos para descargar correos.")
                     return
         
-        # Obtener correos del usuario
-        emails_result = execute_query("""
-        SELECT email FROM user_emails
-        WHERE user_id = %s AND bot_token = %s
-        ORDER BY email
-        """, (user_id, bot_token))
+        # Obtener correos del usuario (cursor de servidor a un buffer en memoria)
+        export_file, total = await db.run(export_user_emails_txt, user_id, bot_token)
         
-        if not emails_result:
+        if not export_file:
             await query.message.reply_text(f"❌ No se encontraron correos para el usuario {user_id}")
             return
         
-        user_emails = [email[0] for email in emails_result]
+        try:
+            await query.message.reply_document(
+                document=export_file,
+                filename=f"correos_usuario_{user_id}.txt",
+                caption=f"📧 Lista de correos para usuario {user_id}"
+            )
+        finally:
+            export_file.close()
         
-        file_path = f"temp_{user_id}_emails.txt"
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(f"Lista de correos para usuario {user_id}\n")
-            f.write("=" * 50 + "\n\n")
-            
-            for email in user_emails:
-                f.write(f"{email}\n")
-            
-            f.write(f"\nTotal de correos: {len(user_emails)}")
+    except Exception as e:
+        error_msg = f"❌ Error al descargar correos: {str(e)}"
+        bot_logger.log_error(error_msg)
+        await query.message.reply_text(error_msg)
+
+@admin_or_reseller_required
+async def export_emails_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Exporta en CSV los correos de todos los usuarios del bot o del subárbol de un revendedor
+    Uso: /exportemails [reseller_id]
+    """
+    try:
+        caller_id = update.effective_user.id
+        bot_token = context.bot.token
+        
+        allowed, created_by = await _list_scope(caller_id, bot_token)
+        if not allowed:
+            await update.message.reply_text("❌ No tienes permisos para usar este comando")
+            return
         
-        await query.message.reply_document(
-            document=open(file_path, 'rb'),
-            filename=f"correos_usuario_{user_id}.txt",
-            caption=f"📧 Lista de correos para usuario {user_id}"
+        if created_by is not None:
+            # Los revendedores solo exportan su propio subárbol
+            root_id = created_by
+        elif context.args:
+            try:
+                root_id = int(context.args[0])
+            except ValueError:
+                await update.message.reply_text("❌ El ID de revendedor debe ser un número")
+                return
+        else:
+            root_id = None
+        
+        export_file, rows, compressed = await db.run(export_emails_csv, bot_token, root_id)
+        if not rows:
+            export_file.close()
+            await update.message.reply_text("📝 No hay correos para exportar")
+            return
+        
+        scope = f"revendedor_{root_id}" if root_id is not None else "bot"
+        filename = f"correos_{scope}_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+        if compressed:
+            filename += ".gz"
+        
+        try:
+            await update.message.reply_document(
+                document=export_file,
+                filename=filename,
+                caption=f"📧 {rows} correos exportados" + (" (comprimido con gzip)" if compressed else "")
+            )
+        finally:
+            export_file.close()
+        
+    except Exception as e:
+        error_msg = f"❌ Error al exportar correos: {str(e)}"
+        bot_logger.log_error(error_msg)
+        await update.message.reply_text(error_msg)
+
+def _parse_duration(time_str):
+    """Convierte '30d' / '90m' en timedelta; None si el formato no es válido"""
+    if len(time_str) < 2 or time_str[-1] not in ('d', 'm') or not time_str[:-1].isdigit():
+        return None
+    amount = int(time_str[:-1])
+    return timedelta(days=amount) if time_str[-1] == 'd' else timedelta(minutes=amount)
+
+def _parse_import_csv(text):
+    """
+    Valida un CSV de importación: user_id, duración, correo1, correo2...
+    (una celda también puede contener varios correos separados por espacios).
+    
+    Returns:
+        tuple: (filas válidas [(línea, user_id, access_until, [correos])], errores [(línea, mensaje)])
+    """
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    
+    now = datetime.now()
+    rows, errors, seen = [], [], {}
+    for line_no, cells in enumerate(csv.reader(io.StringIO(text), dialect), start=1):
+        cells = [cell.strip() for cell in cells]
+        if not any(cells):
+            continue
+        # Cabecera opcional en la primera línea
+        if line_no == 1 and not cells[0].lstrip('-').isdigit():
+            continue
+        if len(rows) + len(errors) >= IMPORT_MAX_ROWS:
+            errors.append((line_no, f"Se superó el máximo de {IMPORT_MAX_ROWS} filas; resto ignorado"))
+            break
+        
+        try:
+            user_id = int(cells[0])
+        except ValueError:
+            errors.append((line_no, f"ID de usuario inválido: {cells[0]!r}"))
+            continue
+        if user_id == ADMIN_ID:
+            errors.append((line_no, "No se puede modificar al super administrador"))
+            continue
+        if user_id in seen:
+            errors.append((line_no, f"Usuario {user_id} repetido (ya aparece en la línea {seen[user_id]})"))
+            continue
+        
+        duration = _parse_duration(cells[1]) if len(cells) > 1 else None
+        if duration is None:
+            errors.append((line_no, "Duración inválida: use un número seguido de 'd' o 'm'"))
+            continue
+        
+        emails, bad = [], []
+        for cell in cells[2:]:
+            for email in cell.split():
+                email = email.lower()
+                if len(email) > 255 or not _IMPORT_EMAIL_RE.match(email):
+                    bad.append(email)
+                elif email not in emails:
+                    emails.append(email)
+        if bad:
+            errors.append((line_no, f"Correos inválidos: {', '.join(bad)}"))
+            continue
+        
+        seen[user_id] = line_no
+        rows.append((line_no, user_id, now + duration, emails))
+    return rows, errors
+
+@admin_or_reseller_required
+async def import_users_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Importa usuarios y correos desde un documento CSV enviado al bot.
+    Formato por fila: user_id, tiempo (30d / 90m), correo1, correo2...
+    Los revendedores solo pueden crear usuarios nuevos o modificar los suyos.
+    """
+    try:
+        caller_id = update.effective_user.id
+        bot_token = context.bot.token
+        document = update.message.document
+        
+        allowed, created_by = await _list_scope(caller_id, bot_token)
+        if not allowed:
+            await update.message.reply_text("❌ No tienes permisos para importar usuarios")
+            return
+        
+        if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+            await update.message.reply_text(
+                f"❌ El archivo supera el máximo de {IMPORT_MAX_BYTES // 1024} KB"
+            )
+            return
+        
+        file = await document.get_file()
+        content = bytes(await file.download_as_bytearray())
+        try:
+            text = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            text = content.decode('latin-1')
+        
+        rows, errors = _parse_import_csv(text)
+        if not rows and not errors:
+            await update.message.reply_text("📝 El archivo no contiene filas para importar")
+            return
+        
+        result = {'created': 0, 'updated': 0, 'emails_added': 0, 'emails_duplicated': 0,
+                  'user_ids': [], 'errors': []}
+        if rows:
+            result = await db.run(import_users, bot_token, rows, caller_id, created_by is not None)
+            authorization_service.invalidate(bot_token)
+        errors = sorted(errors + result['errors'])
+        
+        summary = (
+            f"📥 Importación completada\n\n"
+            f"👤 Usuarios nuevos: {result['created']}\n"
+            f"🔄 Usuarios actualizados: {result['updated']}\n"
+            f"📧 Correos añadidos: {result['emails_added']}\n"
+            f"♻️ Correos ya asignados: {result['emails_duplicated']}\n"
+            f"⚠️ Filas con errores: {len(errors)}"
         )
+        report = "\n".join(f"Línea {line_no}: {message}" for line_no, message in errors)
+        if errors and len(errors) <= 20:
+            summary += "\n\n" + report
+        await update.message.reply_text(summary)
+        
+        if len(errors) > 20:
+            await update.message.reply_document(
+                document=io.BytesIO(report.encode('utf-8')),
+                filename="errores_importacion.txt",
+                caption="⚠️ Informe de errores por fila"
+            )
         
-        os.remove(file_path)
+        # Notificar al administrador si un revendedor realiza la acción
+        if created_by is not None and result['user_ids']:
+            try:
+                await AdminNotifier.notify_admin_action(
+                    context,
+                    caller_id,
+                    "importar_usuarios",
+                    f"Nuevos: {result['created']}, actualizados: {result['updated']}, "
+                    f"correos: {result['emails_added']}"
+                )
+            except Exception as e:
+                bot_logger.log_error(f"Error notificando al admin: {str(e)}")
         
     except Exception as e:
-        error_msg = f"❌ Error al descargar correos: {str(e)}"
+        error_msg = f"❌ Error al importar usuarios: {str(e)}"
         bot_logger.log_error(error_msg)
-        await query.message.reply_text(error_msg)
+        await update.message.reply_text(error_msg)
 
 def read_pid_files():
     """Read current and old PID files"""
@@ -1175,5 +1455,8 @@ __all__ = [
     'free_command',
     'code_command',
     'handle_email_download',
+    'handle_list_page',
+    'export_emails_command',
+    'import_users_document',
     'UserManager'
 ]
@@ -2,9 +2,13 @@ import imaplib
 import email
 import re
 import logging
+import os
+import threading
+import time
 from datetime import datetime, timedelta
 from config import DEFAULT_IMAP_CONFIG
 from database.connection import execute_query
+from database.cache_bus import cache_bus
 
 # Configure logger for IMAP operations
 imap_logger = logging.getLogger('imap_operations')
@@ -114,3 +118,121 @@ class IMAPConnectionPool:
         imap_logger.info("Closing all IMAP connections")
         for key in list(self.connections.keys()):
             self.close_connection(key)
+
+
+class IMAPConfigResolver:
+    """
+    Índice en memoria de imap_config por bot.
+
+    Carga las filas de un bot una sola vez y las indexa por dominio/prefijo,
+    con la configuración de Gmail y la primera fila como respaldos. Se
+    invalida al modificar la tabla (addimap, borrado desde el menú) y, por
+    seguridad, caduca tras IMAP_CONFIG_CACHE_TTL segundos.
+    """
+
+    def __init__(self):
+        self._ttl = int(os.environ.get("IMAP_CONFIG_CACHE_TTL", "300"))
+        self._entries = {}      # bot_token -> (expira_en, índice)
+        self._generation = {}   # bot_token -> contador de invalidaciones
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _as_config(row):
+        _, config_email, config_password, config_server = row
+        return {
+            'EMAIL_ACCOUNT': config_email,
+            'PASSWORD': config_password,
+            'IMAP_SERVER': config_server,
+            'IMAP_PORT': 993
+        }
+
+    def _load(self, bot_token):
+        rows = execute_query(
+            "SELECT domain, email, password, imap_server FROM imap_config WHERE bot_token = %s ORDER BY id",
+            (bot_token,)
+        ) or []
+        by_domain = {}
+        for row in rows:
+            # Ante dominios repetidos gana la primera fila, como en el recorrido lineal
+            by_domain.setdefault(row[0], self._as_config(row))
+        return {
+            'by_domain': by_domain,
+            'gmail': by_domain.get('gmail.com'),
+            'default': self._as_config(rows[0]) if rows else None,
+            'accounts': list({config['EMAIL_ACCOUNT']: config for config in by_domain.values()}.values())
+        }
+
+    def _index(self, bot_token):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(bot_token)
+            if entry and entry[0] > now:
+                return entry[1]
+            generation = self._generation.get(bot_token, 0)
+
+        index = self._load(bot_token)
+
+        with self._lock:
+            # Si hubo una invalidación durante la carga, no guardar datos potencialmente viejos
+            if self._generation.get(bot_token, 0) == generation:
+                self._entries[bot_token] = (now + self._ttl, index)
+        return index
+
+    def invalidate(self, bot_token=None, broadcast=True):
+        """
+        Descarta el índice de un bot (o de todos) tras modificar imap_config.
+        Con broadcast se avisa también al resto de procesos de bot.
+        """
+        with self._lock:
+            tokens = [bot_token] if bot_token else list(self._entries)
+            for token in tokens:
+                self._entries.pop(token, None)
+                self._generation[token] = self._generation.get(token, 0) + 1
+        imap_logger.info(f"Índice de configuración IMAP invalidado ({'todos' if bot_token is None else bot_token[:10]})")
+        if broadcast:
+            cache_bus.publish('imap_config', bot_token)
+
+    def accounts(self, bot_token):
+        """Configuraciones distintas (una por cuenta de correo) del bot."""
+        return list(self._index(bot_token)['accounts'])
+
+    def resolve(self, email_addr, bot_token):
+        """
+        Devuelve la configuración IMAP para un correo o None si el bot no tiene
+        ninguna. Prioridad: prefijo antes del +, dominio, Gmail, primera fila.
+        """
+        index = self._index(bot_token)
+        if index['default'] is None:
+            return None
+
+        if '@' in email_addr:
+            local_part, domain = email_addr.split('@', 1)
+        else:
+            local_part, domain = email_addr, None
+
+        if '+' in local_part:
+            plus_prefix = local_part.split('+', 1)[0]
+            config = index['by_domain'].get(plus_prefix)
+            if config:
+                imap_logger.info(f"Usando configuración para prefijo: {plus_prefix}")
+                return config
+
+        config = index['by_domain'].get(domain)
+        if config:
+            imap_logger.info(f"Usando configuración para dominio específico: {domain}")
+            return config
+
+        if index['gmail']:
+            imap_logger.warning(f"No se encontró configuración específica para {email_addr}, usando Gmail como respaldo")
+            return index['gmail']
+
+        imap_logger.warning("No hay configuración de Gmail, usando la primera disponible")
+        return index['default']
+
+
+# Instancia global del resolvedor de configuraciones IMAP
+imap_config_resolver = IMAPConfigResolver()
+cache_bus.subscribe(
+    'imap_config',
+    lambda bot_token, user_id: imap_config_resolver.invalidate(bot_token, broadcast=False)
+)
@@ -0,0 +1,328 @@
+import asyncio
+import email
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from email.utils import getaddresses
+
+from handlers.async_imap import AsyncIMAPClient
+from handlers.email_search_handlers import email_service, FROM_ADDRESSES
+from utils.imap_parsing import parse_fetch_response, header_literal
+
+logger = logging.getLogger(__name__)
+
+_INTERNALDATE_RE = re.compile(rb'INTERNALDATE "([^"]+)"', re.IGNORECASE)
+_STATUS_UIDNEXT_RE = re.compile(rb'UIDNEXT\s+(\d+)', re.IGNORECASE)
+
+# Filas extraídas, idempotente por UID (execute_values pagina el VALUES)
+_INSERT_CODES = """
+INSERT INTO extracted_codes (
+    bot_token, account, uidvalidity, uid, recipient, regex_key,
+    result, is_link, subject, from_addr, msg_date, received_at
+) VALUES %s
+ON CONFLICT (bot_token, account, uidvalidity, uid, recipient, regex_key) DO NOTHING
+"""
+
+# Cabeceras, fecha de llegada y estructura en un solo FETCH por lote
+_INGEST_FETCH_ITEMS = (
+    '(INTERNALDATE RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM TO DATE SUBJECT)])'
+)
+
+
+def _or_criteria(criteria):
+    """Combina criterios IMAP con OR (el operador es binario, se anida)."""
+    if len(criteria) == 1:
+        return criteria[0]
+    return f'OR {criteria[0]} {_or_criteria(criteria[1:])}'
+
+
+def _parse_internaldate(meta):
+    """Convierte INTERNALDATE a datetime local sin zona (como el resto de tablas)."""
+    match = _INTERNALDATE_RE.search(meta or b'')
+    if match:
+        try:
+            parsed = datetime.strptime(match.group(1).decode().strip(), "%d-%b-%Y %H:%M:%S %z")
+            return parsed.astimezone().replace(tzinfo=None)
+        except ValueError:
+            pass
+    return datetime.now()
+
+
+class MailboxIngestionWorker:
+    """
+    Mantiene una sesión IMAP IDLE sobre el INBOX de una cuenta de un bot.
+
+    Cada vez que llega correo de los remitentes de FROM_ADDRESSES, descarga
+    solo los mensajes nuevos, aplica todas las regex de su familia y guarda
+    los valores en extracted_codes para que search_emails los lea sin IMAP.
+    """
+
+    def __init__(self, bot_token, config, idle_timeout, backfill_days):
+        self.bot_token = bot_token
+        self.config = config
+        self.config_key = email_service._config_key(config)
+        self.idle_timeout = idle_timeout
+        self.backfill_days = backfill_days
+        self.heartbeat = 0.0    # última vez que el worker confirmó estar al día
+        self.ready = False      # True tras completar el backfill inicial
+        self._uidvalidity = None
+        self._next_uid = None
+        self._task = None
+        self._senders = [
+            addr for addrs in FROM_ADDRESSES.values() for addr in addrs if addr
+        ]
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def is_fresh(self):
+        return self.ready and time.time() - self.heartbeat < self.idle_timeout + 60
+
+    def covers(self, uidvalidity, uidnext):
+        """
+        True si todos los mensajes con UID < uidnext ya están indexados, es
+        decir, si el worker llegó al UIDNEXT que tenía el buzón al pedirse la
+        búsqueda. Un mensaje que llegó pero aún no se ha ingerido da False.
+        """
+        return (
+            self.ready and self._next_uid is not None
+            and uidvalidity == self._uidvalidity and self._next_uid >= uidnext
+        )
+
+    async def run(self):
+        backoff = 1
+        while True:
+            client = AsyncIMAPClient(self.config['IMAP_SERVER'], int(self.config.get('IMAP_PORT') or 993))
+            try:
+                await client.connect()
+                await client.login(self.config['EMAIL_ACCOUNT'], self.config['PASSWORD'])
+                uidvalidity, _ = await client.examine('INBOX')
+                if uidvalidity != self._uidvalidity:
+                    # Primera vez o buzón recreado: volver a indexar los últimos días
+                    self._uidvalidity = uidvalidity
+                    self._next_uid = None
+                await self._ingest(client)
+                self.ready = True
+                self.heartbeat = time.time()
+                backoff = 1
+                logger.info(f"[INGESTA] Worker activo para {self.config_key} (bot {self.bot_token[:10]})")
+
+                while True:
+                    events = await client.idle(self.idle_timeout)
+                    self.heartbeat = time.time()
+                    if any(typ == 'EXISTS' for typ, _ in events) or not events:
+                        # También tras cada vencimiento, por si se perdió una notificación
+                        await self._ingest(client)
+                        self.heartbeat = time.time()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.heartbeat = 0.0
+                logger.warning(
+                    f"[INGESTA] Error en worker {self.config_key}, reintentando en {backoff}s: {e}"
+                )
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 300)
+            finally:
+                await client.close()
+
+    async def _ingest(self, client):
+        """
+        Indexa los mensajes posteriores al último UID procesado. El UIDNEXT se
+        lee antes del SEARCH: todo UID menor ya existía y queda cubierto, así
+        que _next_uid avanza también por el correo de otros remitentes.
+        """
+        _, status_data = await client.status('INBOX', '(UIDNEXT)')
+        raw = status_data[0] if status_data and isinstance(status_data[0], bytes) else b''
+        match = _STATUS_UIDNEXT_RE.search(raw)
+        uidnext = int(match.group(1)) if match else None
+
+        criteria = _or_criteria([f'(FROM "{sender}")' for sender in self._senders])
+        if self._next_uid:
+            criteria = f'UID {self._next_uid}:* {criteria}'
+        else:
+            date_since = (datetime.now() - timedelta(days=self.backfill_days)).strftime("%d-%b-%Y")
+            criteria = f'SINCE {date_since} {criteria}'
+
+        _, messages = await client.uid_search(criteria)
+        uids = [int(u) for u in (messages[0].split() if messages and messages[0] else [])]
+        if self._next_uid:
+            uids = [u for u in uids if u >= self._next_uid]
+        if not uids:
+            if uidnext:
+                self._next_uid = max(self._next_uid or 0, uidnext)
+            return
+
+        rows = []
+        for start in range(0, len(uids), 50):
+            batch = uids[start:start + 50]
+            _, msg_data = await client.uid_fetch(','.join(str(u) for u in batch), _INGEST_FETCH_ITEMS)
+            for entry in parse_fetch_response(msg_data):
+                if entry['uid'] is None:
+                    continue
+                rows.extend(await self._extract_rows(client, entry))
+
+        if rows:
+            from database.async_db import db
+            await db.execute_values(_INSERT_CODES, rows)
+            logger.info(f"[INGESTA] {len(rows)} valor(es) indexados de {len(uids)} mensaje(s) en {self.config_key}")
+        # Solo tras guardar las filas: si el INSERT falla, el reintento vuelve a leerlas
+        self._next_uid = max(self._next_uid or 0, max(uids) + 1, uidnext or 0)
+
+    def _family_for(self, from_value):
+        """Clave de FROM_ADDRESSES del remitente del mensaje, o None."""
+        from_value = from_value.lower()
+        for from_key, addresses in FROM_ADDRESSES.items():
+            if any(addr and addr.lower() in from_value for addr in addresses):
+                return from_key
+        return None
+
+    async def _extract_rows(self, client, entry):
+        """Aplica las regex de la familia del remitente y devuelve las filas a insertar."""
+        raw_headers = header_literal(entry)
+        if not raw_headers:
+            return []
+        email_headers = email.message_from_bytes(raw_headers)
+        from_key = self._family_for(email_headers.get('From', ''))
+        if from_key is None:
+            return []
+        family = email_service._pattern_family(from_key)
+        uid = int(entry['uid'])
+        uid_str = entry['uid'].decode()
+
+        found = {}
+        text_parts = email_service._ordered_text_parts(entry)
+        if text_parts:
+            subject = email_service.decode_email_subject(email_headers.get('Subject', ''))
+            for part in text_parts:
+                _, part_data = await client.uid_fetch(uid_str, f"(BODY.PEEK[{part['section']}])")
+                body = email_service._decode_part(part_data, part, "ingesta")
+                if body is not None:
+                    email_service._scan_body(body, family, found, email_headers, subject)
+        else:
+            _, body_data = await client.uid_fetch(uid_str, '(RFC822)')
+            found, _ = email_service._scan_rfc822(body_data, family, email_headers)
+        if not found:
+            return []
+
+        received_at = _parse_internaldate(entry['meta'])
+        recipients = {
+            addr.lower() for _, addr in getaddresses([email_headers.get('To', '')]) if '@' in addr
+        }
+        return [
+            (
+                self.bot_token, self.config_key, self._uidvalidity, uid, recipient, regex_key,
+                result['result'], result['is_link'], result['subject'], result['from'],
+                result['date'], received_at
+            )
+            for recipient in recipients
+            for regex_key, result in found.items()
+        ]
+
+
+class MailboxIngestionManager:
+    """Arranca un worker de ingesta por cuenta IMAP de cada bot y consulta el índice local."""
+
+    def __init__(self):
+        self.enabled = os.environ.get("MAILBOX_INGESTION", "0") == "1"
+        self._idle_timeout = int(os.environ.get("MAILBOX_IDLE_TIMEOUT", "1500"))  # < 29 min (RFC 2177)
+        self._retention_days = int(os.environ.get("MAILBOX_INGESTION_RETENTION_DAYS", "3"))
+        self._workers = {}  # (bot_token, config_key) -> MailboxIngestionWorker
+        self._prune_task = None
+
+    async def start(self, bot_token):
+        """Carga las cuentas IMAP del bot y arranca un worker por cada una."""
+        if not self.enabled:
+            return
+        from database.async_db import db
+        from handlers.imap_manager import imap_config_resolver
+
+        configs = await db.run(imap_config_resolver.accounts, bot_token)
+        for config in configs:
+            key = (bot_token, email_service._config_key(config))
+            if key in self._workers:
+                continue
+            worker = MailboxIngestionWorker(bot_token, config, self._idle_timeout, self._retention_days)
+            self._workers[key] = worker
+            worker.start()
+        if self._prune_task is None:
+            self._prune_task = asyncio.create_task(self._prune_loop())
+        logger.info(f"[INGESTA] {len(configs)} cuenta(s) IMAP en ingesta para bot {bot_token[:10]}")
+
+    async def stop(self, bot_token=None):
+        """Detiene los workers de un bot (o todos si bot_token es None)."""
+        for key, worker in list(self._workers.items()):
+            if bot_token is None or key[0] == bot_token:
+                self._workers.pop(key, None)
+                await worker.stop()
+        if not self._workers and self._prune_task:
+            self._prune_task.cancel()
+            self._prune_task = None
+
+    async def _prune_loop(self):
+        """Borra periódicamente los valores más antiguos que la retención configurada."""
+        from database.async_db import db
+
+        while True:
+            try:
+                await db.execute(
+                    "DELETE FROM extracted_codes WHERE received_at < %s",
+                    (datetime.now() - timedelta(days=self._retention_days),)
+                )
+            except Exception as e:
+                logger.warning(f"[INGESTA] Error al purgar extracted_codes: {e}")
+            await asyncio.sleep(3600)
+
+    def is_fresh(self, bot_token, config_key):
+        worker = self._workers.get((bot_token, config_key))
+        return worker is not None and worker.is_fresh()
+
+    def lookup(self, bot_token, config_key, recipient, regex_key, days_back, watermark):
+        """
+        Consulta el índice local. Devuelve (acierto, resultado); solo hay acierto
+        si el worker de la cuenta ya ingirió todo lo anterior a watermark
+        ((UIDVALIDITY, UIDNEXT) del INBOX leídos al iniciar la búsqueda) y existe
+        un valor en la ventana pedida. En otro caso se debe buscar por IMAP.
+        """
+        if not self.enabled or watermark is None:
+            return False, None
+        worker = self._workers.get((bot_token, config_key))
+        if worker is None or not worker.covers(*watermark):
+            return False, None
+        from database.connection import execute_query
+
+        date_since = datetime.combine(
+            (datetime.now() - timedelta(days=min(days_back, 3))).date(), datetime.min.time()
+        )
+        rows = execute_query("""
+        SELECT result, is_link, subject, msg_date, from_addr FROM extracted_codes
+        WHERE bot_token = %s AND recipient = %s AND regex_key = %s
+          AND account = %s AND received_at >= %s
+        ORDER BY received_at DESC, uid DESC
+        LIMIT 1
+        """, (bot_token, recipient.lower(), regex_key, config_key, date_since))
+        if not rows:
+            return False, None
+        result, is_link, subject, msg_date, from_addr = rows[0]
+        return True, {
+            'result': result,
+            'is_link': is_link,
+            'subject': subject,
+            'date': msg_date,
+            'from': from_addr
+        }
+
+
+# Instancia global del gestor de ingesta
+mailbox_ingestion = MailboxIngestionManager()
@@ -4,6 +4,7 @@ from telegram.ext import ContextTypes
 from datetime import datetime
 from handlers.admin_handlers import admin_required
 from utils.permission_manager import PermissionManager
+from database.async_db import db
 
 @admin_required
 async def check_user_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -17,10 +18,10 @@ async def check_user_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
         permission_manager = PermissionManager()
         
         # Usar la función check_and_log_time_issues para diagnóstico
-        is_valid = permission_manager.check_and_log_time_issues(user_id)
+        is_valid = await db.run(permission_manager.check_and_log_time_issues, user_id)
         
         # Obtener información detallada
-        info = permission_manager.get_user_expiration_info(user_id)
+        info = await db.run(permission_manager.get_user_expiration_info, user_id)
         
         if info:
             message = (
@@ -50,7 +51,6 @@ async def check_time_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     try:
         permission_manager = PermissionManager()
-        from database.connection import execute_query
         
         # Consultar todos los usuarios directamente de la base de datos
         # Obtenemos usuarios que ya expiraron O que expiran en los próximos 2 días
@@ -63,7 +63,7 @@ async def check_time_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         
         bot_token = context.bot.token
-        raw_users = execute_query(query, (bot_token,))
+        raw_users = await db.fetch(query, (bot_token,))
         
         users_with_issues = []
         users_ok_count = 0
@@ -73,7 +73,7 @@ async def check_time_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
         SELECT COUNT(*) FROM users 
         WHERE bot_token = %s AND access_until > CURRENT_TIMESTAMP + INTERVAL '2 days'
         """
-        ok_result = execute_query(count_query, (bot_token,))
+        ok_result = await db.fetch(count_query, (bot_token,))
         if ok_result:
             users_ok_count = ok_result[0][0]
         
@@ -6,8 +6,9 @@ from handlers.admin_handlers import AdminManager
 from handlers.extended_handlers import UserManager
 from utils.permission_manager import PermissionManager
 from utils.logger_utility import bot_logger
+from handlers.imap_manager import imap_config_resolver
 from config import ADMIN_ID
-from database.connection import execute_query
+from database.async_db import db
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -21,7 +22,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         # Verificar si es un usuario existente
-        user_result = execute_query("""
+        user_result = await db.fetch("""
         SELECT u.access_until, r.name as role_name
         FROM users u
         JOIN roles r ON u.role_id = r.id
@@ -48,7 +49,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 
                 # Enviar notificación a otros admins activos
-                admin_results = execute_query("""
+                admin_results = await db.fetch("""
                 SELECT u.id FROM users u
                 JOIN roles r ON u.role_id = r.id
                 WHERE r.name = 'admin' AND u.access_until > CURRENT_TIMESTAMP AND u.bot_token = %s
@@ -111,7 +112,7 @@ async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bot_token = context.bot.token
     
     # Obtener el rol del usuario
-    role_result = execute_query("""
+    role_result = await db.fetch("""
     SELECT r.name FROM users u
     JOIN roles r ON u.role_id = r.id
     WHERE u.id = %s AND u.bot_token = %s
@@ -138,7 +139,7 @@ async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             hours = context.user_data['hours_remaining']
         else:
             # Si no están en el contexto, consultarlos de la base de datos
-            user_info = execute_query("""
+            user_info = await db.fetch("""
             SELECT access_until FROM users
             WHERE id = %s AND bot_token = %s
             """, (user_id, bot_token))
@@ -157,7 +158,7 @@ async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Determinar si el usuario fue creado por un revendedor
     is_reseller_user = False
     try:
-        creator_result = execute_query("""
+        creator_result = await db.fetch("""
         SELECT u2.id FROM users u1
         JOIN users u2 ON u1.created_by = u2.id
         JOIN roles r ON u2.role_id = r.id
@@ -219,7 +220,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
         
         is_reseller_user = False
         try:
-            creator_result = execute_query("""
+            creator_result = await db.fetch("""
             SELECT u2.id FROM users u1
             JOIN users u2 ON u1.created_by = u2.id
             JOIN roles r ON u2.role_id = r.id
@@ -247,7 +248,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
         
         is_reseller_user = False
         try:
-            creator_result = execute_query("""
+            creator_result = await db.fetch("""
             SELECT u2.id FROM users u1
             JOIN users u2 ON u1.created_by = u2.id
             JOIN roles r ON u2.role_id = r.id
@@ -259,7 +260,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
             pass
         
         # Verificar si el usuario tiene permiso (otorgado por comando /code)
-        code_access_result = execute_query("""
+        code_access_result = await db.fetch("""
         SELECT code_access FROM users
         WHERE id = %s AND bot_token = %s
         """, (user_id, bot_token))
@@ -334,7 +335,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
             if user_id == ADMIN_ID:
                 is_admin = True
             else:
-                admin_result = execute_query("""
+                admin_result = await db.fetch("""
                 SELECT r.name FROM users u
                 JOIN roles r ON u.role_id = r.id
                 WHERE u.id = %s AND u.bot_token = %s
@@ -376,7 +377,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
         
         try:
             # Obtener información completa del usuario
-            user_result = execute_query("""
+            user_result = await db.fetch("""
             SELECT u.access_until, u.created_at, r.name as role_name, u.free_access
             FROM users u
             JOIN roles r ON u.role_id = r.id
@@ -396,7 +397,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
             expiration_date, creation_date, role_name, free_access = user_result[0]
             
             # Obtener correos asignados
-            email_result = execute_query("""
+            email_result = await db.fetch("""
             SELECT email FROM user_emails
             WHERE user_id = %s AND bot_token = %s
             ORDER BY email
@@ -418,7 +419,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
             # Si es revendedor, añadir información específica
             if role_name == 'reseller':
                 # Obtener usuarios creados por este revendedor
-                users_created = execute_query("""
+                users_created = await db.fetch("""
                 SELECT COUNT(*) FROM users
                 WHERE created_by = %s AND bot_token = %s
                 """, (user_id, bot_token))
@@ -485,7 +486,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
         user_id = update.effective_user.id
         bot_token = context.bot.token
         
-        admin_result = execute_query("""
+        admin_result = await db.fetch("""
         SELECT r.name FROM users u
         JOIN roles r ON u.role_id = r.id
         WHERE u.id = %s AND u.bot_token = %s
@@ -498,7 +499,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
             return
         
         # Obtener configuraciones IMAP actuales
-        imap_configs = execute_query("""
+        imap_configs = await db.fetch("""
         SELECT id, domain, email, imap_server FROM imap_config
         WHERE bot_token = %s
         ORDER BY domain
@@ -536,7 +537,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
         bot_token = context.bot.token
         
         # Verificar permisos de administrador
-        admin_result = execute_query("""
+        admin_result = await db.fetch("""
         SELECT r.name FROM users u
         JOIN roles r ON u.role_id = r.id
         WHERE u.id = %s AND u.bot_token = %s
@@ -549,7 +550,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
             return
         
         # Obtener detalles de la configuración IMAP
-        config_details = execute_query("""
+        config_details = await db.fetch("""
         SELECT domain, email, imap_server FROM imap_config
         WHERE id = %s AND bot_token = %s
         """, (config_id, bot_token))
@@ -586,7 +587,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
         bot_token = context.bot.token
         
         # Verificar permisos de administrador
-        admin_result = execute_query("""
+        admin_result = await db.fetch("""
         SELECT r.name FROM users u
         JOIN roles r ON u.role_id = r.id
         WHERE u.id = %s AND u.bot_token = %s
@@ -599,7 +600,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
             return
         
         # Obtener información de la configuración antes de eliminarla
-        config_info = execute_query("""
+        config_info = await db.fetch("""
         SELECT domain FROM imap_config
         WHERE id = %s AND bot_token = %s
         """, (config_id, bot_token))
@@ -611,10 +612,11 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
         domain = config_info[0][0]
         
         # Eliminar la configuración
-        execute_query("""
+        await db.execute("""
         DELETE FROM imap_config
         WHERE id = %s AND bot_token = %s
         """, (config_id, bot_token))
+        imap_config_resolver.invalidate(bot_token)
         
         # Mostrar mensaje de confirmación
         message = f"✅ Configuración IMAP para dominio {domain} eliminada correctamente"
@@ -632,7 +634,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
         bot_token = context.bot.token
         
         if user_id != ADMIN_ID:
-            admin_result = execute_query("""
+            admin_result = await db.fetch("""
             SELECT r.name FROM users u
             JOIN roles r ON u.role_id = r.id
             WHERE u.id = %s AND u.bot_token = %s
@@ -670,7 +672,7 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
         bot_token = context.bot.token
         
         if user_id != ADMIN_ID:
-            admin_result = execute_query("""
+            admin_result = await db.fetch("""
             SELECT r.name FROM users u
             JOIN roles r ON u.role_id = r.id
             WHERE u.id = %s AND u.bot_token = %s
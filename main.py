@@ -1,11 +1,12 @@
+import functools
+import gc
 import logging
 import sys
-import subprocess
-import time
 import os
 from config import BOT_TOKENS
-from database.connection import init_db
+from database.connection import init_db, close_all_connections
 from database.models import ensure_roles_exist
+from utils.supervisor import Supervisor
 
 # Configurar logging
 logging.basicConfig(
@@ -15,6 +16,51 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# BOT_RUNTIME=multi agrupa varios tokens por proceso (run_multi_bot.py);
+# BOT_TOKENS_PER_PROCESS fija el tamaño de cada grupo (0 = todos en uno)
+BOT_RUNTIME = os.environ.get("BOT_RUNTIME", "single")
+BOT_TOKENS_PER_PROCESS = int(os.environ.get("BOT_TOKENS_PER_PROCESS", "0"))
+# BOT_SPAWN_MODE=fork importa telegram, psycopg2, handlers y botNew una sola
+# vez en el supervisor y crea cada hijo con fork (páginas compartidas en
+# copy-on-write, sin reimportar ni revisar el esquema). "subprocess" lanza
+# un intérprete nuevo por hijo y es el modo disponible en Windows.
+BOT_SPAWN_MODE = os.environ.get("BOT_SPAWN_MODE", "subprocess")
+
+def _token_groups(tokens):
+    size = BOT_TOKENS_PER_PROCESS or len(tokens)
+    return [tokens[i:i + size] for i in range(0, len(tokens), size)]
+
+def build_commands(tokens):
+    """Devuelve (etiqueta, comando) de cada proceso hijo según BOT_RUNTIME"""
+    if BOT_RUNTIME == "multi":
+        groups = _token_groups(tokens)
+        if len(groups) == 1:
+            return [("multi_0", [sys.executable, "run_multi_bot.py", *groups[0]])]
+        # Varios grupos: cada uno escucha webhooks en WEBHOOK_PORT + N (prefijo /gN)
+        return [
+            (f"multi_{n}", [sys.executable, "run_multi_bot.py", f"--group={n}", *group])
+            for n, group in enumerate(groups)
+        ]
+    return [(token[:10], [sys.executable, "run_single_bot.py", token]) for token in tokens]
+
+def build_fork_targets(tokens):
+    """
+    Equivalente a build_commands para BOT_SPAWN_MODE=fork: (etiqueta, función)
+    que el hijo ejecuta tras el fork. Importa aquí los módulos pesados para
+    que todos los hijos los hereden ya cargados.
+    """
+    import botNew  # noqa: F401  (telegram, httpx, handlers)
+    import run_single_bot
+    import run_multi_bot
+    
+    if BOT_RUNTIME == "multi":
+        groups = _token_groups(tokens)
+        return [
+            (f"multi_{n}", functools.partial(run_multi_bot.run_forked, group, n if len(groups) > 1 else None))
+            for n, group in enumerate(groups)
+        ]
+    return [(token[:10], functools.partial(run_single_bot.run_forked, token)) for token in tokens]
+
 def main():
     """Función principal para iniciar todos los bots como procesos independientes"""
     try:
@@ -32,82 +78,44 @@ def main():
             logger.error("No se encontraron tokens válidos. Revisa la configuración BOT_TOKENS.")
             return
         
-        logger.info(f"Iniciando {len(valid_tokens)} bots como procesos independientes...")
+        # El supervisor no usa la BD: cerrar el pool para no mantener conexiones
+        # ociosas ni heredarlas en los hijos creados con fork
+        close_all_connections(reopen=False)
+        
+        spawn_mode = BOT_SPAWN_MODE
+        if spawn_mode == "fork" and not hasattr(os, "fork"):
+            logger.warning("BOT_SPAWN_MODE=fork no está disponible en esta plataforma. Se usará subprocess.")
+            spawn_mode = "subprocess"
+        
+        if spawn_mode == "fork":
+            commands = build_fork_targets(valid_tokens)
+            # Sacar los objetos ya cargados del GC para que sus recorridos no
+            # escriban en las páginas compartidas con los hijos
+            gc.collect()
+            gc.freeze()
+        else:
+            commands = build_commands(valid_tokens)
+        logger.info(
+            f"Iniciando {len(valid_tokens)} bots en {len(commands)} procesos "
+            f"(runtime {BOT_RUNTIME}, spawn {spawn_mode})..."
+        )
         
         # Crear directorio para logs si no existe
         logs_dir = "logs"
         if not os.path.exists(logs_dir):
             os.makedirs(logs_dir)
         
-        # Iniciar un proceso independiente para cada bot
-        processes = []
-        for token in valid_tokens:
-            try:
-                # Crear un archivo de log para cada bot
-                log_filename = os.path.join(logs_dir, f"bot_{token[:10]}.log")
-                
-                # Iniciar el proceso con redirección de salida a un archivo de log
-                with open(log_filename, 'a') as log_file:
-                    process = subprocess.Popen(
-                        [sys.executable, "run_single_bot.py", token],
-                        stdout=log_file,
-                        stderr=log_file,
-                        stdin=subprocess.DEVNULL
-                    )
-                
-                processes.append((process, token, log_filename))
-                logger.info(f"Proceso iniciado para bot con token: {token[:10]}...")
-                
-                # Pequeña pausa para evitar sobrecarga
-                time.sleep(1)
-            except Exception as e:
-                logger.error(f"Error al iniciar bot con token {token[:10]}: {e}")
-        
-        if not processes:
+        # Iniciar todos los procesos a la vez; el supervisor los reinicia con
+        # backoff al terminar y publica su estado en logs/supervisor_status.json
+        supervisor = Supervisor(commands, logs_dir=logs_dir)
+        started = supervisor.start()
+        if not started:
             logger.error("No se pudo iniciar ningún proceso de bot. Verificar tokens y conexión.")
+            supervisor.stop()
             return
             
-        logger.info(f"Se iniciaron {len(processes)} procesos de bot correctamente")
-        
-        # Monitorear procesos y reiniciar los que fallen
-        try:
-            while True:
-                for i, (process, token, log_filename) in enumerate(processes[:]):
-                    # Verificar si el proceso ha terminado
-                    if process.poll() is not None:
-                        exit_code = process.returncode
-                        logger.warning(f"El proceso del bot con token {token[:10]} ha terminado con código {exit_code}. Reiniciando...")
-                        
-                        # Reiniciar proceso
-                        with open(log_filename, 'a') as log_file:
-                            log_file.write(f"\n\n--- REINICIO DEL BOT {token[:10]} - {time.strftime('%Y-%m-%d %H:%M:%S')} ---\n\n")
-                            new_process = subprocess.Popen(
-                                [sys.executable, "run_single_bot.py", token],
-                                stdout=log_file,
-                                stderr=log_file,
-                                stdin=subprocess.DEVNULL
-                            )
-                        
-                        # Reemplazar proceso en la lista
-                        processes[i] = (new_process, token, log_filename)
-                        logger.info(f"Proceso reiniciado para bot con token: {token[:10]}...")
-                
-                time.sleep(10)  # Revisar cada 10 segundos
-                
-        except (KeyboardInterrupt, SystemExit):
-            logger.info("Terminando todos los procesos de bot...")
-            for process, token, _ in processes:
-                if process.poll() is None:  # Si el proceso sigue en ejecución
-                    logger.info(f"Terminando proceso del bot con token: {token[:10]}...")
-                    process.terminate()
-                    # Esperar a que termine
-                    try:
-                        process.wait(timeout=5)
-                    except subprocess.TimeoutExpired:
-                        logger.warning(f"El proceso del bot con token {token[:10]} no respondió. Forzando terminación...")
-                        process.kill()
-            
-            logger.info("Todos los procesos de bot han sido terminados")
+        logger.info(f"Se iniciaron {started} procesos de bot correctamente")
+        supervisor.run()
     
     except Exception as e:
         logger.error(f"Error en la ejecución principal: {e}", exc_info=True)
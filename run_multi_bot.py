@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+from config import BOT_TOKENS
+from database.connection import init_db, close_all_connections
+from database.async_db import db
+from database.cache_bus import cache_bus
+from run_single_bot import check_lock_file, remove_lock_file, start_bot, stop_bot
+from utils.webhook_server import WebhookServer
+
+# Configurar logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+# Reducir logging de las bibliotecas externas
+logging.getLogger('httpx').setLevel(logging.WARNING)
+logging.getLogger('telegram').setLevel(logging.WARNING)
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Runtime multi-bot: varias aplicaciones EmailBot en un solo event loop.
+# Comparten el pool de Postgres, el executor de BD, los pools IMAP (que ya
+# se indexan por cuenta, no por bot), el bus de invalidación y, con
+# WEBHOOK_URL, un único servidor de webhooks; cada handler sigue resolviendo
+# su bot con context.bot.token. Con muchos bots conviene subir DB_POOL_MAX,
+# que pasa a ser el total del proceso.
+# ---------------------------------------------------------------------------
+
+# Bots que se inician a la vez (cada inicio hace llamadas a la Bot API y a la BD)
+START_CONCURRENCY = int(os.environ.get("BOT_START_CONCURRENCY", "8"))
+
+
+async def run(tokens, init_schema=True, spawn_mode="subprocess", group=None):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: se recurre a KeyboardInterrupt
+            pass
+
+    running = {}  # token -> (bot, app)
+    locked = []
+    webhook = None
+    try:
+        if not init_db(init_schema=init_schema):
+            logger.error("Error al inicializar la base de datos. Revisa la configuración y los logs.")
+            return 1
+        cache_bus.start()
+        
+        # Un solo servidor de webhooks para todos los bots del proceso (con
+        # varios grupos, uno por grupo en su propio puerto); si no está
+        # configurado o no puede escuchar, los bots usan polling
+        server = WebhookServer.for_group(group)
+        if server.enabled:
+            try:
+                await server.start()
+                webhook = server
+            except OSError as e:
+                logger.warning(f"No se pudo iniciar el servidor de webhooks, se usará polling: {e}")
+
+        for token in tokens:
+            if check_lock_file(token, spawn_mode):
+                locked.append(token)
+            else:
+                logger.error(f"Ya existe una instancia del bot para el token {token[:10]}. Se omite.")
+
+        semaphore = asyncio.Semaphore(START_CONCURRENCY)
+
+        async def _start(token):
+            async with semaphore:
+                try:
+                    running[token] = await start_bot(token, shared_runtime=True, webhook=webhook)
+                except Exception as e:
+                    logger.error(f"Error iniciando bot con token {token[:10]}: {e}", exc_info=True)
+
+        await asyncio.gather(*(_start(token) for token in locked))
+
+        if not running:
+            logger.error("No se pudo iniciar ningún bot en este proceso")
+            return 1
+        logger.info(f"{len(running)}/{len(tokens)} bots en ejecución en el proceso {os.getpid()}")
+
+        await stop_event.wait()
+        logger.info("Señal de parada recibida. Deteniendo bots...")
+        return 0
+
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logger.info("Interrupción recibida. Deteniendo bots...")
+        return 0
+    finally:
+        await asyncio.gather(*(stop_bot(bot, app) for bot, app in running.values()))
+        if webhook is not None:
+            await webhook.stop()
+        for token in locked:
+            remove_lock_file(token)
+
+        # Recursos compartidos: se cierran una sola vez, tras parar todos los bots
+        try:
+            from handlers.async_imap import async_imap_pool
+            await async_imap_pool.close_all()
+        except Exception as e:
+            logger.error(f"Error cerrando conexiones IMAP asíncronas: {e}")
+        cache_bus.stop()
+        db.shutdown()
+        try:
+            close_all_connections(reopen=False)
+        except Exception as e:
+            logger.error(f"Error al cerrar conexiones de base de datos: {e}")
+        logger.info("Runtime multi-bot detenido")
+
+
+def run_forked(tokens, group=None):
+    """Entrada de un hijo creado con fork desde el supervisor (BOT_SPAWN_MODE=fork)"""
+    return asyncio.run(run(tokens, init_schema=False, spawn_mode="fork", group=group))
+
+
+def main():
+    # Sin argumentos se atienden todos los BOT_TOKENS; main.py puede repartirlos
+    # en grupos y pasa --group=N para que cada uno use su puerto de webhooks
+    args = sys.argv[1:]
+    group = None
+    if args and args[0].startswith("--group="):
+        group = int(args.pop(0).split("=", 1)[1])
+    tokens = args or [token.strip() for token in BOT_TOKENS if token.strip()]
+    if not tokens:
+        print("Uso: python run_multi_bot.py [--group=N] [token1 token2 ...]")
+        sys.exit(1)
+
+    os.makedirs("logs", exist_ok=True)
+    os.makedirs("locks", exist_ok=True)
+    sys.exit(asyncio.run(run(tokens, group=group)))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,8 @@ from datetime import datetime
 import psutil
 
 from database.connection import init_db, close_all_connections
+from database.cache_bus import cache_bus
+from database.async_db import db
 from database.models import setup_super_admin, setup_default_services
 
 # Configurar logging
@@ -24,9 +26,56 @@ logging.getLogger('telegram').setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
+def _is_bot_process(cmdline, token, spawn_mode="subprocess"):
+    """Indica si la línea de comandos es de un runner que atiende este token"""
+    if spawn_mode == "fork":
+        # Hijo creado con fork por el supervisor: conserva la línea de comandos de main.py
+        return len(cmdline) >= 2 and 'main.py' in cmdline[1]
+    if len(cmdline) >= 2 and 'run_multi_bot.py' in cmdline[1]:
+        # Sin argumentos run_multi_bot atiende todos los BOT_TOKENS
+        return len(cmdline) == 2 or any(token in arg for arg in cmdline[2:])
+    return len(cmdline) >= 3 and 'run_single_bot.py' in cmdline[1] and token in cmdline[2]
+
+def remove_lock_file(token):
+    """Elimina el archivo de bloqueo del token"""
+    lock_file = f"locks/bot_{token[:10]}.lock"
+    if os.path.exists(lock_file):
+        try:
+            os.remove(lock_file)
+            logger.info(f"Lock file eliminado: {lock_file}")
+        except Exception as e:
+            logger.error(f"Error al eliminar lock file: {e}")
+
+def _read_lock_file(lock_file):
+    """
+    Devuelve (pid, prefijo del token, modo de arranque, create_time) del lock.
+    Los locks antiguos solo contienen el PID: el resto vale None.
+    """
+    with open(lock_file, 'r') as f:
+        fields = f.read().split()
+    pid = int(fields[0])
+    if len(fields) < 4:
+        return pid, None, None, None
+    return pid, fields[1], fields[2], float(fields[3])
+
+def _lock_owner_alive(process, token, prefix, spawn_mode, created):
+    """Indica si el proceso del lock es la instancia que lo escribió para este token"""
+    if created is None:
+        return _is_bot_process(process.cmdline(), token)
+    # create_time descarta un PID reutilizado por otro proceso
+    return (
+        prefix == token[:10]
+        and abs(process.create_time() - created) < 0.01
+        and _is_bot_process(process.cmdline(), token, spawn_mode)
+    )
+
 # Sistema de bloqueo para asegurar una sola instancia por token
-def check_lock_file(token):
-    """Verifica si ya hay una instancia en ejecución para este token"""
+def check_lock_file(token, spawn_mode="subprocess"):
+    """
+    Verifica si ya hay una instancia en ejecución para este token y, si no,
+    crea el lock con PID, prefijo del token, modo de arranque ("subprocess"
+    o "fork") e instante de creación del proceso.
+    """
     # Crear directorio si no existe
     os.makedirs("locks", exist_ok=True)
     
@@ -36,16 +85,14 @@ def check_lock_file(token):
     if os.path.exists(lock_file):
         # Leer el PID del archivo
         try:
-            with open(lock_file, 'r') as f:
-                pid = int(f.read().strip())
+            pid, prefix, lock_mode, created = _read_lock_file(lock_file)
             
             # Verificar si el proceso sigue en ejecución
-            if psutil.pid_exists(pid):
+            if psutil.pid_exists(pid) and pid != os.getpid():
                 # Verificar si es realmente un proceso del bot
                 try:
                     process = psutil.Process(pid)
-                    cmdline = process.cmdline()
-                    if len(cmdline) >= 3 and 'run_single_bot.py' in cmdline[1] and token in cmdline[2]:
+                    if _lock_owner_alive(process, token, prefix, lock_mode, created):
                         logger.error(f"Ya hay una instancia en ejecución para el token {token[:10]} (PID: {pid})")
                         return False
                     else:
@@ -67,8 +114,9 @@ def check_lock_file(token):
     
     # Crear archivo de bloqueo con el PID actual
     try:
+        created = psutil.Process().create_time()
         with open(lock_file, 'w') as f:
-            f.write(str(os.getpid()))
+            f.write(f"{os.getpid()}\n{token[:10]}\n{spawn_mode}\n{created}\n")
         logger.info(f"Lock file creado: {lock_file}")
     except Exception as e:
         logger.error(f"Error al crear lock file: {e}")
@@ -76,57 +124,100 @@ def check_lock_file(token):
     
     return True
 
-async def main():
-    """Función principal para iniciar un solo bot"""
-    global token
+async def start_bot(token, shared_runtime=False, webhook=None):
+    """
+    Prepara los datos del token, crea su EmailBot e inicia la recepción de
+    updates: por el servidor de webhooks si se pasa y Telegram lo acepta,
+    y por polling en caso contrario. Devuelve (bot, app); detener con stop_bot.
+    """
+    # Configurar super admin y servicios predeterminados (en el executor de BD:
+    # en el runtime multi-bot el loop es compartido con los bots ya activos)
+    await db.run(setup_super_admin, token)
+    await db.run(setup_default_services, token)
     
-    # Verificar argumentos
-    if len(sys.argv) != 2:
-        print("Uso: python run_single_bot.py <token>")
-        sys.exit(1)
-        
-    token = sys.argv[1]
+    # Importar solo después de la inicialización de la BD para evitar dependencias circulares
+    from botNew import EmailBot
+    
+    # Crear y configurar el bot
+    bot = EmailBot()
+    bot.token = token  # Asignar el token al bot
+    bot.shared_runtime = shared_runtime
+    
+    # Configurar el bot y obtener la aplicación
+    app = bot.setup()
     
+    # Mensaje de inicio
+    logger.info(f"Bot con token {token[:10]} iniciando...")
+    
+    # Iniciar el polling
+    try:
+        await app.initialize()
+        await app.start()
+        if webhook is not None and await webhook.register(app):
+            bot.webhook = webhook
+        else:
+            await app.updater.start_polling()
+        # initialize()/start() manuales no ejecutan el hook post_init de la aplicación
+        await bot.post_init(app)
+    except Exception:
+        await stop_bot(bot, app)
+        raise
+    
+    ingress = "webhook" if bot.webhook else "polling"
+    logger.info(f"Bot con token {token[:10]} iniciado correctamente ({ingress})")
+    return bot, app
+
+async def stop_bot(bot, app):
+    """Detiene el polling y la aplicación de un bot iniciado con start_bot"""
+    try:
+        if bot.webhook:
+            bot.webhook.unregister(app)
+        if app.updater and app.updater.running:
+            await app.updater.stop()
+        if app.running:
+            await app.stop()
+        await bot.post_shutdown(app)
+        await app.shutdown()
+    except Exception as e:
+        logger.error(f"Error al detener el bot {bot.token[:10]}: {e}")
+
+async def run(token, init_schema=True, spawn_mode="subprocess"):
+    """
+    Ciclo de vida completo de un bot: lock, pool de BD, start_bot y limpieza
+    final. Devuelve el código de salida del proceso.
+    """
     # Verificar si ya hay una instancia en ejecución para este token
-    if not check_lock_file(token):
+    if not check_lock_file(token, spawn_mode):
         logger.error(f"Ya existe una instancia del bot para el token {token[:10]}. Saliendo...")
-        sys.exit(1)
+        return 1
+    
+    # SIGTERM (parada o reinicio del supervisor) y SIGINT terminan con la
+    # limpieza completa: lock, stop_bot y cierre de conexiones
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: se recurre a KeyboardInterrupt
+            pass
     
     try:
         # Inicializar base de datos
-        if not init_db():
+        if not init_db(init_schema=init_schema):
             logger.error("Error al inicializar la base de datos. Revisa la configuración y los logs.")
-            return
+            return 0
             
         logger.info(f"Base de datos inicializada para bot con token: {token[:10]}...")
         
-        # Configurar super admin y servicios predeterminados
-        setup_super_admin(token)
-        setup_default_services(token)
-        
-        # Importar solo después de la inicialización de la BD para evitar dependencias circulares
-        from botNew import EmailBot
+        # Escuchar invalidaciones de caché publicadas por otros procesos de bot
+        cache_bus.start()
         
-        # Crear y configurar el bot
-        bot = EmailBot()
-        bot.token = token  # Asignar el token al bot
+        bot, app = await start_bot(token)
         
-        # Configurar el bot y obtener la aplicación
-        app = bot.setup()
-        
-        # Mensaje de inicio
-        logger.info(f"Bot con token {token[:10]} iniciando...")
-        
-        # Iniciar el polling
-        await app.initialize()
-        await app.start()
-        await app.updater.start_polling()
-        
-        logger.info(f"Bot con token {token[:10]} iniciado correctamente")
-        
-        # Mantener el bot en ejecución
-        while True:
-            await asyncio.sleep(10)
+        # Mantener el bot en ejecución hasta recibir una señal de parada
+        await stop_event.wait()
+        logger.info(f"Señal de parada recibida. Deteniendo bot con token: {token[:10]}...")
             
     except (KeyboardInterrupt, SystemExit):
         logger.info(f"Señal de interrupción recibida. Deteniendo bot con token: {token[:10]}...")
@@ -137,33 +228,41 @@ async def main():
         logger.info("Realizando limpieza final...")
         
         # Eliminar el archivo de bloqueo
-        lock_file = f"locks/bot_{token[:10]}.lock"
-        if os.path.exists(lock_file):
-            try:
-                os.remove(lock_file)
-                logger.info(f"Lock file eliminado: {lock_file}")
-            except Exception as e:
-                logger.error(f"Error al eliminar lock file: {e}")
+        remove_lock_file(token)
         
         # Detener el bot si está activo
         if 'app' in locals():
-            try:
-                await app.updater.stop()
-                await app.stop()
-                await app.shutdown()
-            except Exception as e:
-                logger.error(f"Error al detener el bot: {e}")
+            await stop_bot(bot, app)
+        
+        cache_bus.stop()
         
         # Limpiar conexiones a la base de datos
         try:
-            close_all_connections()
+            close_all_connections(reopen=False)
         except Exception as e:
             logger.error(f"Error al cerrar conexiones de base de datos: {e}")
         
         logger.info(f"Bot con token {token[:10]} detenido correctamente")
-        
-        # Asegurar que el proceso termine correctamente
-        sys.exit(0)
+    
+    return 0
+
+def run_forked(token):
+    """
+    Entrada de un hijo creado con fork desde el supervisor (BOT_SPAWN_MODE=fork).
+    Los módulos ya vienen importados y el supervisor ya revisó el esquema,
+    así que solo se crea el pool propio del proceso.
+    """
+    return asyncio.run(run(token, init_schema=False, spawn_mode="fork"))
+
+async def main():
+    """Función principal para iniciar un solo bot"""
+    # Verificar argumentos
+    if len(sys.argv) != 2:
+        print("Uso: python run_single_bot.py <token>")
+        sys.exit(1)
+    
+    # Asegurar que el proceso termine correctamente
+    sys.exit(await run(sys.argv[1]))
 
 if __name__ == "__main__":
     # Crear directorios necesarios
@@ -171,4 +270,4 @@ if __name__ == "__main__":
     os.makedirs("locks", exist_ok=True)
     
     # Ejecutar el bot
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
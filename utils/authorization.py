@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+import time
+from config import ADMIN_ID
+from database.connection import execute_query
+from database.async_db import db
+from database.cache_bus import cache_bus
+
+logger = logging.getLogger(__name__)
+
+ADMIN_ROLES = ('admin', 'super_admin')
+RESELLER_ROLES = ('admin', 'super_admin', 'reseller')
+
+# Rol, vigencia y flags del usuario en una sola consulta
+_USER_AUTH_QUERY = """
+SELECT r.name, u.access_until, u.free_access, u.code_access, u.blocked_reason, u.created_by
+FROM users u
+LEFT JOIN roles r ON u.role_id = r.id
+WHERE u.id = %s AND u.bot_token = %s
+"""
+
+_USER_EMAIL_QUERY = """
+SELECT 1 FROM user_emails
+WHERE user_id = %s AND bot_token = %s AND email = %s
+LIMIT 1
+"""
+
+
+class AuthorizationService:
+    """
+    Datos de autorización de cada usuario con caché por (bot_token, user_id).
+
+    Un solo SELECT trae rol, access_until, free_access, code_access,
+    blocked_reason y created_by; el resultado (también "no existe") se
+    guarda AUTH_CACHE_TTL segundos. Los comandos de administración que
+    modifican usuarios o sus correos llaman a invalidate() para que el
+    cambio se vea de inmediato. Lo comparten el middleware de permisos y
+    la ruta de búsqueda de correos.
+    """
+
+    def __init__(self):
+        self._ttl = float(os.environ.get("AUTH_CACHE_TTL", "30"))
+        self._cache = {}        # (bot_token, user_id) -> (expira_en, info, {email: permitido})
+        self._generation = 0    # se incrementa en cada invalidación
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @staticmethod
+    def _row_to_info(rows):
+        if not rows:
+            return None
+        role, access_until, free_access, code_access, blocked_reason, created_by = rows[0]
+        return {
+            'role': role,
+            'access_until': access_until,
+            'free_access': bool(free_access),
+            'code_access': bool(code_access),
+            'blocked_reason': blocked_reason,
+            'created_by': created_by,
+        }
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > time.time():
+                self._stats['hits'] += 1
+                return True, entry
+            self._stats['misses'] += 1
+            return False, self._generation
+
+    def _store(self, key, generation, info):
+        with self._lock:
+            # Si hubo una invalidación durante la consulta, no guardar datos potencialmente viejos
+            if self._generation == generation:
+                self._cache[key] = (time.time() + self._ttl, info, {})
+
+    def get_user(self, user_id, bot_token):
+        """Devuelve el dict de autorización del usuario o None si no existe (síncrono)."""
+        key = (bot_token, user_id)
+        hit, entry = self._cached(key)
+        if hit:
+            return entry[1]
+        info = self._row_to_info(execute_query(_USER_AUTH_QUERY, (user_id, bot_token)))
+        self._store(key, entry, info)
+        return info
+
+    async def get_user_async(self, user_id, bot_token):
+        """Igual que get_user, sin bloquear el event loop cuando hay que consultar la BD."""
+        key = (bot_token, user_id)
+        hit, entry = self._cached(key)
+        if hit:
+            return entry[1]
+        info = self._row_to_info(await db.fetch(_USER_AUTH_QUERY, (user_id, bot_token)))
+        self._store(key, entry, info)
+        return info
+
+    def get_role(self, user_id, bot_token):
+        info = self.get_user(user_id, bot_token)
+        return info['role'] if info else None
+
+    def is_admin(self, user_id, bot_token):
+        if user_id == ADMIN_ID:
+            return True
+        info = self.get_user(user_id, bot_token)
+        return bool(info and info['role'] in ADMIN_ROLES)
+
+    def can_access_email(self, user_id, bot_token, email_addr):
+        """Admin, acceso libre o correo asignado en user_emails (síncrono, con caché)."""
+        if user_id == ADMIN_ID:
+            return True
+        info = self.get_user(user_id, bot_token)
+        if info and (info['role'] in ADMIN_ROLES or info['free_access']):
+            return True
+        allowed, generation = self._cached_email(bot_token, user_id, email_addr)
+        if allowed is None:
+            allowed = bool(execute_query(_USER_EMAIL_QUERY, (user_id, bot_token, email_addr)))
+            self._store_email(bot_token, user_id, email_addr, allowed, generation)
+        return allowed
+
+    async def can_access_email_async(self, user_id, bot_token, email_addr):
+        if user_id == ADMIN_ID:
+            return True
+        info = await self.get_user_async(user_id, bot_token)
+        if info and (info['role'] in ADMIN_ROLES or info['free_access']):
+            return True
+        allowed, generation = self._cached_email(bot_token, user_id, email_addr)
+        if allowed is None:
+            allowed = bool(await db.fetch(_USER_EMAIL_QUERY, (user_id, bot_token, email_addr)))
+            self._store_email(bot_token, user_id, email_addr, allowed, generation)
+        return allowed
+
+    def _cached_email(self, bot_token, user_id, email_addr):
+        with self._lock:
+            entry = self._cache.get((bot_token, user_id))
+            if entry and entry[0] > time.time():
+                return entry[2].get(email_addr), self._generation
+            return None, self._generation
+
+    def _store_email(self, bot_token, user_id, email_addr, allowed, generation):
+        # Solo se guarda dentro de la entrada vigente del usuario, con su misma caducidad
+        with self._lock:
+            entry = self._cache.get((bot_token, user_id))
+            if entry and entry[0] > time.time() and self._generation == generation:
+                entry[2][email_addr] = allowed
+
+    def invalidate(self, bot_token=None, user_id=None, broadcast=True):
+        """
+        Descarta la caché de un usuario, de todos los de un bot o de todos.
+        Con broadcast se avisa también al resto de procesos de bot.
+        """
+        with self._lock:
+            for key in list(self._cache):
+                if (bot_token is None or key[0] == bot_token) and (user_id is None or key[1] == user_id):
+                    del self._cache[key]
+            self._generation += 1
+            self._stats['invalidations'] += 1
+        if broadcast:
+            cache_bus.publish('auth', bot_token, user_id)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats, cached=len(self._cache))
+
+
+# Instancia global del servicio de autorización
+authorization_service = AuthorizationService()
+cache_bus.subscribe(
+    'auth',
+    lambda bot_token, user_id: authorization_service.invalidate(bot_token, user_id, broadcast=False)
+)
@@ -0,0 +1,217 @@
+import base64
+import quopri
+import re
+
+# Prefijo de una respuesta FETCH: "<seq> (" al inicio del bloque
+_FETCH_SEQ_RE = re.compile(rb'^(\d+)\s+\(')
+# UID dentro de los atributos del FETCH (puede venir antes o después del literal)
+_FETCH_UID_RE = re.compile(rb'UID\s+(\d+)', re.IGNORECASE)
+# Nombre del atributo cuyo valor es el literal "{n}" al final del prefijo
+_LITERAL_NAME_RE = re.compile(rb'([A-Z0-9.]+(?:\[[^\]]*\])?(?:<\d+>)?)\s*\{\d+\}$', re.IGNORECASE)
+# Marca "{n}" de un literal al final del prefijo
+_LITERAL_MARK_RE = re.compile(rb'\{\d+\}$')
+
+
+def _attach_meta(entry, chunk):
+    """Acumula texto no literal de la respuesta y extrae el UID si aparece."""
+    entry['meta'] += chunk
+    if entry['uid'] is None:
+        uid_match = _FETCH_UID_RE.search(chunk)
+        if uid_match:
+            entry['uid'] = uid_match.group(1)
+
+
+def _quote_literal(literal):
+    """Reescribe un literal como cadena citada para reinsertarlo en meta."""
+    return b'"' + literal.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+
+def parse_fetch_response(data):
+    """
+    Agrupa la respuesta de un FETCH sobre un conjunto de mensajes.
+
+    imaplib devuelve una lista mezclando tuplas (prefijo, literal) y bytes
+    sueltos (cierres o atributos posteriores al literal). Esta función
+    devuelve una lista de dicts en el orden recibido:
+        {'seq': b'12', 'uid': b'3456' | None, 'meta': bytes, 'literals': {nombre: bytes}}
+
+    Los literales que son el valor de un atributo (BODY[...], RFC822...) van
+    a 'literals'. Los que van dentro de una estructura (p. ej. un nombre de
+    adjunto con 8 bits dentro del BODYSTRUCTURE) se reinsertan en 'meta' como
+    cadena citada para que la estructura quede completa.
+    """
+    entries = []
+    current = None
+
+    for item in data or []:
+        if isinstance(item, tuple) and len(item) >= 2:
+            prefix, literal = item[0], item[1]
+            seq_match = _FETCH_SEQ_RE.match(prefix)
+            if seq_match or current is None:
+                current = {
+                    'seq': seq_match.group(1) if seq_match else None,
+                    'uid': None,
+                    'meta': b'',
+                    'literals': {},
+                }
+                entries.append(current)
+            name_match = _LITERAL_NAME_RE.search(prefix.rstrip())
+            if name_match:
+                _attach_meta(current, prefix)
+                current['literals'][name_match.group(1).upper().decode('ascii', 'ignore')] = literal
+            else:
+                _attach_meta(current, _LITERAL_MARK_RE.sub(b'', prefix.rstrip()) + _quote_literal(literal))
+        elif isinstance(item, bytes) and item:
+            seq_match = _FETCH_SEQ_RE.match(item)
+            if seq_match:
+                # Respuesta sin literales (p. ej. solo UID/RFC822.SIZE/BODYSTRUCTURE)
+                current = {'seq': seq_match.group(1), 'uid': None, 'meta': b'', 'literals': {}}
+                entries.append(current)
+            if current is not None:
+                _attach_meta(current, item)
+
+    return entries
+
+
+def first_literal(entry):
+    """Devuelve el primer literal de una entrada de parse_fetch_response o b''."""
+    for literal in entry['literals'].values():
+        return literal
+    return b''
+
+
+def header_literal(entry):
+    """Devuelve las cabeceras pedidas con BODY.PEEK[HEADER...] de una entrada, o b''."""
+    for name, literal in entry['literals'].items():
+        if name.startswith('BODY[HEADER'):
+            return literal
+    return b''
+
+
+# ---------------------------------------------------------------------------
+# BODYSTRUCTURE
+# ---------------------------------------------------------------------------
+
+_BODYSTRUCTURE_RE = re.compile(rb'BODYSTRUCTURE\s+\(', re.IGNORECASE)
+_RFC822_SIZE_RE = re.compile(rb'RFC822\.SIZE\s+(\d+)', re.IGNORECASE)
+_ATOM_END = b' ()"\r\n'
+
+
+def _parse_sexp(raw, pos):
+    """Parsea una lista entre paréntesis desde raw[pos] == '('. Devuelve (lista, nueva_pos)."""
+    items = []
+    pos += 1
+    length = len(raw)
+    while pos < length:
+        char = raw[pos:pos + 1]
+        if char == b')':
+            return items, pos + 1
+        if char in (b' ', b'\r', b'\n'):
+            pos += 1
+        elif char == b'(':
+            sub, pos = _parse_sexp(raw, pos)
+            items.append(sub)
+        elif char == b'"':
+            pos += 1
+            buf = bytearray()
+            while pos < length and raw[pos:pos + 1] != b'"':
+                if raw[pos:pos + 1] == b'\\':
+                    pos += 1
+                buf += raw[pos:pos + 1]
+                pos += 1
+            items.append(bytes(buf).decode('utf-8', 'ignore'))
+            pos += 1
+        elif char == b'{':
+            # parse_fetch_response ya reinserta los literales como cadenas: si queda
+            # una marca {n} es que el literal no llegó
+            raise ValueError("BODYSTRUCTURE con literal no soportado")
+        else:
+            start = pos
+            while pos < length and raw[pos:pos + 1] not in _ATOM_END:
+                pos += 1
+            atom = raw[start:pos].decode('ascii', 'ignore')
+            items.append(None if atom.upper() == 'NIL' else atom)
+    raise ValueError("BODYSTRUCTURE incompleto")
+
+
+def parse_bodystructure(meta):
+    """Extrae y parsea el BODYSTRUCTURE de la parte no literal de un FETCH, o None."""
+    match = _BODYSTRUCTURE_RE.search(meta or b'')
+    if not match:
+        return None
+    try:
+        structure, _ = _parse_sexp(meta, match.end() - 1)
+        return structure
+    except (ValueError, IndexError):
+        return None
+
+
+def parse_rfc822_size(meta):
+    """Devuelve el RFC822.SIZE de la parte no literal de un FETCH, o None."""
+    match = _RFC822_SIZE_RE.search(meta or b'')
+    return int(match.group(1)) if match else None
+
+
+def _params_to_dict(params):
+    """Convierte ("CHARSET" "utf-8" ...) en {'charset': 'utf-8', ...}."""
+    if not isinstance(params, list):
+        return {}
+    return {
+        str(params[i]).lower(): params[i + 1]
+        for i in range(0, len(params) - 1, 2)
+        if params[i] is not None
+    }
+
+
+def find_text_parts(structure, prefix=''):
+    """
+    Recorre un BODYSTRUCTURE y devuelve las partes text/* no adjuntas:
+        [{'section': '1.2', 'subtype': 'html', 'charset': 'utf-8', 'encoding': 'quoted-printable', 'size': 1234}]
+    """
+    parts = []
+    if not isinstance(structure, list) or not structure:
+        return parts
+
+    if isinstance(structure[0], list):
+        # Multipart: las subpartes son las listas iniciales, luego viene el subtipo
+        index = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            index += 1
+            section = f"{prefix}.{index}" if prefix else str(index)
+            parts.extend(find_text_parts(child, section))
+        return parts
+
+    if len(structure) < 7 or str(structure[0]).lower() != 'text':
+        return parts
+
+    # Descartar partes marcadas como adjunto (campo disposition en las extensiones)
+    for extension in structure[8:]:
+        if isinstance(extension, list) and extension and str(extension[0]).lower() == 'attachment':
+            return parts
+
+    try:
+        size = int(structure[6])
+    except (TypeError, ValueError):
+        size = None
+    parts.append({
+        'section': prefix or '1',
+        'subtype': str(structure[1]).lower(),
+        'charset': _params_to_dict(structure[2]).get('charset') or 'utf-8',
+        'encoding': str(structure[5] or '7bit').lower(),
+        'size': size,
+    })
+    return parts
+
+
+def decode_part_payload(payload, encoding, charset):
+    """Decodifica una sección según su Content-Transfer-Encoding y charset declarados."""
+    if encoding == 'base64':
+        payload = base64.b64decode(payload, validate=False)
+    elif encoding == 'quoted-printable':
+        payload = quopri.decodestring(payload)
+    try:
+        return payload.decode(charset or 'utf-8', 'ignore')
+    except LookupError:
+        return payload.decode('utf-8', 'ignore')
@@ -3,7 +3,7 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from datetime import datetime
 from config import ADMIN_ID
-from database.connection import execute_query
+from utils.authorization import authorization_service, ADMIN_ROLES, RESELLER_ROLES
 from utils.logger_utility import bot_logger
 
 def check_user_permission(func):
@@ -17,32 +17,21 @@ def check_user_permission(func):
             return await func(update, context, *args, **kwargs)
         
         try:
-            # Primero verificar si es admin
-            admin_result = execute_query("""
-            SELECT r.name FROM users u
-            JOIN roles r ON u.role_id = r.id
-            WHERE u.id = %s AND u.bot_token = %s
-            """, (user_id, bot_token))
+            # Rol, vigencia y bloqueo en una sola consulta (con caché por usuario)
+            user_info = await authorization_service.get_user_async(user_id, bot_token)
             
-            is_admin = admin_result and admin_result[0][0] in ['admin', 'super_admin']
-            
-            if is_admin:
+            if user_info and user_info['role'] in ADMIN_ROLES:
                 return await func(update, context, *args, **kwargs)
             
             # Verificar si es un usuario normal con acceso válido
-            user_result = execute_query("""
-            SELECT access_until, blocked_reason FROM users
-            WHERE id = %s AND bot_token = %s
-            """, (user_id, bot_token))
-            
-            if not user_result:
+            if not user_info:
                 await update.message.reply_text(
                     "❌ No tienes acceso al bot. Por favor, contacta al administrador para obtener acceso."
                 )
                 return
                 
-            expiration = user_result[0][0]
-            blocked_reason = user_result[0][1] if len(user_result[0]) > 1 else None
+            expiration = user_info['access_until']
+            blocked_reason = user_info['blocked_reason']
             
             # Verificar si la suscripción ha expirado o está bloqueado
             if datetime.now() > expiration:
@@ -88,33 +77,22 @@ def check_callback_permission(func):
             return await func(update, context, *args, **kwargs)
 
         try:
-            # Primero verificar si es admin
-            admin_result = execute_query("""
-            SELECT r.name FROM users u
-            JOIN roles r ON u.role_id = r.id
-            WHERE u.id = %s AND u.bot_token = %s
-            """, (user_id, bot_token))
+            # Rol, vigencia y bloqueo en una sola consulta (con caché por usuario)
+            user_info = await authorization_service.get_user_async(user_id, bot_token)
             
-            is_admin = admin_result and admin_result[0][0] in ['admin', 'super_admin']
-            
-            if is_admin:
+            if user_info and user_info['role'] in ADMIN_ROLES:
                 return await func(update, context, *args, **kwargs)
             
             # Verificar si es un usuario normal con acceso válido
-            user_result = execute_query("""
-            SELECT access_until, blocked_reason FROM users
-            WHERE id = %s AND bot_token = %s
-            """, (user_id, bot_token))
-            
-            if not user_result:
+            if not user_info:
                 await update.callback_query.answer(
                     "No tienes acceso al bot. Contacta al administrador.",
                     show_alert=True
                 )
                 return
                 
-            expiration = user_result[0][0]
-            blocked_reason = user_result[0][1] if len(user_result[0]) > 1 else None
+            expiration = user_info['access_until']
+            blocked_reason = user_info['blocked_reason']
             
             # Verificar si la suscripción ha expirado o está bloqueado
             if datetime.now() > expiration:
@@ -154,13 +132,9 @@ def admin_required(func):
             return await func(update, context, *args, **kwargs)
             
         try:
-            admin_result = execute_query("""
-            SELECT r.name FROM users u
-            JOIN roles r ON u.role_id = r.id
-            WHERE u.id = %s AND u.bot_token = %s
-            """, (user_id, bot_token))
+            user_info = await authorization_service.get_user_async(user_id, bot_token)
             
-            if not admin_result or admin_result[0][0] not in ['admin', 'super_admin']:
+            if not user_info or user_info['role'] not in ADMIN_ROLES:
                 await update.message.reply_text(
                     "❌ Este comando está restringido solo para administradores."
                 )
@@ -192,13 +166,9 @@ def admin_or_reseller_required(func):
             
         try:
             # Verificar si es admin o revendedor
-            role_result = execute_query("""
-            SELECT r.name FROM users u
-            JOIN roles r ON u.role_id = r.id
-            WHERE u.id = %s AND u.bot_token = %s
-            """, (user_id, bot_token))
+            user_info = await authorization_service.get_user_async(user_id, bot_token)
             
-            if not role_result or role_result[0][0] not in ['admin', 'super_admin', 'reseller']:
+            if not user_info or user_info['role'] not in RESELLER_ROLES:
                 await update.message.reply_text(
                     "❌ Este comando está restringido para administradores y revendedores."
                 )
@@ -227,22 +197,16 @@ def reseller_required(func):
         
         try:
             # Verificar rol del usuario
-            role_result = execute_query("""
-            SELECT r.name FROM users u
-            JOIN roles r ON u.role_id = r.id
-            WHERE u.id = %s AND u.bot_token = %s
-            """, (user_id, bot_token))
+            user_info = await authorization_service.get_user_async(user_id, bot_token)
             
-            if not role_result:
+            if not user_info or not user_info['role']:
                 await update.message.reply_text(
                     "❌ No tienes acceso al bot. Por favor, contacta al administrador."
                 )
                 return
                 
-            role_name = role_result[0][0]
-            
             # Admins y revendedores pueden usar estos comandos
-            if role_name in ['admin', 'super_admin', 'reseller']:
+            if user_info['role'] in RESELLER_ROLES:
                 return await func(update, context, *args, **kwargs)
                 
             await update.message.reply_text(
@@ -298,24 +262,12 @@ def reseller_can_manage_user(func):
                 return await func(update, context, *args, **kwargs)
                 
             # Verificar si es admin
-            admin_result = execute_query("""
-            SELECT r.name FROM users u
-            JOIN roles r ON u.role_id = r.id
-            WHERE u.id = %s AND u.bot_token = %s
-            """, (caller_id, bot_token))
-            
-            is_admin = admin_result and admin_result[0][0] in ['admin', 'super_admin']
-            if is_admin:
+            caller_info = await authorization_service.get_user_async(caller_id, bot_token)
+            if caller_info and caller_info['role'] in ADMIN_ROLES:
                 return await func(update, context, *args, **kwargs)
             
             # Si no es admin, verificar si es revendedor
-            reseller_check = execute_query("""
-            SELECT r.name FROM users u
-            JOIN roles r ON u.role_id = r.id
-            WHERE u.id = %s AND u.bot_token = %s AND r.name = 'reseller'
-            """, (caller_id, bot_token))
-            
-            if not reseller_check:
+            if not caller_info or caller_info['role'] != 'reseller':
                 await update.message.reply_text("❌ No tienes permisos para ejecutar este comando.")
                 return
                 
@@ -324,10 +276,8 @@ def reseller_can_manage_user(func):
                 return await func(update, context, *args, **kwargs)
                 
             # Para otros comandos, verificar si el revendedor creó al usuario
-            creator_check = execute_query("""
-            SELECT id FROM users
-            WHERE id = %s AND bot_token = %s AND created_by = %s
-            """, (user_id, bot_token, caller_id))
+            target_info = await authorization_service.get_user_async(user_id, bot_token)
+            creator_check = target_info and target_info['created_by'] == caller_id
             
             if not creator_check:
                 await update.message.reply_text(
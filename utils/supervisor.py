@@ -0,0 +1,363 @@
+import collections
+import json
+import logging
+import os
+import select
+import signal
+import subprocess
+import sys
+import time
+import traceback
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# Espera antes del primer reinicio; se duplica con cada caída seguida
+RESTART_BACKOFF_BASE = float(os.environ.get("SUPERVISOR_BACKOFF_BASE", "1"))
+RESTART_BACKOFF_MAX = float(os.environ.get("SUPERVISOR_BACKOFF_MAX", "300"))
+# Un hijo que aguanta este tiempo en marcha se considera estable (reinicia el backoff)
+STABLE_AFTER = float(os.environ.get("SUPERVISOR_STABLE_AFTER", "60"))
+# Corte de crash loop: N caídas dentro de la ventana dejan el hijo parado
+CRASH_LOOP_RESTARTS = int(os.environ.get("SUPERVISOR_CRASH_LOOP_RESTARTS", "5"))
+CRASH_LOOP_WINDOW = float(os.environ.get("SUPERVISOR_CRASH_LOOP_WINDOW", "300"))
+# Estado por hijo (pid, uptime, reinicios, RSS) en JSON, reescrito periódicamente
+STATUS_FILE = os.environ.get("SUPERVISOR_STATUS_FILE", os.path.join("logs", "supervisor_status.json"))
+STATUS_INTERVAL = float(os.environ.get("SUPERVISOR_STATUS_INTERVAL", "15"))
+STOP_TIMEOUT = 5
+
+# Sin SIGCHLD (Windows) se recurre a consultar los hijos cada POLL_INTERVAL
+_HAS_SIGCHLD = hasattr(signal, "SIGCHLD")
+POLL_INTERVAL = 1.0
+
+
+class ForkedProcess:
+    """
+    Hijo creado con os.fork() que ejecuta una función del propio supervisor
+    (BOT_SPAWN_MODE=fork). Ofrece la parte de la interfaz de Popen que usa
+    Supervisor: pid, returncode, poll, wait, terminate y kill.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+    @classmethod
+    def spawn(cls, target, log_file, in_child=None):
+        # Vaciar buffers antes del fork para no duplicar salida pendiente
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            return cls(pid)
+
+        # Proceso hijo: nunca vuelve al bucle del supervisor
+        code = 1
+        try:
+            if in_child is not None:
+                in_child()
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.close(devnull)
+            os.dup2(log_file.fileno(), 1)
+            os.dup2(log_file.fileno(), 2)
+            code = target()
+        except SystemExit as e:
+            code = e.code
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(code if isinstance(code, int) else (0 if code is None else 1))
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                # Ya recogido por otro waitpid; no hay código que recuperar
+                self.returncode = 255
+                return self.returncode
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(f"fork:{self.pid}", timeout)
+            time.sleep(0.05)
+        return self.returncode
+
+    def _signal(self, sig):
+        if self.poll() is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        self._signal(signal.SIGKILL)
+
+
+class Child:
+    """Un proceso hijo supervisado y su historial de reinicios."""
+
+    def __init__(self, label, command, log_filename):
+        self.label = label
+        self.command = command
+        self.log_filename = log_filename
+        self.process = None
+        self.state = 'pending'           # running, backoff, crash_loop, stopped
+        self.started_at = None
+        self.restarts = 0
+        self.failures = 0                # caídas seguidas, para el backoff
+        self.exits = collections.deque()  # instantes de las caídas recientes
+        self.last_exit_code = None
+        self.next_start_at = 0.0
+
+    def status(self, now):
+        pid = self.process.pid if self.state == 'running' else None
+        rss = None
+        if pid is not None:
+            try:
+                rss = psutil.Process(pid).memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        return {
+            'label': self.label,
+            'state': self.state,
+            'pid': pid,
+            'uptime_s': round(now - self.started_at, 1) if pid is not None else 0,
+            'restarts': self.restarts,
+            'last_exit_code': self.last_exit_code,
+            'rss_mb': round(rss / (1024 * 1024), 1) if rss is not None else None,
+            'next_start_in_s': round(max(0.0, self.next_start_at - now), 1) if self.state == 'backoff' else None,
+        }
+
+
+class Supervisor:
+    """
+    Arranca todos los procesos hijo a la vez y los reinicia cuando terminan.
+
+    En POSIX el bucle duerme en select() sobre un self-pipe que despierta
+    signal.set_wakeup_fd al llegar SIGCHLD, de modo que una caída se detecta
+    al instante sin consultar periódicamente. Los reinicios usan backoff
+    exponencial (RESTART_BACKOFF_BASE * 2^(caídas seguidas - 1), hasta
+    RESTART_BACKOFF_MAX) y un hijo con CRASH_LOOP_RESTARTS caídas dentro de
+    CRASH_LOOP_WINDOW queda en crash_loop sin reiniciarse. El estado de cada
+    hijo se escribe en STATUS_FILE.
+
+    Cada comando puede ser una lista de argumentos (subprocess) o una
+    función sin argumentos, que se ejecuta en un hijo creado con fork y
+    cuyo valor de retorno es el código de salida.
+    """
+
+    def __init__(self, commands, logs_dir="logs", status_file=None):
+        self.children = [
+            Child(label, command, os.path.join(logs_dir, f"bot_{label}.log"))
+            for label, command in commands
+        ]
+        self.status_file = status_file or STATUS_FILE
+        self.started_at = time.monotonic()
+        self._stopping = False
+        self._wakeup_r = None
+        self._wakeup_w = None
+        self._previous_handlers = {}
+
+    def _spawn(self, child, restart=False):
+        try:
+            with open(child.log_filename, 'a') as log_file:
+                if restart:
+                    log_file.write(f"\n\n--- REINICIO DEL BOT {child.label} - {time.strftime('%Y-%m-%d %H:%M:%S')} ---\n\n")
+                    log_file.flush()
+                if callable(child.command):
+                    child.process = ForkedProcess.spawn(child.command, log_file, self._reset_in_child)
+                else:
+                    child.process = subprocess.Popen(
+                        child.command,
+                        stdout=log_file,
+                        stderr=log_file,
+                        stdin=subprocess.DEVNULL
+                    )
+        except Exception as e:
+            logger.error(f"Error al iniciar bot {child.label}: {e}")
+            child.started_at = None
+            self._record_exit(child, None, time.monotonic())
+            return False
+        child.state = 'running'
+        child.started_at = time.monotonic()
+        if restart:
+            child.restarts += 1
+            logger.info(f"Proceso reiniciado para bot {child.label} (pid {child.process.pid}, reinicio {child.restarts})")
+        else:
+            logger.info(f"Proceso iniciado para bot {child.label} (pid {child.process.pid})")
+        return True
+
+    def start(self):
+        """Instala el aviso de SIGCHLD y lanza todos los hijos sin pausas entre ellos."""
+        self._install_signals()
+        started = sum(1 for child in self.children if self._spawn(child))
+        self.write_status()
+        return started
+
+    def _install_signals(self):
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self._previous_handlers[sig] = signal.signal(sig, self._on_stop_signal)
+        if not _HAS_SIGCHLD:
+            return
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        signal.set_wakeup_fd(self._wakeup_w)
+        # Hace falta un manejador Python para que la señal escriba en el pipe
+        self._previous_handlers[signal.SIGCHLD] = signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    def _restore_signals(self):
+        for sig, handler in self._previous_handlers.items():
+            signal.signal(sig, handler)
+        self._previous_handlers.clear()
+        if self._wakeup_r is not None:
+            signal.set_wakeup_fd(-1)
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self._wakeup_r = self._wakeup_w = None
+
+    def _reset_in_child(self):
+        """En un hijo creado con fork: señales por defecto y fuera el self-pipe del supervisor."""
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if self._wakeup_r is not None:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+
+    def _on_stop_signal(self, signum, frame):
+        self._stopping = True
+
+    def _wait(self, timeout):
+        if self._wakeup_r is None:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return
+        try:
+            readable, _, _ = select.select([self._wakeup_r], [], [], timeout)
+        except InterruptedError:
+            return
+        if readable:
+            try:
+                while os.read(self._wakeup_r, 512):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _record_exit(self, child, exit_code, now):
+        child.last_exit_code = exit_code
+        if child.started_at is not None and now - child.started_at >= STABLE_AFTER:
+            child.failures = 0
+        child.failures += 1
+        child.exits.append(now)
+        while child.exits and now - child.exits[0] > CRASH_LOOP_WINDOW:
+            child.exits.popleft()
+
+        if len(child.exits) >= CRASH_LOOP_RESTARTS:
+            child.state = 'crash_loop'
+            logger.error(
+                f"El bot {child.label} ha caído {len(child.exits)} veces en {CRASH_LOOP_WINDOW:.0f}s. "
+                f"No se reiniciará más; revisa {child.log_filename}"
+            )
+            return
+        delay = min(RESTART_BACKOFF_BASE * 2 ** (child.failures - 1), RESTART_BACKOFF_MAX)
+        child.state = 'backoff'
+        child.next_start_at = now + delay
+        logger.warning(f"El proceso del bot {child.label} ha terminado con código {exit_code}. Reinicio en {delay:.1f}s")
+
+    def _reap(self, now):
+        changed = False
+        for child in self.children:
+            if child.state != 'running':
+                continue
+            exit_code = child.process.poll()
+            if exit_code is not None:
+                self._record_exit(child, exit_code, now)
+                changed = True
+        return changed
+
+    def _restart_due(self, now):
+        changed = False
+        for child in self.children:
+            if child.state == 'backoff' and now >= child.next_start_at:
+                self._spawn(child, restart=True)
+                changed = True
+        return changed
+
+    def run(self):
+        """Bucle de supervisión hasta SIGINT/SIGTERM; luego detiene a los hijos."""
+        next_status = time.monotonic() + STATUS_INTERVAL
+        try:
+            while not self._stopping:
+                now = time.monotonic()
+                changed = self._reap(now)
+                changed = self._restart_due(now) or changed
+                if changed or now >= next_status:
+                    self.write_status()
+                    next_status = now + STATUS_INTERVAL
+
+                deadlines = [next_status] + [
+                    child.next_start_at for child in self.children if child.state == 'backoff'
+                ]
+                self._wait(max(0.0, min(deadlines) - time.monotonic()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Envía SIGTERM a todos los hijos a la vez y fuerza los que no terminen."""
+        self._stopping = True
+        running = [child for child in self.children if child.state == 'running']
+        logger.info(f"Terminando {len(running)} procesos de bot...")
+        for child in running:
+            try:
+                child.process.terminate()
+            except OSError:
+                pass
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for child in running:
+            try:
+                child.process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"El proceso del bot {child.label} no respondió. Forzando terminación...")
+                child.process.kill()
+                child.process.wait()
+            child.last_exit_code = child.process.returncode
+            child.state = 'stopped'
+        self.write_status()
+        self._restore_signals()
+        logger.info("Todos los procesos de bot han sido terminados")
+
+    def get_status(self):
+        now = time.monotonic()
+        children = [child.status(now) for child in self.children]
+        states = collections.Counter(child['state'] for child in children)
+        return {
+            'supervisor_pid': os.getpid(),
+            'uptime_s': round(now - self.started_at, 1),
+            'updated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'states': dict(states),
+            'children': children,
+        }
+
+    def write_status(self):
+        """Escritura atómica (fichero temporal + replace) para lectores concurrentes."""
+        tmp_path = f"{self.status_file}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.get_status(), f, indent=2)
+            os.replace(tmp_path, self.status_file)
+        except OSError as e:
+            logger.error(f"No se pudo escribir el estado del supervisor: {e}")
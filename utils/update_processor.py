@@ -0,0 +1,163 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Máximo de updates ejecutándose a la vez por bot (env BOT_MAX_CONCURRENT_UPDATES)
+MAX_CONCURRENT_UPDATES = int(os.environ.get("BOT_MAX_CONCURRENT_UPDATES", "32"))
+# Espera (cola + semáforo) a partir de la cual se registra un aviso
+WAIT_WARN_MS = float(os.environ.get("BOT_UPDATE_WAIT_WARN_MS", "2000"))
+# Updates pendientes (en curso + esperando + encolados) a partir de los cuales
+# se registra un aviso; el webhook responde 503 con su propio tope (WEBHOOK_MAX_QUEUE)
+BACKLOG_WARN = int(os.environ.get("BOT_UPDATE_BACKLOG_WARN", "500"))
+# Valor del semáforo de PTB. PTB lo toma dentro de la tarea que ya creó para
+# cada update, así que no frena al fetcher ni acota nada: solo tiene que ser
+# mayor que cualquier backlog razonable para no interferir con el semáforo
+# propio, que se toma después del orden por usuario
+_PTB_TASK_CEILING = 4096
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Procesa updates de usuarios distintos en paralelo y los de un mismo
+    usuario en orden de llegada.
+
+    Mientras un usuario tiene un update en curso, los siguientes se encolan
+    en su propia cola y los ejecuta la misma tarea al terminar, de modo que
+    una ráfaga de un usuario ocupa como mucho un hueco del límite global.
+    El límite global (max_concurrent) se aplica con un semáforo propio que
+    se adquiere por cada update; get_stats() expone la profundidad de las
+    colas y el tiempo de espera de cada update hasta empezar a ejecutarse.
+
+    PTB crea una tarea por update en cuanto lo saca de la update_queue, así
+    que el procesador no puede frenar la llegada: backlog cuenta los updates
+    aceptados y aún sin terminar, y es lo que el webhook usa para responder
+    503. En polling solo se avisa en el log al superar BACKLOG_WARN.
+    """
+
+    def __init__(self, max_concurrent=None):
+        super().__init__(max_concurrent_updates=_PTB_TASK_CEILING)
+        self.max_concurrent = max_concurrent or MAX_CONCURRENT_UPDATES
+        self._limit = asyncio.BoundedSemaphore(self.max_concurrent)
+        self._pending = {}              # clave de usuario -> deque[(coroutine, llegada)]
+        self._running = 0
+        self._waiting = 0
+        self._backlog_warned = False
+        self._stats = {'processed': 0, 'errors': 0, 'wait_total_ms': 0.0, 'wait_max_ms': 0.0}
+
+    @staticmethod
+    def _user_key(update):
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return ('user', user.id)
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None:
+            return ('chat', chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        arrived = time.perf_counter()
+        self._check_backlog()
+        key = self._user_key(update)
+        if key is None:
+            await self._run(coroutine, arrived)
+            return
+
+        queue = self._pending.get(key)
+        if queue is not None:
+            # Ya hay un update de este usuario en curso: lo ejecutará esa tarea
+            queue.append((coroutine, arrived))
+            return
+
+        queue = self._pending[key] = collections.deque()
+        try:
+            await self._run(coroutine, arrived)
+            while queue:
+                await self._run(*queue.popleft())
+        finally:
+            del self._pending[key]
+
+    async def _run(self, coroutine, arrived):
+        self._waiting += 1
+        try:
+            await self._limit.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            wait_ms = (time.perf_counter() - arrived) * 1000
+            self._stats['wait_total_ms'] += wait_ms
+            self._stats['wait_max_ms'] = max(self._stats['wait_max_ms'], wait_ms)
+            if wait_ms >= WAIT_WARN_MS:
+                logger.warning(
+                    f"Update esperó {wait_ms:.0f} ms antes de procesarse "
+                    f"(en curso={self._running}, esperando={self._waiting}, encolados={self.queued})"
+                )
+            self._running += 1
+            try:
+                await coroutine
+            except Exception as e:
+                # Application.process_update ya envía los errores de handlers a
+                # process_error; esto cubre fallos fuera de los handlers
+                self._stats['errors'] += 1
+                logger.error(f"Error procesando update: {e}")
+            finally:
+                self._running -= 1
+                self._stats['processed'] += 1
+        finally:
+            self._limit.release()
+
+    def _check_backlog(self):
+        """Avisa una vez cada vez que el backlog cruza BACKLOG_WARN."""
+        backlog = self.backlog
+        if backlog >= BACKLOG_WARN and not self._backlog_warned:
+            self._backlog_warned = True
+            logger.warning(
+                f"Backlog de updates en {backlog} (en curso={self._running}, "
+                f"esperando={self._waiting}, encolados={self.queued}, máximo={self.max_concurrent})"
+            )
+        elif backlog < BACKLOG_WARN // 2:
+            self._backlog_warned = False
+
+    @property
+    def backlog(self):
+        """Updates aceptados y sin terminar: en curso, esperando hueco o encolados por usuario."""
+        return self._running + self._waiting + self.queued
+
+    @property
+    def queued(self):
+        """Updates encolados detrás de otro del mismo usuario."""
+        return sum(len(queue) for queue in self._pending.values())
+
+    def get_stats(self):
+        processed = self._stats['processed']
+        return {
+            'max_concurrent': self.max_concurrent,
+            'running': self._running,
+            'waiting': self._waiting,
+            'queued': self.queued,
+            'backlog': self.backlog,
+            'active_users': len(self._pending),
+            'processed': processed,
+            'errors': self._stats['errors'],
+            'avg_wait_ms': round(self._stats['wait_total_ms'] / processed, 1) if processed else 0.0,
+            'max_wait_ms': round(self._stats['wait_max_ms'], 1),
+        }
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        # Cerrar las corrutinas que quedaron encoladas sin ejecutarse
+        dropped = 0
+        for queue in self._pending.values():
+            while queue:
+                coroutine, _ = queue.popleft()
+                coroutine.close()
+                dropped += 1
+        if dropped:
+            logger.warning(f"{dropped} updates encolados descartados al apagar")
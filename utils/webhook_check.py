@@ -0,0 +1,239 @@
+"""
+Comprobación del servidor de webhooks contra una Bot API falsa local.
+
+Levanta un servidor HTTP que imita a api.telegram.org (getMe y setWebhook),
+crea una Application real de python-telegram-bot apuntando a él, ya arrancada
+(su fetcher vacía la update_queue) y con un PerUserUpdateProcessor de un solo
+hueco y un handler que se bloquea, y un WebhookServer en un puerto libre.
+Verifica de extremo a extremo:
+
+  - register() llama a setWebhook con la URL pública y el secret_token del bot
+  - un update con el secreto correcto se acepta (200) y llega al handler
+  - un secreto incorrecto da 403 y una ruta desconocida 404
+  - con max_queue updates pendientes en el procesador se responde 503 con
+    Retry-After, aunque la update_queue esté vacía
+  - GET /healthz devuelve las estadísticas, con las del procesador del bot
+  - al liberarse el handler y vaciarse el backlog se vuelve a aceptar
+
+No necesita red ni un token real. Sale con código 1 si alguna comprobación falla.
+
+Uso:
+    python -m utils.webhook_check [--max-queue 5] [--group N]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import socket
+import sys
+from urllib.parse import parse_qs
+
+import httpx
+from telegram import Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+
+from utils.update_processor import PerUserUpdateProcessor
+from utils.webhook_server import WebhookServer, webhook_secret
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = "123456:CHECK-webhook-token"
+_PUBLIC_URL = "https://bots.example.invalid"
+_BOT_INFO = {"id": 123456, "is_bot": True, "first_name": "Check", "username": "check_bot"}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeBotAPI:
+    """Bot API mínima: responde getMe y registra las llamadas a setWebhook."""
+
+    def __init__(self):
+        self.port = _free_port()
+        self.set_webhook_calls = []
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', '0')))
+
+            method = request_line.decode('latin-1').split()[1].rsplit('/', 1)[-1]
+            if 'json' in headers.get('content-type', ''):
+                params = json.loads(body or b'{}')
+            else:
+                params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+            if method == 'getMe':
+                result = _BOT_INFO
+            elif method == 'setWebhook':
+                self.set_webhook_calls.append(params)
+                result = True
+            else:
+                result = True
+            payload = json.dumps({"ok": True, "result": result}).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n"
+                + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+def _update(update_id, user_id=1):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "/start",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+        },
+    }
+
+
+async def _wait_for(condition, timeout=5.0):
+    """Espera a que condition() sea cierto (el fetcher de PTB trabaja en otra tarea)."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+async def run_checks(max_queue, group):
+    failures = []
+
+    def check(name, ok, detail=""):
+        print(f"{'OK ' if ok else 'FALLO'} {name}{f' ({detail})' if detail and not ok else ''}")
+        if not ok:
+            failures.append(name)
+
+    api = FakeBotAPI()
+    await api.start()
+    processor = PerUserUpdateProcessor(max_concurrent=1)
+    application = (
+        ApplicationBuilder().token(_TOKEN).base_url(api.base_url)
+        .concurrent_updates(processor).build()
+    )
+    handled = []
+    release = asyncio.Event()
+
+    async def blocking_handler(update, context):
+        handled.append(update.update_id)
+        await release.wait()
+
+    application.add_handler(TypeHandler(Update, blocking_handler))
+    await application.initialize()
+    await application.start()
+
+    server = WebhookServer(
+        host="127.0.0.1", port=_free_port(), public_url=_PUBLIC_URL,
+        path_prefix=f"/g{group}" if group is not None else "", max_queue=max_queue,
+    )
+    await server.start()
+    try:
+        registered = await server.register(application)
+        path = server.path_for(_TOKEN)
+        check("register() devuelve True", registered)
+        call = api.set_webhook_calls[-1] if api.set_webhook_calls else {}
+        check("setWebhook con la URL pública", call.get('url') == f"{_PUBLIC_URL}{path}", call.get('url'))
+        check("setWebhook con el secret_token del bot", call.get('secret_token') == webhook_secret(_TOKEN))
+
+        base = f"http://127.0.0.1:{server.port}"
+        secret = {"X-Telegram-Bot-Api-Secret-Token": webhook_secret(_TOKEN)}
+        async with httpx.AsyncClient(base_url=base) as client:
+            response = await client.post(path, json=_update(1), headers=secret)
+            check("update válido -> 200", response.status_code == 200, response.status_code)
+            check("el update llega al handler", await _wait_for(lambda: handled == [1]), handled)
+
+            response = await client.post(path, json=_update(2), headers={"X-Telegram-Bot-Api-Secret-Token": "x"})
+            check("secreto incorrecto -> 403", response.status_code == 403, response.status_code)
+
+            response = await client.post("/webhook/desconocido", json=_update(3), headers=secret)
+            check("ruta desconocida -> 404", response.status_code == 404, response.status_code)
+
+            # Un usuario distinto por update: ninguno se encola detrás de otro del mismo usuario
+            statuses = []
+            for user_id in range(10, 10 + max_queue - 1):
+                response = await client.post(path, json=_update(user_id, user_id), headers=secret)
+                statuses.append(response.status_code)
+            check("updates hasta max_queue -> 200", set(statuses) == {200}, statuses)
+            await _wait_for(lambda: application.update_queue.qsize() == 0)
+            check("el fetcher vacía la update_queue", application.update_queue.qsize() == 0,
+                  application.update_queue.qsize())
+            check("el backlog del procesador llega a max_queue", processor.backlog == max_queue,
+                  processor.get_stats())
+
+            response = await client.post(path, json=_update(999, 999), headers=secret)
+            check(
+                "backlog lleno -> 503 con Retry-After",
+                response.status_code == 503 and 'retry-after' in response.headers,
+                response.status_code
+            )
+            check("el backlog no supera max_queue", processor.backlog == max_queue, processor.backlog)
+
+            response = await client.get("/healthz")
+            stats = response.json() if response.status_code == 200 else {}
+            bot_stats = stats.get('updates', {}).get(_TOKEN[:10], {})
+            check(
+                "healthz con estadísticas del procesador",
+                stats.get('busy', 0) >= 1 and stats.get('bots') == 1 and bot_stats.get('backlog') == max_queue,
+                stats
+            )
+
+            release.set()
+            drained = await _wait_for(lambda: processor.backlog == 0)
+            response = await client.post(path, json=_update(1000, 1000), headers=secret)
+            check("backlog vacío -> vuelve a aceptar", drained and response.status_code == 200,
+                  response.status_code)
+    finally:
+        release.set()
+        server.unregister(application)
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await api.stop()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-queue', type=int, default=5, help='tope de updates pendientes para probar el 503')
+    parser.add_argument('--group', type=int, default=None, help='comprobar las rutas /gN de un grupo multi-bot')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    failures = asyncio.run(run_checks(args.max_queue, args.group))
+    if failures:
+        print(f"\n{len(failures)} comprobación(es) fallida(s)")
+        return 1
+    print("\nServidor de webhooks verificado contra la Bot API falsa")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Ingreso por webhook: un único servidor HTTP local (detrás del proxy TLS)
+# recibe los updates de todos los bots del proceso y los deja en la
+# update_queue de la Application correspondiente. La ruta de cada bot es
+# /webhook/<sha256(token)[:16]>, de modo que el token no aparece en la URL.
+# Se activa con WEBHOOK_URL (URL pública base, p. ej. https://bots.example.com).
+#
+# Con BOT_RUNTIME=multi y varios grupos (BOT_TOKENS_PER_PROCESS), cada proceso
+# de grupo N escucha en WEBHOOK_PORT + N y sus rutas llevan el prefijo /gN
+# (/gN/webhook/<hash>). El proxy debe enviar /gN/ a ese puerto sin quitar el
+# prefijo, p. ej. en nginx: location /g1/ { proxy_pass http://127.0.0.1:8081; }
+# ---------------------------------------------------------------------------
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+# Secreto base del que se deriva el secret_token de cada bot (aleatorio si falta)
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_hex(32)
+# Updates pendientes por bot (update_queue + backlog del procesador) a partir
+# de los cuales se responde 503
+WEBHOOK_MAX_QUEUE = int(os.environ.get("WEBHOOK_MAX_QUEUE", "1000"))
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+_MAX_BODY_BYTES = 1024 * 1024
+_MAX_HEADERS = 100
+_IDLE_TIMEOUT = 75
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable",
+}
+
+
+def webhook_path(token):
+    return f"/webhook/{hashlib.sha256(token.encode()).hexdigest()[:16]}"
+
+
+def webhook_secret(token):
+    """secret_token que Telegram enviará en X-Telegram-Bot-Api-Secret-Token"""
+    return hmac.new(WEBHOOK_SECRET.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+
+class WebhookServer:
+    """
+    Servidor HTTP/1.1 mínimo sobre asyncio para los webhooks de Telegram.
+
+    Cada petición se valida (ruta registrada, método POST, secret_token,
+    tamaño) antes de deserializar el Update. Si los updates pendientes del
+    bot (ver pending_updates) llegan a max_queue (WEBHOOK_MAX_QUEUE) se
+    responde 503 y Telegram reintenta
+    más tarde, de modo que la memoria del proceso queda acotada. GET /healthz
+    devuelve las estadísticas en JSON, con la profundidad de cola y el tiempo
+    de espera de cada bot (PerUserUpdateProcessor.get_stats).
+    """
+
+    def __init__(self, host=None, port=None, public_url=None, path_prefix="", max_queue=None):
+        self.host = host or WEBHOOK_LISTEN
+        self.port = port or WEBHOOK_PORT
+        self.public_url = (public_url or WEBHOOK_URL).rstrip("/")
+        self.path_prefix = path_prefix.rstrip("/")
+        self.max_queue = max_queue or WEBHOOK_MAX_QUEUE
+        self._routes = {}  # ruta -> (application, secret)
+        self._server = None
+        self._connections = set()  # tareas de las conexiones abiertas
+        self._stats = {'accepted': 0, 'forbidden': 0, 'busy': 0, 'not_found': 0, 'bad_request': 0}
+
+    @classmethod
+    def for_group(cls, group):
+        """Servidor del proceso de grupo N del runtime multi-bot (ver cabecera)."""
+        if group is None:
+            return cls()
+        return cls(port=WEBHOOK_PORT + group, path_prefix=f"/g{group}")
+
+    @property
+    def enabled(self):
+        return bool(self.public_url)
+
+    def path_for(self, token):
+        return self.path_prefix + webhook_path(token)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Servidor de webhooks escuchando en {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            # Server.close() no corta las conexiones keep-alive ya abiertas
+            connections = list(self._connections)
+            for task in connections:
+                task.cancel()
+            await asyncio.gather(*connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def register(self, application):
+        """
+        Registra el bot en el servidor y en Telegram (set_webhook).
+        Devuelve False si Telegram rechaza el webhook, para recurrir al polling.
+        """
+        token = application.bot.token
+        path = self.path_for(token)
+        secret = webhook_secret(token)
+        self._routes[path] = (application, secret)
+        try:
+            await application.bot.set_webhook(
+                url=f"{self.public_url}{path}",
+                secret_token=secret,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+        except Exception as e:
+            self._routes.pop(path, None)
+            logger.warning(f"No se pudo registrar el webhook del bot {token[:10]}: {e}")
+            return False
+        logger.info(f"Webhook registrado para bot {token[:10]} en {path}")
+        return True
+
+    def unregister(self, application):
+        self._routes.pop(self.path_for(application.bot.token), None)
+
+    @staticmethod
+    def pending_updates(application):
+        """
+        Updates aceptados por un bot y aún sin terminar. Con concurrent_updates
+        PTB vacía la update_queue al momento y crea una tarea por update, así
+        que el backlog real está en el procesador (PerUserUpdateProcessor.backlog).
+        """
+        pending = application.update_queue.qsize()
+        backlog = getattr(application.update_processor, 'backlog', None)
+        return pending + backlog if backlog is not None else pending
+
+    def get_stats(self):
+        """Contadores del servidor y, por bot, la cola y espera de su procesador de updates."""
+        updates = {}
+        for application, _ in self._routes.values():
+            processor = application.update_processor
+            if hasattr(processor, 'get_stats'):
+                updates[application.bot.token[:10]] = processor.get_stats()
+        return dict(self._stats, bots=len(self._routes), updates=updates)
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), _IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # stop() cierra las conexiones abiertas; la tarea termina sin error
+            pass
+        except Exception as e:
+            logger.error(f"Error atendiendo petición de webhook: {e}")
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (Exception, asyncio.CancelledError):
+                pass
+
+    async def _handle_request(self, request_line, reader, writer):
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            await self._respond(writer, 400, keep_alive=False)
+            return False
+        method, path, version = parts
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= _MAX_HEADERS:
+                await self._respond(writer, 400, keep_alive=False)
+                return False
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            await self._respond(writer, 400, keep_alive=False)
+            return False
+        if length > _MAX_BODY_BYTES:
+            self._stats['bad_request'] += 1
+            await self._respond(writer, 413, keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b''
+
+        if method == 'GET' and path == '/healthz':
+            await self._respond(writer, 200, json.dumps(self.get_stats()).encode(), keep_alive)
+            return keep_alive
+
+        route = self._routes.get(path)
+        if route is None:
+            self._stats['not_found'] += 1
+            await self._respond(writer, 404, keep_alive=keep_alive)
+            return keep_alive
+        if method != 'POST':
+            await self._respond(writer, 405, keep_alive=keep_alive)
+            return keep_alive
+
+        application, secret = route
+        received = headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(received.encode(), secret.encode()):
+            self._stats['forbidden'] += 1
+            await self._respond(writer, 403, keep_alive=keep_alive)
+            return keep_alive
+
+        # Contrapresión: Telegram reintenta los updates rechazados con 503
+        if self.pending_updates(application) >= self.max_queue:
+            self._stats['busy'] += 1
+            await self._respond(writer, 503, keep_alive=keep_alive, extra_headers={'Retry-After': '1'})
+            return keep_alive
+
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+        except Exception:
+            self._stats['bad_request'] += 1
+            await self._respond(writer, 400, keep_alive=keep_alive)
+            return keep_alive
+
+        await application.update_queue.put(update)
+        self._stats['accepted'] += 1
+        await self._respond(writer, 200, keep_alive=keep_alive)
+        return keep_alive
+
+    @staticmethod
+    async def _respond(writer, status, body=b'', keep_alive=True, extra_headers=None):
+        headers = {
+            'Content-Length': str(len(body)),
+            'Connection': 'keep-alive' if keep_alive else 'close',
+        }
+        if body:
+            headers['Content-Type'] = 'application/json'
+        headers.update(extra_headers or {})
+        head = f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in headers.items()
+        )
+        writer.write(head.encode('latin-1') + b"\r\n" + body)
+        await writer.drain()